@@ -0,0 +1,7 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Benchmarks package: scripts to run with ``python -m benchmarks.<name>``
+
+:license: Apache License 2.0
+"""
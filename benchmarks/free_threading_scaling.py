@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Measures how the throughput of the dispatcher and of the ThreadPool scales
+with the number of threads. On a free-threaded build of CPython (3.13t+),
+run with the GIL disabled, the throughput should grow with the number of
+threads up to the number of cores.
+
+Usage: python -m benchmarks.free_threading_scaling [nb_calls] [max_threads]
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import json
+import sys
+import threading
+import time
+
+# JSON-RPC library
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher
+from jsonrpclib.threadpool import ThreadPool
+
+# ------------------------------------------------------------------------------
+
+
+def compute(count):
+    """
+    The benchmarked method: a small CPU-bound computation
+    """
+    return sum(value * value for value in range(count))
+
+
+def gil_status():
+    """
+    Describes the state of the GIL in this interpreter
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    if is_gil_enabled is None:
+        return "GIL build"
+    elif is_gil_enabled():
+        return "free-threaded build, GIL enabled"
+    return "free-threaded build, GIL disabled"
+
+
+def bench_dispatcher(nb_threads, nb_calls):
+    """
+    Dispatches requests from concurrent threads, with metrics enabled, as a
+    pooled server would
+
+    :return: The number of requests per second
+    """
+    dispatcher = SimpleJSONRPCDispatcher()
+    dispatcher.register_function(compute)
+    dispatcher.enable_metrics()
+
+    per_thread = nb_calls // nb_threads
+    barrier = threading.Event()
+
+    def worker():
+        # Mix JSON-RPC 2.0 and 1.0 requests
+        request = {"method": "compute", "params": [50], "id": 1}
+        requests = [
+            json.dumps(dict(request, jsonrpc="2.0")),
+            json.dumps(request),
+        ]
+        barrier.wait()
+        for idx in range(per_thread):
+            dispatcher._marshaled_dispatch(requests[idx % 2])
+
+    threads = [threading.Thread(target=worker) for _ in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+
+    start = time.time()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    return per_thread * nb_threads / (time.time() - start)
+
+
+def bench_pool(nb_threads, nb_calls):
+    """
+    Executes CPU-bound tasks in a ThreadPool
+
+    :return: The number of tasks per second
+    """
+    pool = ThreadPool(nb_threads, nb_threads)
+    pool.start()
+    try:
+        start = time.time()
+        for _ in range(nb_calls):
+            pool.enqueue(compute, 50)
+        pool.join()
+        return nb_calls / (time.time() - start)
+    finally:
+        pool.stop()
+
+
+def main(argv):
+    """
+    Entry point
+    """
+    nb_calls = int(argv[0]) if argv else 50000
+    max_threads = int(argv[1]) if len(argv) > 1 else 16
+
+    thread_counts = []
+    nb_threads = 1
+    while nb_threads <= max_threads:
+        thread_counts.append(nb_threads)
+        nb_threads *= 2
+
+    print("Python {0} ({1})".format(sys.version.split()[0], gil_status()))
+    print(
+        "threads  dispatcher (req/s)  speedup  "
+        "ThreadPool (tasks/s)  speedup"
+    )
+    base_dispatcher = base_pool = None
+    for nb_threads in thread_counts:
+        dispatcher_rate = bench_dispatcher(nb_threads, nb_calls)
+        pool_rate = bench_pool(nb_threads, nb_calls)
+        if base_dispatcher is None:
+            base_dispatcher, base_pool = dispatcher_rate, pool_rate
+
+        print(
+            "{0:7d}  {1:18.0f}  {2:6.2f}x  {3:20.0f}  {4:6.2f}x".format(
+                nb_threads,
+                dispatcher_rate,
+                dispatcher_rate / base_dispatcher,
+                pool_rate,
+                pool_rate / base_pool,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
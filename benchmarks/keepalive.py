@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Compares the number of requests per second handled by a PooledJSONRPCServer
+with and without HTTP keep-alive.
+
+Usage: python -m benchmarks.keepalive [nb_clients] [nb_calls]
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import sys
+import threading
+import time
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy
+from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer
+
+# ------------------------------------------------------------------------------
+
+
+def run_clients(port, nb_clients, nb_calls):
+    """
+    Runs the given number of client threads, each with its own proxy
+
+    :return: The number of requests per second
+    """
+
+    def client_loop():
+        proxy = ServerProxy("http://localhost:{0}".format(port))
+        for idx in range(nb_calls):
+            proxy.add(idx, 1)
+        proxy("close")()
+
+    threads = [threading.Thread(target=client_loop) for _ in range(nb_clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return (nb_clients * nb_calls) / (time.time() - start)
+
+
+def bench(keep_alive, nb_clients, nb_calls):
+    """
+    Runs the benchmark against a new server
+
+    :param keep_alive: Server keep-alive flag
+    :return: The number of requests per second
+    """
+    server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+    server.keep_alive = keep_alive
+    server.register_function(lambda a, b: a + b, "add")
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        return run_clients(server.server_address[1], nb_clients, nb_calls)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main(argv):
+    """
+    Entry point
+    """
+    nb_clients = int(argv[0]) if argv else 4
+    nb_calls = int(argv[1]) if len(argv) > 1 else 1000
+
+    for keep_alive in (False, True):
+        print(
+            "keep-alive={0!s:5}: {1:8.0f} req/s".format(
+                keep_alive, bench(keep_alive, nb_clients, nb_calls)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
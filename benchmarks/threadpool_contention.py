@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Measures the number of tasks per second a ThreadPool accepts and executes
+when 1 to 64 producer threads submit tasks concurrently, compared to the
+concurrent.futures ThreadPoolExecutor.
+
+Usage: python -m benchmarks.threadpool_contention [nb_tasks] [max_threads]
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import sys
+import threading
+import time
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2
+    ThreadPoolExecutor = None  # type: ignore
+
+# JSON-RPC library
+from jsonrpclib.threadpool import ThreadPool
+
+# ------------------------------------------------------------------------------
+
+PRODUCERS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def noop():
+    """
+    The benchmarked task
+    """
+
+
+def run_producers(submit, nb_producers, nb_tasks):
+    """
+    Submits tasks from concurrent producer threads, discarding the futures
+
+    :param submit: Method submitting a task
+    :param nb_producers: Number of producer threads
+    :param nb_tasks: Total number of tasks to submit
+    :return: The time spent submitting the tasks (in seconds)
+    """
+    per_producer = nb_tasks // nb_producers
+    barrier = threading.Event()
+
+    def producer():
+        barrier.wait()
+        for _ in range(per_producer):
+            submit(noop)
+
+    threads = [threading.Thread(target=producer) for _ in range(nb_producers)]
+    for thread in threads:
+        thread.start()
+
+    start = time.time()
+    barrier.set()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def bench_pool(nb_producers, nb_tasks, max_threads):
+    """
+    Benchmarks the jsonrpclib ThreadPool
+
+    :return: The number of tasks per second
+    """
+    pool = ThreadPool(max_threads, max_threads)
+    pool.start()
+    try:
+        start = time.time()
+        run_producers(pool.enqueue, nb_producers, nb_tasks)
+        pool.join()
+        return nb_tasks / (time.time() - start)
+    finally:
+        pool.stop()
+
+
+def bench_executor(nb_producers, nb_tasks, max_threads):
+    """
+    Benchmarks the concurrent.futures ThreadPoolExecutor
+
+    :return: The number of tasks per second
+    """
+    executor = ThreadPoolExecutor(max_threads)
+    try:
+        start = time.time()
+        run_producers(executor.submit, nb_producers, nb_tasks)
+        executor.shutdown(wait=True)
+        return nb_tasks / (time.time() - start)
+    finally:
+        executor.shutdown(wait=True)
+
+
+def main(argv):
+    """
+    Entry point
+    """
+    nb_tasks = int(argv[0]) if argv else 100000
+    max_threads = int(argv[1]) if len(argv) > 1 else 8
+
+    print("producers  ThreadPool (tasks/s)  ThreadPoolExecutor (tasks/s)")
+    for nb_producers in PRODUCERS:
+        pool_rate = bench_pool(nb_producers, nb_tasks, max_threads)
+        if ThreadPoolExecutor is not None:
+            executor_rate = "{0:28.0f}".format(
+                bench_executor(nb_producers, nb_tasks, max_threads)
+            )
+        else:
+            executor_rate = "{0:>28}".format("-")
+
+        print(
+            "{0:9d}  {1:20.0f}  {2}".format(
+                nb_producers, pool_rate, executor_rate
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -30,9 +30,16 @@ CGI request handler.
 from __future__ import print_function
 
 # Standard library
+import collections
+import functools
+import json
 import logging
+import re
+import select
 import socket
 import sys
+import threading
+import time
 import traceback
 
 try:
@@ -57,6 +64,27 @@ except (ImportError, AttributeError):
     resolve_dotted_attribute = xmlrpcserver.resolve_dotted_attribute  # type: ignore  # noqa: E501  # pylint: disable=invalid-name,line-too-long
     import SocketServer as socketserver  # type: ignore
 
+try:
+    # Python 3
+    import queue  # pylint: disable=F0401
+except ImportError:
+    # Python 2
+    import Queue as queue  # type: ignore # pylint: disable=F0401
+
+try:
+    # Python 3.3+
+    from inspect import Parameter, signature
+except ImportError:
+    # Python 2: parameters can't be checked before the call
+    Parameter = signature = None  # type: ignore
+
+try:
+    # Python 3.2+
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    # Python 2
+    ProcessPoolExecutor = None  # type: ignore
+
 try:
     # Windows
     import fcntl
@@ -74,9 +102,131 @@ except AttributeError:
 
 # Local modules
 import jsonrpclib.config
+import jsonrpclib.jsonclass as jsonclass
+import jsonrpclib.metrics
 import jsonrpclib.threadpool
 import jsonrpclib.utils as utils
 from jsonrpclib import Fault
+from jsonrpclib.jsonrpc import Payload
+
+# ------------------------------------------------------------------------------
+
+try:
+    # Python 3.3+
+    _clock = time.monotonic
+except AttributeError:
+    # Python 2
+    _clock = time.time
+
+# Fault code returned when the concurrency limit of a method is reached
+BUSY_FAULT_CODE = -32001
+
+# Priority of the classification of requests in the request pool
+_CLASSIFY_PRIORITY = float("-inf")
+
+# Finds the (first) method name in the beginning of a request body
+_METHOD_PATTERN = re.compile(br'"method"\s*:\s*"([^"\\]+)"')
+
+
+def _find_method(data):
+    """
+    Looks for the name of the called method in a raw request body, without
+    parsing it
+
+    :param data: The request body
+    :return: The method name, "(batch)" for a batch, or None
+    """
+    if data.lstrip()[:1] == b"[":
+        return jsonrpclib.metrics.LABEL_BATCH
+
+    match = _METHOD_PATTERN.search(data)
+    if match is None:
+        return None
+
+    try:
+        return utils.from_bytes(bytes(match.group(1)))
+    except UnicodeError:
+        return None
+
+
+def _find_header(data, name):
+    """
+    Looks for a header in the beginning of a raw HTTP request
+
+    :param data: The beginning of the raw HTTP request
+    :param name: Name of the header
+    :return: The raw value of the header, or None if not found
+    """
+    headers = data.partition(b"\r\n\r\n")[0]
+    match = re.search(
+        b"^" + re.escape(utils.to_bytes(name)) + b"[ \t]*:[ \t]*([^\r\n]*)",
+        headers,
+        re.IGNORECASE | re.MULTILINE,
+    )
+    if match is None:
+        return None
+    return match.group(1).strip()
+
+
+def _enqueue(pool, priority, task, *args):
+    """
+    Queues a task in a ThreadPool or in a concurrent.futures Executor
+
+    :param pool: A ThreadPool or a concurrent.futures Executor
+    :param priority: Priority of the task, ignored if the pool doesn't
+                     support priorities
+    :param task: Method to execute in the pool
+    :return: The future of the task
+    """
+    if priority:
+        enqueue_priority = getattr(pool, "enqueue_priority", None)
+        if enqueue_priority is not None:
+            return enqueue_priority(priority, task, *args)
+
+    try:
+        # concurrent.futures
+        submit = pool.submit
+    except AttributeError:
+        # jsonrpclib thread pool
+        submit = pool.enqueue
+    return submit(task, *args)
+
+
+def _is_process_pool(pool):
+    """
+    Checks if the given pool executes its tasks in other processes
+
+    :param pool: A ThreadPool or a concurrent.futures Executor
+    """
+    return ProcessPoolExecutor is not None and isinstance(
+        pool, ProcessPoolExecutor
+    )
+
+
+def _call_function(function, params):
+    """
+    Calls a function with JSON-RPC parameters. Used to execute methods in
+    other processes: the function and the parameters must be picklable.
+
+    :param function: The function to call
+    :param params: A list or a dictionary of parameters
+    :return: The result of the function
+    """
+    if isinstance(params, utils.DictType):
+        return function(**params)
+    return function(*params)
+
+
+def _log_notification_error(future):
+    """
+    Logs the error raised by a notification executed in another process
+
+    :param future: The concurrent.futures Future of the notification
+    """
+    exception = future.exception()
+    if exception is not None:
+        _logger.error("Error executing a notification: %s", exception)
+
 
 # ------------------------------------------------------------------------------
 
@@ -177,6 +327,412 @@ class NoMulticallResult(Exception):
     """
 
 
+class Bulkhead(object):
+    """
+    Limits the number of concurrent calls to a method
+    """
+
+    def __init__(self, limit, timeout=0):
+        """
+        :param limit: Maximum number of concurrent calls
+        :param timeout: Maximum time to wait for a slot (in seconds)
+        :raise ValueError: Invalid limit or timeout
+        """
+        self.limit = 1
+        self.timeout = 0
+        self.__condition = threading.Condition()
+        self.__in_flight = 0
+        self.__waiting = 0
+        self.__rejected = 0
+        self.update(limit, timeout)
+
+    def update(self, limit, timeout=0):
+        """
+        Changes the limit, keeping track of the calls being executed
+
+        :param limit: Maximum number of concurrent calls
+        :param timeout: Maximum time to wait for a slot (in seconds)
+        :raise ValueError: Invalid limit or timeout
+        """
+        try:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError("Limit must be greater than 0")
+
+            timeout = float(timeout or 0)
+            if timeout < 0:
+                raise ValueError("Timeout must be positive")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid concurrency limit: {0}".format(ex))
+
+        with self.__condition:
+            self.limit = limit
+            self.timeout = timeout
+            self.__condition.notify_all()
+
+    def acquire(self):
+        """
+        Waits for a slot, up to the timeout
+
+        :return: True if a slot has been acquired, else False
+        """
+        with self.__condition:
+            if self.__in_flight >= self.limit:
+                if not self.timeout:
+                    self.__rejected += 1
+                    return False
+
+                deadline = _clock() + self.timeout
+                self.__waiting += 1
+                try:
+                    while self.__in_flight >= self.limit:
+                        remaining = deadline - _clock()
+                        if remaining <= 0:
+                            self.__rejected += 1
+                            return False
+                        self.__condition.wait(remaining)
+                finally:
+                    self.__waiting -= 1
+
+            self.__in_flight += 1
+            return True
+
+    def release(self):
+        """
+        Releases a slot
+        """
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify()
+
+    def get_stats(self):
+        """
+        Returns the state of the limit
+
+        :return: A dictionary with the limit (``limit``), the number of calls
+                 being executed (``in_flight``) and waiting for a slot
+                 (``waiting``), and the number of rejected calls
+                 (``rejected``)
+        """
+        with self.__condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.__in_flight,
+                "waiting": self.__waiting,
+                "rejected": self.__rejected,
+            }
+
+
+class ResultCache(object):
+    """
+    Cache of the results of a method, with a time to live and a maximum
+    number of entries (least recently used entries are evicted first).
+
+    In ``serialize`` mode, the JSON representation of the results is kept
+    too, so that cache hits skip the conversion of the result.
+    """
+
+    def __init__(self, ttl=None, max_size=128, serialize=False):
+        """
+        :param ttl: Time to live of the entries (in seconds, None for no
+                    expiration)
+        :param max_size: Maximum number of entries
+        :param serialize: If True, cache the JSON representation of results
+        :raise ValueError: Invalid TTL or size
+        """
+        try:
+            if ttl is not None:
+                ttl = float(ttl)
+                if ttl <= 0:
+                    raise ValueError("TTL must be greater than 0")
+
+            max_size = int(max_size)
+            if max_size < 1:
+                raise ValueError("Size must be greater than 0")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid cache parameters: {0}".format(ex))
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self.serialize = serialize
+
+        self.__lock = threading.Lock()
+        # Key -> (expiration time, value), in LRU order
+        self.__entries = collections.OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def get(self, key):
+        """
+        Looks for a cached value
+
+        :param key: Key of the entry
+        :return: A (found, value) tuple
+        """
+        with self.__lock:
+            try:
+                expiration, value = self.__entries.pop(key)
+            except KeyError:
+                self.__misses += 1
+                return False, None
+
+            if expiration is not None and expiration < _clock():
+                # Expired entry
+                self.__misses += 1
+                return False, None
+
+            # Put back the entry at the end of the LRU order
+            self.__entries[key] = (expiration, value)
+            self.__hits += 1
+            return True, value
+
+    def put(self, key, value):
+        """
+        Stores a value in the cache
+
+        :param key: Key of the entry
+        :param value: Value to store
+        """
+        if self.ttl is not None:
+            expiration = _clock() + self.ttl
+        else:
+            expiration = None
+
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (expiration, value)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def clear(self):
+        """
+        Removes all the entries of the cache
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def get_stats(self):
+        """
+        Returns the statistics of the cache
+
+        :return: A dictionary with the number of entries (``size``), hits
+                 (``hits``), misses (``misses``), evictions (``evictions``)
+                 and the hit rate (``hit_rate``, between 0 and 1)
+        """
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                "size": len(self.__entries),
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions,
+                "hit_rate": float(self.__hits) / lookups if lookups else 0.0,
+            }
+
+
+class _Flight(object):
+    """
+    A method call being executed, shared by identical concurrent calls
+    """
+
+    __slots__ = ("event", "result", "exception")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class _SerializedResponse(dict):
+    """
+    Response dictionary of a cached result, keeping the JSON representation
+    of that result to avoid converting it again
+    """
+
+    __slots__ = ("raw_result",)
+
+    def __init__(self, response, raw_result):
+        """
+        :param response: The response dictionary
+        :param raw_result: The JSON representation of the result
+        """
+        dict.__init__(self, response)
+        self.raw_result = raw_result
+
+    def dumps(self, encoding):
+        """
+        Returns the JSON representation of the response
+
+        :param encoding: Encoding of the JSON string
+        """
+        envelope = dict(self)
+        del envelope["result"]
+        text = jsonrpclib.jdumps(envelope, encoding).rstrip()
+        return text[:-1] + ', "result": ' + self.raw_result + "}"
+
+
+def _cache_key(params):
+    """
+    Computes the canonical representation of call parameters
+
+    :param params: Parameters of the call
+    :return: A string, or None if the parameters can't be represented
+    """
+    try:
+        return json.dumps(params, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+
+
+class MethodInvoker(object):
+    """
+    Calls a method after having checked that the given parameters match its
+    signature, so that a TypeError raised by the method itself is not taken
+    for invalid parameters.
+    """
+
+    __slots__ = (
+        "func",
+        "checked",
+        "_min_positional",
+        "_max_positional",
+        "_names",
+        "_required_names",
+        "_var_keyword",
+        "_positional_call",
+        "_keyword_call",
+    )
+
+    def __init__(self, func):
+        """
+        Computes the shape of the parameters accepted by the given method
+
+        :param func: The method to call
+        """
+        self.func = func
+        self.checked = False
+
+        if signature is None:
+            # Python 2
+            return
+
+        try:
+            sig = signature(func)
+        except (TypeError, ValueError):
+            # No signature available (some built-in methods)
+            return
+
+        self.checked = True
+        self._min_positional = 0
+        self._max_positional = 0
+        self._names = set()
+        self._required_names = set()
+        self._var_keyword = False
+        self._positional_call = True
+        self._keyword_call = True
+        var_positional = False
+
+        for param in sig.parameters.values():
+            required = param.default is Parameter.empty
+            if param.kind == Parameter.POSITIONAL_ONLY:
+                self._max_positional += 1
+                if required:
+                    self._min_positional += 1
+                    # Can't be given by name
+                    self._keyword_call = False
+            elif param.kind == Parameter.POSITIONAL_OR_KEYWORD:
+                self._max_positional += 1
+                self._names.add(param.name)
+                if required:
+                    self._min_positional += 1
+                    self._required_names.add(param.name)
+            elif param.kind == Parameter.VAR_POSITIONAL:
+                var_positional = True
+            elif param.kind == Parameter.KEYWORD_ONLY:
+                self._names.add(param.name)
+                if required:
+                    self._required_names.add(param.name)
+                    # Can't be given by position
+                    self._positional_call = False
+            elif param.kind == Parameter.VAR_KEYWORD:
+                self._var_keyword = True
+
+        if var_positional:
+            self._max_positional = None
+
+    def check(self, params):
+        """
+        Checks if the given parameters match the signature of the method
+
+        :param params: A list or a dictionary of parameters
+        :return: None if the parameters are valid, else an error message
+        """
+        if not self.checked:
+            # Can't tell
+            return None
+
+        if isinstance(params, utils.DictType):
+            if not self._keyword_call:
+                return "method doesn't accept keyword arguments"
+
+            missing = self._required_names.difference(params)
+            if missing:
+                return "missing arguments: {0}".format(
+                    ", ".join(sorted(missing))
+                )
+
+            if not self._var_keyword:
+                unknown = set(params).difference(self._names)
+                if unknown:
+                    return "unexpected arguments: {0}".format(
+                        ", ".join(sorted(str(name) for name in unknown))
+                    )
+        else:
+            if not self._positional_call:
+                return "method requires keyword arguments"
+
+            nb_params = len(params)
+            if nb_params < self._min_positional:
+                return "expected at least {0} arguments, got {1}".format(
+                    self._min_positional, nb_params
+                )
+
+            if self._max_positional is not None:
+                if nb_params > self._max_positional:
+                    return "expected at most {0} arguments, got {1}".format(
+                        self._max_positional, nb_params
+                    )
+
+        return None
+
+    def __call__(self, params):
+        """
+        Calls the method with the given parameters
+
+        :param params: A list or a dictionary of parameters
+        :return: The result of the method
+        """
+        if isinstance(params, utils.DictType):
+            return self.func(**params)
+        else:
+            return self.func(*params)
+
+
+def cpu_bound(function):
+    """
+    Decorator marking a function as CPU-bound: once registered, it is executed
+    in the CPU-bound pool of the dispatcher, if any (see
+    SimpleJSONRPCDispatcher.set_cpu_bound_pool())
+
+    :param function: A module-level function
+    :return: The function
+    """
+    function._jsonrpclib_cpu_bound = True
+    return function
+
+
 class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
     """
     Mix-in class that dispatches JSON-RPC requests.
@@ -196,269 +752,1842 @@ class SimpleJSONRPCDispatcher(SimpleXMLRPCDispatcher, object):
         )
         self.json_config = config
 
+        # JSON-RPC 1.0 variant of the configuration: (key, configuration)
+        self.__v1_config = (None, None)
+
         # Notification thread pool
         self.__notification_pool = None
 
-    def set_notification_pool(self, thread_pool):
-        """
-        Sets the thread pool to use to handle notifications
-        """
-        self.__notification_pool = thread_pool
+        # Batch entries execution pool
+        self.__batch_pool = None
+        self.__batch_max_parallel = None
 
-    def _unmarshaled_dispatch(self, request, dispatch_method=None):
-        """
-        Loads the request dictionary (unmarshaled), calls the method(s)
-        accordingly and returns a JSON-RPC dictionary (not marshaled)
+        # Pool executing the CPU-bound methods, and their names
+        self.__cpu_bound_pool = None
+        self.__cpu_bound = set()
 
-        :param request: JSON-RPC request dictionary (or list of)
-        :param dispatch_method: Custom dispatch method (for method resolution)
-        :return: A JSON-RPC dictionary (or an array of) or None if the request
-                 was a notification
-        :raise NoMulticallResult: No result in batch
-        """
-        if not request:
-            # Invalid request dictionary
-            fault = Fault(
-                -32600,
-                "Request invalid -- no request data.",
-                config=self.json_config,
-            )
-            _logger.warning("Invalid request: %s", fault)
-            return fault.dump()
+        # Method name -> ResultCache
+        self.__result_caches = {}
 
-        if isinstance(request, utils.ListType):
-            # This SHOULD be a batch, by spec
-            responses = []
-            for req_entry in request:
-                # Validate the request
-                result = validate_request(req_entry, self.json_config)
-                if isinstance(result, Fault):
-                    responses.append(result.dump())
-                    continue
+        # Method name -> vectorized implementation
+        self.__vectorized = {}
 
-                # Call the method
-                resp_entry = self._marshaled_single_dispatch(
-                    req_entry, dispatch_method
-                )
+        # Metrics registry (None if disabled)
+        self.metrics = None
 
-                # Store its result
-                if isinstance(resp_entry, Fault):
-                    # pylint: disable=E1103
-                    responses.append(resp_entry.dump())
-                elif resp_entry is not None:
-                    responses.append(resp_entry)
+        # Request profiler (None if not set)
+        self.profiler = None
 
-            if not responses:
-                # No non-None result
-                _logger.error("No result in Multicall")
-                raise NoMulticallResult("No result")
+        # Method name -> MicroBatcher (copy-on-write)
+        self.__bulk_consumers = {}
 
-            return responses
+        # Single-flight methods, calls being executed and coalesced calls
+        self.__single_flight = {}
+        self.__flights = {}
+        self.__flights_lock = threading.Lock()
 
-        else:
-            # Single call
-            result = validate_request(request, self.json_config)
-            if isinstance(result, Fault):
-                return result.dump()
+        # Method name or namespace ("name.*") -> Bulkhead
+        self.__bulkheads = {}
 
-            # Call the method
-            response = self._marshaled_single_dispatch(request, dispatch_method)
-            if isinstance(response, Fault):
-                # pylint: disable=E1103
-                return response.dump()
+        # Method name -> priority of its execution in the pools
+        self.__method_priorities = {}
 
-            return response
+        # Method name -> MethodInvoker, for the registered functions
+        self.__invokers = {}
+        # Invalidation counter, to avoid caching methods resolved while the
+        # cache was being cleared
+        self.__invokers_generation = 0
+        self.__invokers_lock = threading.Lock()
 
-    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+    def register_instance(self, instance, allow_dotted_names=False):
         """
-        Parses the request data (marshaled), calls method(s) and returns a
-        JSON string (marshaled)
+        Registers an instance to respond to JSON-RPC requests.
 
-        :param data: A JSON request string
-        :param dispatch_method: Custom dispatch method (for method resolution)
-        :param path: Unused parameter, to keep compatibility with xmlrpclib
-        :return: A JSON-RPC response string (marshaled)
+        See SimpleXMLRPCDispatcher.register_instance()
         """
-        # Parse the request
-        try:
-            request = jsonrpclib.loads(data, self.json_config)
-        except Exception as ex:
-            # Parsing/loading error
-            fault = Fault(
-                -32700,
-                "Request {0} invalid. ({1}:{2})".format(
-                    data, type(ex).__name__, ex
-                ),
-                config=self.json_config,
+        SimpleXMLRPCDispatcher.register_instance(
+            self, instance, allow_dotted_names
+        )
+        self.clear_methods_cache()
+
+    def register_function(
+        self,
+        function=None,
+        name=None,
+        cache=None,
+        vectorized=None,
+        cpu_bound=None,
+    ):
+        """
+        Registers a function to respond to JSON-RPC requests.
+        Can be used as a decorator if the function is not given.
+
+        See SimpleXMLRPCDispatcher.register_function()
+
+        :param function: The function to register
+        :param name: Name of the method (name of the function by default)
+        :param cache: A ResultCache to store the results of the function, if
+                      they only depend on its parameters
+        :param vectorized: A function handling the calls to the method of a
+                           batch at once: it is given the list of their
+                           parameters and must return the list of their
+                           results (or Fault objects), in the same order
+        :param cpu_bound: If True, the function is executed in the CPU-bound
+                          pool (see set_cpu_bound_pool()). By default, True
+                          if the function has been decorated with
+                          cpu_bound().
+        """
+        if function is None:
+            # Decorator
+            return functools.partial(
+                self.register_function,
+                name=name,
+                cache=cache,
+                vectorized=vectorized,
+                cpu_bound=cpu_bound,
             )
-            _logger.warning("Error parsing request: %s", fault)
-            return fault.response()
 
-        # Get the response dictionary
-        try:
-            response = self._unmarshaled_dispatch(request, dispatch_method)
-            if response is not None:
-                # Compute the string representation of the dictionary/list
-                return jsonrpclib.jdumps(response, self.encoding)
-            else:
-                # No result (notification)
-                return ""
-        except NoMulticallResult:
-            # Return an empty string (jsonrpclib internal behaviour)
-            return ""
+        if name is None:
+            name = function.__name__
 
-    def _marshaled_single_dispatch(self, request, dispatch_method=None):
-        """
-        Dispatches a single method call
+        result = SimpleXMLRPCDispatcher.register_function(self, function, name)
+        if cache is not None:
+            self.__result_caches[name] = cache
+        else:
+            self.__result_caches.pop(name, None)
 
-        :param request: A validated request dictionary
-        :param dispatch_method: Custom dispatch method (for method resolution)
-        :return: A JSON-RPC response dictionary, or None if it was a
-                 notification request
-        """
-        method = request.get("method")
-        params = request.get("params")
+        if vectorized is not None:
+            self.__vectorized[name] = vectorized
+        else:
+            self.__vectorized.pop(name, None)
 
-        # Prepare a request-specific configuration
-        if "jsonrpc" not in request and self.json_config.version >= 2:
-            # JSON-RPC 1.0 request on a JSON-RPC 2.0
-            # => compatibility needed
-            config = self.json_config.copy()
-            config.version = 1.0
+        if cpu_bound is None:
+            cpu_bound = getattr(function, "_jsonrpclib_cpu_bound", False)
+
+        if cpu_bound:
+            self.__cpu_bound.add(name)
         else:
-            # Keep server configuration as is
-            config = self.json_config
+            self.__cpu_bound.discard(name)
 
-        # Test if this is a notification request
-        is_notification = "id" not in request or request["id"] in (None, "")
-        if is_notification and self.__notification_pool is not None:
-            # Use the thread pool for notifications
-            if dispatch_method is not None:
-                self.__notification_pool.enqueue(
-                    dispatch_method, method, params
+        self.clear_methods_cache()
+        return result
+
+    def register_bulk_consumer(
+        self,
+        function=None,
+        name=None,
+        max_size=100,
+        max_delay=0.1,
+        queue_size=1000,
+        overflow=jsonrpclib.threadpool.OVERFLOW_BLOCK,
+    ):
+        """
+        Registers a function receiving the notifications of a method by
+        batches: it is called from a dedicated thread with the list of the
+        parameters of the queued notifications.
+        Can be used as a decorator if the function is not given.
+
+        See jsonrpclib.threadpool.MicroBatcher for the batch parameters.
+
+        :param function: The function consuming the batches
+        :param name: Name of the method (name of the function by default)
+        :param max_size: Maximum number of notifications in a batch
+        :param max_delay: Maximum time a notification waits for its batch
+                          to be delivered (in seconds)
+        :param queue_size: Maximum number of queued notifications
+        :param overflow: Policy to apply when the queue is full (block,
+                         drop-oldest or drop-new)
+        :return: The function
+        :raise ValueError: Invalid batch parameters
+        """
+        if function is None:
+            # Decorator
+            return functools.partial(
+                self.register_bulk_consumer,
+                name=name,
+                max_size=max_size,
+                max_delay=max_delay,
+                queue_size=queue_size,
+                overflow=overflow,
+            )
+
+        if name is None:
+            name = function.__name__
+
+        batcher = jsonrpclib.threadpool.MicroBatcher(
+            function,
+            max_size,
+            max_delay,
+            queue_size,
+            overflow,
+            logname="{0}.{1}".format(__name__, name),
+        )
+
+        consumers = self.__bulk_consumers.copy()
+        previous = consumers.pop(name, None)
+        consumers[name] = batcher
+        self.__bulk_consumers = consumers
+
+        if previous is not None:
+            previous.stop()
+        return function
+
+    def stop_bulk_consumers(self, flush=True):
+        """
+        Stops the delivery threads of the bulk consumers
+
+        :param flush: If True, deliver the queued notifications before
+                      returning, else drop them
+        """
+        for batcher in self.__bulk_consumers.values():
+            batcher.stop(flush)
+
+    def get_bulk_stats(self):
+        """
+        Returns the statistics of the bulk consumers
+
+        :return: A method name -> statistics dictionary (see
+                 MicroBatcher.get_stats())
+        """
+        return dict(
+            (name, batcher.get_stats())
+            for name, batcher in self.__bulk_consumers.items()
+        )
+
+    def get_cache_stats(self):
+        """
+        Returns the statistics of the results caches
+
+        :return: A method name -> cache statistics dictionary (see
+                 ResultCache.get_stats())
+        """
+        return dict(
+            (name, cache.get_stats())
+            for name, cache in self.__result_caches.items()
+        )
+
+    def register_introspection_functions(self):
+        """
+        Registers the introspection methods in the system namespace.
+
+        See SimpleXMLRPCDispatcher.register_introspection_functions()
+        """
+        SimpleXMLRPCDispatcher.register_introspection_functions(self)
+        self.clear_methods_cache()
+
+    def register_multicall_functions(self):
+        """
+        Registers the multicall method in the system namespace.
+
+        See SimpleXMLRPCDispatcher.register_multicall_functions()
+        """
+        SimpleXMLRPCDispatcher.register_multicall_functions(self)
+        self.clear_methods_cache()
+
+    def clear_methods_cache(self):
+        """
+        Clears the cache of resolved methods.
+
+        This is done automatically when registering a function or an instance,
+        but must be called after a direct modification of the ``funcs``
+        dictionary.
+        """
+        with self.__invokers_lock:
+            self.__invokers_generation += 1
+            self.__invokers = {}
+
+    def _get_invoker(self, method):
+        """
+        Returns the invoker of the given method. Invokers of the registered
+        functions are cached; methods of the registered instance are resolved
+        on each call.
+
+        :param method: Name of the method to call
+        :return: A MethodInvoker object, or None if the method is unknown or
+                 must be resolved by the ``_dispatch`` method of the
+                 registered instance
+        """
+        try:
+            return self.__invokers[method]
+        except KeyError:
+            pass
+
+        generation = self.__invokers_generation
+        try:
+            # Look into registered methods
+            func = self.funcs[method]
+        except KeyError:
+            if self.instance is None or hasattr(self.instance, "_dispatch"):
+                # Nothing to resolve
+                return None
+
+            try:
+                # Resolve the method name in the instance. Not cached, as the
+                # attributes of the instance can change at any time
+                func = resolve_dotted_attribute(self.instance, method, True)
+            except AttributeError:
+                # Unknown method
+                return None
+
+            return MethodInvoker(func)
+
+        invoker = MethodInvoker(func)
+        with self.__invokers_lock:
+            if generation == self.__invokers_generation:
+                # The cache hasn't been cleared during the resolution
+                self.__invokers[method] = invoker
+        return invoker
+
+    def after_fork(self):
+        """
+        Resets the thread pools of the dispatcher in a child process, forked
+        while they were running. Pools without an ``after_fork()`` method
+        (executors) must be replaced by the caller.
+        """
+        for pool in (self.__notification_pool, self.__batch_pool):
+            reset = getattr(pool, "after_fork", None)
+            if reset is not None:
+                reset()
+
+        for batcher in self.__bulk_consumers.values():
+            batcher.after_fork()
+
+    def set_method_limit(self, name, limit, timeout=0):
+        """
+        Limits the number of concurrent calls to a method, or to all the
+        methods of a namespace, to avoid a slow method to use all the threads
+        of the server.
+
+        Calls over the limit wait up to the given timeout for a slot, then
+        get a fault with the BUSY_FAULT_CODE code.
+
+        :param name: Name of the method, or namespace followed by ``.*``
+                     (e.g. ``export.*``)
+        :param limit: Maximum number of concurrent calls (None to remove the
+                      limit)
+        :param timeout: Maximum time to wait for a slot (in seconds, 0 to
+                        fail immediately)
+        :raise ValueError: Invalid limit or timeout
+        """
+        bulkheads = self.__bulkheads.copy()
+        if limit is None:
+            bulkheads.pop(name, None)
+        elif name in bulkheads:
+            bulkheads[name].update(limit, timeout)
+            return
+        else:
+            bulkheads[name] = Bulkhead(limit, timeout)
+
+        # Replace the dictionary, to avoid locking while dispatching
+        self.__bulkheads = bulkheads
+
+    def get_method_limits(self):
+        """
+        Returns the state of the concurrency limits
+
+        :return: A name -> state dictionary, with the limit (``limit``), the
+                 number of calls being executed (``in_flight``) and waiting
+                 for a slot (``waiting``), and the number of rejected calls
+                 (``rejected``)
+        """
+        return dict(
+            (name, bulkhead.get_stats())
+            for name, bulkhead in self.__bulkheads.items()
+        )
+
+    def _get_bulkhead(self, method):
+        """
+        Returns the concurrency limit applying to the given method: its own
+        or the one of its closest namespace
+
+        :param method: Name of the method
+        :return: A Bulkhead object or None
+        """
+        bulkheads = self.__bulkheads
+        if not bulkheads:
+            return None
+
+        try:
+            return bulkheads[method]
+        except KeyError:
+            pass
+
+        namespace = method
+        while "." in namespace:
+            namespace = namespace.rsplit(".", 1)[0]
+            bulkhead = bulkheads.get(namespace + ".*")
+            if bulkhead is not None:
+                return bulkhead
+
+        return None
+
+    def set_method_priority(self, method, priority):
+        """
+        Sets the priority of the execution of a method in the thread pools
+        (notifications, batch entries and, in PooledJSONRPCServer, requests).
+        Tasks with the lowest priority value are executed first; the default
+        priority is 0.
+
+        :param method: Name of the method
+        :param priority: Priority of the method (None to reset it)
+        :raise ValueError: Invalid priority
+        """
+        if priority is None:
+            self.__method_priorities.pop(method, None)
+            return
+
+        try:
+            self.__method_priorities[method] = int(priority)
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid priority: {0}".format(ex))
+
+    def get_method_priority(self, method):
+        """
+        Returns the priority of the execution of the given method
+
+        :param method: Name of the method
+        :return: The priority of the method (0 by default)
+        """
+        return self.__method_priorities.get(method, 0)
+
+    def set_single_flight(self, method, enabled=True):
+        """
+        Enables or disables the coalescing of identical concurrent calls to
+        a method: calls with the same parameters as a call being executed
+        wait for it and get its result instead of executing the method.
+
+        :param method: Name of the method
+        :param enabled: True to coalesce calls to the method
+        """
+        with self.__flights_lock:
+            if enabled:
+                self.__single_flight.setdefault(method, 0)
+            else:
+                self.__single_flight.pop(method, None)
+
+    def get_single_flight_stats(self):
+        """
+        Returns the number of calls which have been coalesced with an
+        identical call being executed, for each single-flight method
+
+        :return: A method name -> number of coalesced calls dictionary
+        """
+        with self.__flights_lock:
+            return dict(self.__single_flight)
+
+    def __call_once(self, key, method, params, config, dispatch_method):
+        """
+        Executes a method call, or waits for the identical call being
+        executed
+
+        :param key: Key of the call: method name and canonical parameters
+        :return: The result of the method
+        :raise Exception: Error raised by the method
+        """
+        with self.__flights_lock:
+            flight = self.__flights.get(key)
+            if flight is None:
+                flight = self.__flights[key] = _Flight()
+                leader = True
+            else:
+                if method in self.__single_flight:
+                    self.__single_flight[method] += 1
+                leader = False
+
+        if not leader:
+            flight.event.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return flight.result
+
+        try:
+            flight.result = self.__call(
+                method, params, config, dispatch_method
+            )
+            return flight.result
+        except Exception as ex:
+            flight.exception = ex
+            raise
+        finally:
+            with self.__flights_lock:
+                del self.__flights[key]
+            flight.event.set()
+
+    def __call(self, method, params, config, dispatch_method):
+        """
+        Executes a method call
+
+        :param method: Name of the method
+        :param params: Parameters of the call
+        :param config: Request-specific configuration
+        :param dispatch_method: Custom dispatch method
+        :return: The result of the method
+        """
+        if dispatch_method is not None:
+            return dispatch_method(method, params)
+        return self._dispatch(method, params, config)
+
+    def _has_method_priorities(self):
+        """
+        Checks if method priorities have been set
+        """
+        return bool(self.__method_priorities)
+
+    def _submit(self, pool, method, task, *args):
+        """
+        Queues a task in the given pool, with the priority of the JSON-RPC
+        method it executes if the pool supports priorities
+
+        :param pool: A ThreadPool or a concurrent.futures Executor
+        :param method: Name of the JSON-RPC method
+        :param task: Method to execute in the pool
+        :return: The future of the task
+        """
+        return _enqueue(
+            pool, self.__method_priorities.get(method), task, *args
+        )
+
+    def set_notification_pool(self, thread_pool):
+        """
+        Sets the pool to use to handle notifications.
+
+        With a ProcessPoolExecutor, the function of the notified method is
+        called in another process: the registered functions and the
+        parameters of the notifications must be picklable. Notifications
+        which can't be resolved to a registered function, or whose
+        parameters don't match it, are handled in the current thread. The
+        errors of the notifications sent to other processes, including
+        pickling errors, are logged.
+
+        :param thread_pool: A ThreadPool, a concurrent.futures Executor or
+                            None to handle notifications in the request
+                            thread
+        """
+        self.__notification_pool = thread_pool
+
+    def set_batch_pool(self, pool, max_parallel=None):
+        """
+        Sets the pool used to execute the entries of batch requests
+        concurrently. Responses are still returned in the order of the
+        requests.
+
+        The pool must be started and must not be the one handling the client
+        requests, as those would wait for the batch entries to be executed.
+
+        :param pool: A ThreadPool, a thread-based concurrent.futures Executor
+                     or None to execute batch entries sequentially
+        :param max_parallel: Maximum number of entries of a single batch being
+                             executed at the same time (no limit if None)
+        :raise ValueError: Invalid maximum number of parallel entries or
+                           process-based pool
+        """
+        if _is_process_pool(pool):
+            # Batch entries are executed by the dispatcher, which lives in
+            # this process
+            raise ValueError("Batch entries can't be executed in processes")
+
+        if max_parallel is not None:
+            try:
+                max_parallel = int(max_parallel)
+                if max_parallel < 1:
+                    raise ValueError("Limit must be greater than 0")
+            except (TypeError, ValueError) as ex:
+                raise ValueError(
+                    "Invalid number of parallel entries: {0}".format(ex)
+                )
+
+        self.__batch_pool = pool
+        self.__batch_max_parallel = max_parallel
+
+    def set_cpu_bound_pool(self, pool):
+        """
+        Sets the pool executing the methods registered as CPU-bound, usually
+        a ProcessPoolExecutor, so that they don't hold the GIL of the server.
+
+        The functions of those methods are given to the pool with the parsed
+        parameters of the calls: with a process pool, the functions, their
+        parameters and their results must be picklable. The calling thread
+        waits for the result.
+
+        An InterpreterPool (see jsonrpclib.interpreters) executes them in
+        subinterpreters instead, where available: the functions must then be
+        defined at module level and their parameters and results must be
+        JSON-serializable.
+
+        :param pool: A concurrent.futures Executor, an InterpreterPool, or
+                     None to execute the CPU-bound methods in the calling
+                     thread
+        """
+        self.__cpu_bound_pool = pool
+
+    def get_cpu_bound_methods(self):
+        """
+        Returns the names of the methods registered as CPU-bound
+
+        :return: A sorted list of method names
+        """
+        return sorted(self.__cpu_bound)
+
+    def _unmarshaled_dispatch(self, request, dispatch_method=None):
+        """
+        Loads the request dictionary (unmarshaled), calls the method(s)
+        accordingly and returns a JSON-RPC dictionary (not marshaled)
+
+        :param request: JSON-RPC request dictionary (or list of)
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :return: A JSON-RPC dictionary (or an array of) or None if the request
+                 was a notification
+        :raise NoMulticallResult: No result in batch
+        """
+        if not request:
+            # Invalid request dictionary
+            fault = Fault(
+                -32600,
+                "Request invalid -- no request data.",
+                config=self.json_config,
+            )
+            _logger.warning("Invalid request: %s", fault)
+            return fault.dump()
+
+        if isinstance(request, utils.ListType):
+            # This SHOULD be a batch, by spec
+            if (
+                self.__vectorized
+                and dispatch_method is None
+                and len(request) > 1
+            ):
+                entries = self.__vectorized_batch_dispatch(request)
+            else:
+                entries = self.__batch_dispatch(request, dispatch_method)
+
+            # Ignore notifications
+            responses = [entry for entry in entries if entry is not None]
+            if not responses:
+                # No non-None result
+                _logger.error("No result in Multicall")
+                raise NoMulticallResult("No result")
+
+            return responses
+
+        else:
+            # Single call
+            result = validate_request(request, self.json_config)
+            if isinstance(result, Fault):
+                return result.dump()
+
+            # Call the method
+            response = self.__single_dispatch(request, dispatch_method)
+            if isinstance(response, Fault):
+                # pylint: disable=E1103
+                return response.dump()
+
+            return response
+
+    def __single_dispatch(self, request, dispatch_method):
+        """
+        Dispatches a single method call, recording its metrics if enabled
+
+        :param request: A validated request dictionary
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :return: A JSON-RPC response dictionary, or None if it was a
+                 notification request
+        """
+        metrics = self.metrics
+        profiler = self.profiler
+        if profiler is not None and not profiler.enabled:
+            profiler = None
+
+        if metrics is None and profiler is None:
+            return self._marshaled_single_dispatch(request, dispatch_method)
+
+        start = _clock()
+        if profiler is None:
+            response = self._marshaled_single_dispatch(request, dispatch_method)
+        else:
+            response = profiler.call(
+                request.get("method"),
+                request.get("params"),
+                self._marshaled_single_dispatch,
+                request,
+                dispatch_method,
+            )
+
+        if metrics is not None:
+            self.__record_call(request, response, _clock() - start)
+        return response
+
+    def __record_call(self, request, response, duration):
+        """
+        Records the metrics of a method call
+
+        :param request: The request dictionary
+        :param response: The response dictionary, a Fault or None
+        :param duration: Time spent to dispatch the call (in seconds)
+        """
+        fault_code = self.__fault_code(response)
+        if fault_code == -32601:
+            # Don't create metrics for each unknown method name
+            method = jsonrpclib.metrics.LABEL_UNKNOWN
+        else:
+            method = request.get("method")
+
+        self.metrics.record_call(method, duration, fault_code)
+
+    @staticmethod
+    def __fault_code(response):
+        """
+        Returns the code of the error of a response
+
+        :param response: A response dictionary, a Fault or None
+        :return: The fault code, or None
+        """
+        if isinstance(response, Fault):
+            return response.faultCode
+
+        try:
+            error = response.get("error")
+        except AttributeError:
+            return None
+
+        if isinstance(error, utils.DictType):
+            return error.get("code")
+        elif error is not None:
+            # Non-standard error
+            return -32603
+        return None
+
+    def __metrics_label(self, request, response):
+        """
+        Returns the label of a request in the metrics
+
+        :param request: The parsed request
+        :param response: The response dictionary (or list of), or None
+        :return: The method name or one of the special labels
+        """
+        if isinstance(request, utils.ListType):
+            return jsonrpclib.metrics.LABEL_BATCH
+
+        try:
+            method = request.get("method")
+        except AttributeError:
+            method = None
+
+        if not isinstance(method, utils.STRING_TYPES):
+            return jsonrpclib.metrics.LABEL_INVALID
+        elif self.__fault_code(response) in (-32600, -32601):
+            return jsonrpclib.metrics.LABEL_UNKNOWN
+        return method
+
+    def enable_metrics(self, buckets=None):
+        """
+        Starts collecting the metrics of the dispatcher and registers the
+        ``system.stats`` method returning them.
+        Does nothing if the metrics are already enabled.
+
+        :param buckets: Upper bounds of the latency histograms buckets (in
+                        seconds, see jsonrpclib.metrics.DEFAULT_BUCKETS)
+        :return: The MetricsRegistry
+        """
+        if self.metrics is None:
+            self.metrics = jsonrpclib.metrics.MetricsRegistry(buckets)
+            self.register_function(self.get_metrics, "system.stats")
+        return self.metrics
+
+    def get_metrics(self):
+        """
+        Returns the current values of the metrics
+
+        :return: See MetricsRegistry.snapshot(), or None if the metrics are
+                 disabled
+        """
+        if self.metrics is None:
+            return None
+        return self.metrics.snapshot(self._get_pools())
+
+    def render_metrics(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+
+        :return: The metrics as a string, or None if they are disabled
+        """
+        if self.metrics is None:
+            return None
+        return self.metrics.render(self._get_pools())
+
+    def set_profiler(self, profiler):
+        """
+        Sets the profiler of the method calls. It only profiles calls once it
+        has been enabled.
+
+        :param profiler: A jsonrpclib.profiler.RequestProfiler, or None
+        """
+        self.profiler = profiler
+
+    def register_profiler_functions(self):
+        """
+        Registers the methods controlling the profiler:
+        ``system.profiler.enable``, ``system.profiler.disable``,
+        ``system.profiler.dump`` (in the dump directory of the profiler),
+        ``system.profiler.methods`` and ``system.profiler.slow_calls``
+
+        :raise ValueError: No profiler set
+        """
+        profiler = self.profiler
+        if profiler is None:
+            raise ValueError("No profiler set")
+
+        def enable():
+            profiler.enable()
+            return True
+
+        def disable():
+            profiler.disable()
+            return False
+
+        def dump():
+            return profiler.dump()
+
+        for name, function in (
+            ("enable", enable),
+            ("disable", disable),
+            ("dump", dump),
+            ("methods", profiler.get_profiled_methods),
+            ("slow_calls", profiler.get_slow_calls),
+        ):
+            self.register_function(function, "system.profiler." + name)
+
+    def _get_pools(self):
+        """
+        Returns the thread pools used by the dispatcher
+
+        :return: A name -> pool dictionary
+        """
+        pools = {}
+        if self.__notification_pool is not None:
+            pools["notification"] = self.__notification_pool
+        if self.__batch_pool is not None:
+            pools["batch"] = self.__batch_pool
+        return pools
+
+    def __batch_dispatch(self, requests, dispatch_method):
+        """
+        Dispatches the entries of a batch, in parallel if a batch pool is set
+
+        :param requests: Entries of the batch
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :return: The list of responses or None (notifications), in the order
+                 of the requests
+        """
+        if self.__batch_pool is not None and len(requests) > 1:
+            return self.__parallel_batch_dispatch(requests, dispatch_method)
+
+        return [
+            self._batch_entry_dispatch(req_entry, dispatch_method)
+            for req_entry in requests
+        ]
+
+    def __vectorized_batch_dispatch(self, requests):
+        """
+        Dispatches the entries of a batch, calling the vectorized
+        implementation of a method once for all its calls
+
+        :param requests: Entries of the batch
+        :return: The list of responses or None (notifications), in the order
+                 of the requests
+        """
+        # Method -> indices of its calls
+        groups = {}
+        for idx, req_entry in enumerate(requests):
+            if (
+                isinstance(req_entry, utils.DictType)
+                and req_entry.get("method") in self.__vectorized
+                and validate_request(req_entry, self.json_config) is True
+            ):
+                groups.setdefault(req_entry["method"], []).append(idx)
+
+        vectorized = {}
+        for method, indices in groups.items():
+            if len(indices) > 1:
+                vectorized[method] = indices
+
+        if not vectorized:
+            return self.__batch_dispatch(requests, None)
+
+        # Dispatch the other entries as usual
+        results = [None] * len(requests)
+        others = set(range(len(requests)))
+        for indices in vectorized.values():
+            others.difference_update(indices)
+
+        others = sorted(others)
+        if others:
+            responses = self.__batch_dispatch(
+                [requests[idx] for idx in others], None
+            )
+            for idx, response in zip(others, responses):
+                results[idx] = response
+
+        for method, indices in vectorized.items():
+            responses = self.__vectorized_call(
+                method, [requests[idx] for idx in indices]
+            )
+            for idx, response in zip(indices, responses):
+                results[idx] = response
+
+        return results
+
+    def __vectorized_call(self, method, requests):
+        """
+        Calls the vectorized implementation of a method
+
+        :param method: Name of the method
+        :param requests: The validated requests to the method
+        :return: The list of responses or None (notifications), in the order
+                 of the requests
+        """
+        vectorized = self.__vectorized.get(method)
+        invoker = self._get_invoker(method)
+        if vectorized is None or invoker is None:
+            # Unregistered in the meantime
+            return self.__batch_dispatch(requests, None)
+
+        # Check the parameters of each call against the method signature
+        start = _clock()
+        results = [None] * len(requests)
+        calls = []
+        for idx, req_entry in enumerate(requests):
+            error = invoker.check(req_entry["params"])
+            if error is None:
+                calls.append(idx)
+            else:
+                fault = Fault(
+                    -32602,
+                    "Invalid parameters: {0}".format(error),
+                    config=self.__request_config(req_entry),
+                )
+                _logger.warning("Invalid call parameters: %s", fault)
+                results[idx] = fault
+
+        if calls:
+            bulkhead = self._get_bulkhead(method)
+            if bulkhead is not None and not bulkhead.acquire():
+                call_results = [
+                    self.__busy_fault(method, self.json_config)
+                ] * len(calls)
+            else:
+                try:
+                    call_results = list(
+                        vectorized([requests[idx]["params"] for idx in calls])
+                    )
+                    if len(call_results) != len(calls):
+                        raise ValueError(
+                            "Vectorized method {0} didn't return {1} "
+                            "results".format(method, len(calls))
+                        )
+                except Exception:
+                    call_results = [
+                        self.__method_fault(self.json_config)
+                    ] * len(calls)
+                finally:
+                    if bulkhead is not None:
+                        bulkhead.release()
+
+            for idx, result in zip(calls, call_results):
+                results[idx] = result
+
+        if self.metrics is not None:
+            duration = _clock() - start
+            for req_entry, result in zip(requests, results):
+                if not isinstance(result, Fault):
+                    # Results are not response dictionaries
+                    result = None
+                self.__record_call(req_entry, result, duration)
+
+        responses = []
+        for req_entry, result in zip(requests, results):
+            rpcid = req_entry.get("id")
+            if rpcid in (None, ""):
+                # Notification
+                responses.append(None)
+                continue
+
+            config = self.__request_config(req_entry)
+            try:
+                responses.append(
+                    jsonrpclib.dump(
+                        result, rpcid=rpcid, is_response=True, config=config
+                    )
+                )
+            except Exception as ex:
+                # JSON conversion exception
+                fault = Fault(
+                    -32603,
+                    "{0}:{1}".format(type(ex).__name__, ex),
+                    config=config,
+                )
+                _logger.error("Error preparing JSON-RPC result: %s", fault)
+                responses.append(
+                    jsonrpclib.dump(
+                        fault, rpcid=rpcid, is_response=True, config=config
+                    )
+                )
+
+        return responses
+
+    def __request_config(self, request):
+        """
+        Returns the configuration to use to handle a request
+
+        :param request: A validated request dictionary
+        :return: The server configuration, or a JSON-RPC 1.0 copy of it for
+                 JSON-RPC 1.0 requests on a JSON-RPC 2.0 server
+        """
+        server_config = self.json_config
+        if "jsonrpc" not in request and server_config.version >= 2:
+            # JSON-RPC 1.0 request on a JSON-RPC 2.0
+            # => compatibility needed
+            key = (
+                server_config,
+                server_config.use_jsonclass,
+                server_config.serialize_method,
+                server_config.ignore_attribute,
+                server_config.content_type,
+                server_config.user_agent,
+            )
+            cached_key, config = self.__v1_config
+            if cached_key != key:
+                # Derive the configuration once, instead of copying it for
+                # each request: it shares the classes and the serialization
+                # handlers of the server configuration, which can still be
+                # updated
+                config = server_config.copy()
+                config.version = 1.0
+                config.classes = server_config.classes
+                config.serialize_handlers = server_config.serialize_handlers
+                self.__v1_config = (key, config)
+            return config
+
+        # Keep server configuration as is
+        return server_config
+
+    def _batch_entry_dispatch(self, request, dispatch_method=None):
+        """
+        Validates and dispatches an entry of a batch request
+
+        :param request: A batch entry
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :return: A JSON-RPC response dictionary, or None if it was a
+                 notification request
+        """
+        # Validate the request
+        result = validate_request(request, self.json_config)
+        if isinstance(result, Fault):
+            return result.dump()
+
+        # Call the method
+        response = self.__single_dispatch(request, dispatch_method)
+        if isinstance(response, Fault):
+            # pylint: disable=E1103
+            return response.dump()
+
+        return response
+
+    @staticmethod
+    def __release_on_done(future, semaphore):
+        """
+        Releases the given semaphore once the future is done, even if its task
+        failed or has been cancelled
+
+        :param future: A concurrent.futures Future or a FutureResult
+        :param semaphore: Semaphore limiting the parallel entries of the batch
+        """
+
+        def release(*_):
+            semaphore.release()
+
+        try:
+            # concurrent.futures
+            future.add_done_callback(release)
+        except AttributeError:
+            # jsonrpclib thread pool
+            future.set_callback(release)
+
+    def __parallel_batch_dispatch(self, requests, dispatch_method):
+        """
+        Executes the entries of a batch in the batch pool
+
+        :param requests: Entries of the batch
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :return: The list of responses or None (notifications), in the order
+                 of the requests
+        """
+        pool = self.__batch_pool
+        if self.__batch_max_parallel is not None:
+            semaphore = threading.BoundedSemaphore(self.__batch_max_parallel)
+        else:
+            semaphore = None
+
+        results = [None] * len(requests)
+        futures = []
+        for idx, req_entry in enumerate(requests):
+            if semaphore is not None:
+                # Wait for a slot
+                semaphore.acquire()
+
+            if isinstance(req_entry, utils.DictType):
+                method = req_entry.get("method")
+            else:
+                method = None
+
+            try:
+                future = self._submit(
+                    pool,
+                    method,
+                    self._batch_entry_dispatch,
+                    req_entry,
+                    dispatch_method,
+                )
+            except Exception as ex:
+                # Full or stopped pool: execute the entry here
+                _logger.warning("Error queuing batch entry: %s", ex)
+                try:
+                    results[idx] = self._batch_entry_dispatch(
+                        req_entry, dispatch_method
+                    )
+                finally:
+                    if semaphore is not None:
+                        semaphore.release()
+            else:
+                if semaphore is not None:
+                    self.__release_on_done(future, semaphore)
+                futures.append((idx, future))
+
+        for idx, future in futures:
+            try:
+                results[idx] = future.result()
+            except Exception as ex:
+                # Entry validation and dispatch errors are already handled
+                # by the task: this is a pool error
+                req_entry = requests[idx]
+                if not isinstance(req_entry, utils.DictType):
+                    rpcid = None
+                elif req_entry.get("id") in (None, ""):
+                    # Notification: no response
+                    _logger.error("Error executing notification: %s", ex)
+                    continue
+                else:
+                    rpcid = req_entry["id"]
+
+                fault = Fault(
+                    -32603,
+                    "{0}:{1}".format(type(ex).__name__, ex),
+                    rpcid=rpcid,
+                    config=self.json_config,
+                )
+                _logger.error("Error executing batch entry: %s", fault)
+                results[idx] = fault.dump()
+
+        return results
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        """
+        Parses the request data (marshaled), calls method(s) and returns a
+        JSON string (marshaled)
+
+        :param data: A JSON request string
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :param path: Unused parameter, to keep compatibility with xmlrpclib
+        :return: A JSON-RPC response string (marshaled)
+        """
+        metrics = self.metrics
+        if metrics is None:
+            return self.__marshaled_dispatch(data, dispatch_method)
+
+        start = _clock()
+        timing = {"method": jsonrpclib.metrics.LABEL_INVALID}
+        metrics.request_started()
+        try:
+            response = self.__marshaled_dispatch(data, dispatch_method, timing)
+        finally:
+            metrics.request_done()
+
+        metrics.record_request(
+            timing["method"],
+            timing.get("serialization", 0.0),
+            _clock() - start,
+        )
+        return response
+
+    def __marshaled_dispatch(self, data, dispatch_method, timing=None):
+        """
+        Parses the request data (marshaled), calls method(s) and returns a
+        JSON string (marshaled)
+
+        :param data: A JSON request string
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :param timing: If given, a dictionary to fill with the label of the
+                       request (``method``) and the time spent to serialize
+                       the response (``serialization``)
+        :return: A JSON-RPC response string (marshaled)
+        """
+        # Parse the request
+        try:
+            request = jsonrpclib.loads(data, self.json_config)
+        except Exception as ex:
+            # Parsing/loading error
+            if isinstance(data, bytearray):
+                # Show the request content, not the buffer representation
+                try:
+                    data = utils.from_bytes(bytes(data))
+                except UnicodeError:
+                    data = bytes(data)
+
+            fault = Fault(
+                -32700,
+                "Request {0} invalid. ({1}:{2})".format(
+                    data, type(ex).__name__, ex
+                ),
+                config=self.json_config,
+            )
+            _logger.warning("Error parsing request: %s", fault)
+            return fault.response()
+
+        # Get the response dictionary
+        try:
+            response = self._unmarshaled_dispatch(request, dispatch_method)
+            if timing is not None:
+                timing["method"] = self.__metrics_label(request, response)
+
+            if response is not None:
+                # Compute the string representation of the dictionary/list
+                if timing is None:
+                    return self._dumps_response(response)
+
+                start = _clock()
+                result = self._dumps_response(response)
+                timing["serialization"] = _clock() - start
+                return result
+            else:
+                # No result (notification)
+                return ""
+        except NoMulticallResult:
+            # Return an empty string (jsonrpclib internal behaviour)
+            return ""
+
+    def _marshaled_single_dispatch(self, request, dispatch_method=None):
+        """
+        Dispatches a single method call
+
+        :param request: A validated request dictionary
+        :param dispatch_method: Custom dispatch method (for method resolution)
+        :return: A JSON-RPC response dictionary, or None if it was a
+                 notification request
+        """
+        method = request.get("method")
+        params = request.get("params")
+
+        # Prepare a request-specific configuration
+        config = self.__request_config(request)
+
+        # Test if this is a notification request
+        is_notification = "id" not in request or request["id"] in (None, "")
+        batcher = self.__bulk_consumers.get(method) if is_notification else None
+        if batcher is not None:
+            # Delivered by batches
+            batcher.put(params)
+            return None
+        elif is_notification and self.__notification_pool is not None:
+            # Use the thread pool for notifications
+            pool = self.__notification_pool
+            if dispatch_method is None and _is_process_pool(pool):
+                invoker = self._get_invoker(method)
+                if invoker is not None and invoker.check(params) is None:
+                    # Only the function can be sent to the process
+                    future = _enqueue(
+                        pool,
+                        None,
+                        _call_function,
+                        invoker.func,
+                        params,
+                    )
+                    future.add_done_callback(_log_notification_error)
+                else:
+                    # Let the dispatcher handle the error
+                    self._dispatch(method, params, config)
+            elif dispatch_method is not None:
+                future = self._submit(
+                    pool, method, dispatch_method, method, params
                 )
+                if _is_process_pool(pool):
+                    # Errors, including pickling ones, would be lost
+                    future.add_done_callback(_log_notification_error)
             else:
-                self.__notification_pool.enqueue(
-                    self._dispatch, method, params, config
+                self._submit(
+                    pool, method, self._dispatch, method, params, config
+                )
+
+            # Return immediately
+            return None
+        else:
+            cache = None
+            if not is_notification and self.__result_caches:
+                cache = self.__result_caches.get(method)
+                cache_key = _cache_key(params) if cache is not None else None
+                if cache_key is None:
+                    cache = None
+                else:
+                    found, value = cache.get(cache_key)
+                    if found:
+                        return self.__cached_response(
+                            value, cache.serialize, request["id"], config
+                        )
+
+            flight_key = None
+            if not is_notification and method in self.__single_flight:
+                flight_key = _cache_key(params)
+                if flight_key is not None:
+                    flight_key = (method, flight_key)
+
+            # Synchronous call
+            try:
+                # Call the method
+                if flight_key is not None:
+                    response = self.__call_once(
+                        flight_key, method, params, config, dispatch_method
+                    )
+                else:
+                    response = self.__call(
+                        method, params, config, dispatch_method
+                    )
+            except Exception as ex:
+                # Return a fault
+                fault = Fault(
+                    -32603,
+                    "{0}:{1}".format(type(ex).__name__, ex),
+                    config=config,
+                )
+                _logger.error("Error calling method %s: %s", method, fault)
+                return fault.dump()
+
+            if is_notification:
+                # It's a notification, no result needed
+                # Do not use 'not id' as it might be the integer 0
+                return None
+
+        # Prepare a JSON-RPC dictionary
+        try:
+            if cache is not None and not isinstance(response, Fault):
+                if cache.serialize:
+                    # Cache the converted result and its JSON representation
+                    if config.use_jsonclass:
+                        response = jsonclass.dump(response, config=config)
+                    response = (response, jsonrpclib.jdumps(response))
+
+                cache.put(cache_key, response)
+                return self.__cached_response(
+                    response, cache.serialize, request["id"], config
+                )
+
+            return jsonrpclib.dump(
+                response, rpcid=request["id"], is_response=True, config=config
+            )
+        except Exception as ex:
+            # JSON conversion exception
+            fault = Fault(
+                -32603, "{0}:{1}".format(type(ex).__name__, ex), config=config
+            )
+            _logger.error("Error preparing JSON-RPC result: %s", fault)
+            return fault.dump()
+
+    @staticmethod
+    def __cached_response(value, serialized, rpcid, config):
+        """
+        Prepares the response dictionary of a cached result
+
+        :param value: The cached result, or a (converted result, JSON
+                      representation) tuple in serialized mode
+        :param serialized: True if the value comes from a serialized cache
+        :param rpcid: ID of the request
+        :param config: Request-specific configuration
+        :return: A JSON-RPC response dictionary
+        """
+        if not serialized:
+            return jsonrpclib.dump(
+                value, rpcid=rpcid, is_response=True, config=config
+            )
+
+        result, raw_result = value
+        payload = Payload(rpcid=rpcid, version=config.version)
+        return _SerializedResponse(payload.response(result), raw_result)
+
+    def _dumps_response(self, response):
+        """
+        Converts a response dictionary (or a list of) to a JSON string,
+        reusing the JSON representation of cached results
+
+        :param response: A JSON-RPC response dictionary or a list of
+        :return: The JSON string
+        """
+        if isinstance(response, _SerializedResponse):
+            return response.dumps(self.encoding)
+
+        if isinstance(response, utils.ListType) and any(
+            isinstance(entry, _SerializedResponse) for entry in response
+        ):
+            return (
+                "["
+                + ", ".join(self._dumps_response(entry) for entry in response)
+                + "]"
+            )
+
+        return jsonrpclib.jdumps(response, self.encoding)
+
+    def _dispatch(self, method, params, config=None):
+        """
+        Default method resolver and caller
+
+        :param method: Name of the method to call
+        :param params: List of arguments to give to the method
+        :param config: Request-specific configuration
+        :return: The result of the method
+        """
+        config = config or self.json_config
+
+        invoker = self._get_invoker(method)
+        if invoker is None:
+            instance = self.instance
+            if instance is not None and hasattr(instance, "_dispatch"):
+                # Instance has a custom dispatcher
+                bulkhead = self._get_bulkhead(method)
+                if bulkhead is None:
+                    return instance._dispatch(method, params)
+                elif not bulkhead.acquire():
+                    return self.__busy_fault(method, config)
+
+                try:
+                    return instance._dispatch(method, params)
+                finally:
+                    bulkhead.release()
+
+            # Unknown method
+            fault = Fault(
+                -32601,
+                "Method {0} not supported.".format(method),
+                config=config,
+            )
+            _logger.warning("Unknown method: %s", fault)
+            return fault
+
+        error = invoker.check(params)
+        if error is not None:
+            fault = Fault(
+                -32602, "Invalid parameters: {0}".format(error), config=config
+            )
+            _logger.warning("Invalid call parameters: %s", fault)
+            return fault
+
+        bulkhead = self._get_bulkhead(method)
+        if bulkhead is not None and not bulkhead.acquire():
+            return self.__busy_fault(method, config)
+
+        try:
+            pool = self.__cpu_bound_pool
+            if pool is not None and method in self.__cpu_bound:
+                # Execute the function in the pool, with the parsed
+                # parameters
+                submit_call = getattr(pool, "submit_call", None)
+                if submit_call is not None:
+                    # Pool exchanging messages (InterpreterPool)
+                    future = submit_call(invoker.func, params)
+                else:
+                    future = pool.submit(_call_function, invoker.func, params)
+                return future.result()
+
+            # Call the method
+            return invoker(params)
+        except TypeError as ex:
+            if invoker.checked:
+                # Parameters were valid: this is a method error
+                return self.__method_fault(config)
+
+            # Maybe the parameters are wrong
+            fault = Fault(
+                -32602, "Invalid parameters: {0}".format(ex), config=config
+            )
+            _logger.warning("Invalid call parameters: %s", fault)
+            return fault
+        except BaseException:
+            # Method exception
+            return self.__method_fault(config)
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+
+    @staticmethod
+    def __busy_fault(method, config):
+        """
+        Prepares the fault returned when the concurrency limit of a method is
+        reached
+
+        :param method: Name of the called method
+        :param config: Request-specific configuration
+        :return: A Fault object
+        """
+        fault = Fault(
+            BUSY_FAULT_CODE,
+            "Method {0} is busy: too many concurrent calls.".format(method),
+            config=config,
+        )
+        _logger.warning("Concurrency limit reached: %s", fault)
+        return fault
+
+    @staticmethod
+    def __method_fault(config):
+        """
+        Prepares the fault describing the exception being handled
+
+        :param config: Request-specific configuration
+        :return: A Fault object
+        """
+        err_lines = traceback.format_exception(*sys.exc_info())
+        trace_string = "{0} | {1}".format(
+            err_lines[-2].splitlines()[0].strip(), err_lines[-1]
+        )
+        fault = Fault(
+            -32603,
+            "Server error: {0}".format(trace_string),
+            config=config,
+        )
+        _logger.exception("Server-side exception: %s", fault)
+        return fault
+
+
+# ------------------------------------------------------------------------------
+
+
+class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    HTTP request handler.
+
+    The server that receives the requests must have a json_config member,
+    containing a JSONRPClib Config instance.
+
+    Persistent connections are kept open if the ``keep_alive`` member of the
+    server is True.
+    """
+
+    # Persistent connections are closed if the server doesn't allow them
+    protocol_version = "HTTP/1.1"
+
+    # Maximum number of bytes allocated at once when reading a chunk
+    chunk_piece_size = 65536
+
+    def setup(self):
+        """
+        Prepares the connection
+        """
+        if getattr(self.server, "keep_alive", False):
+            # Idle timeout of persistent connections
+            self.timeout = self.server.keepalive_timeout
+
+        # Number of requests received on this connection
+        self._nb_requests = 0
+        self._connection_header_sent = False
+        self._response_code = None
+
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def handle_one_request(self):
+        """
+        Handles a single HTTP request, waiting quietly for it if the
+        connection is persistent
+        """
+        if self._nb_requests:
+            # Wait for the next request (or for a pipelined one)
+            try:
+                if not self.rfile.peek(1):
+                    # Connection closed by the client
+                    self.close_connection = True
+                    return
+            except AttributeError:
+                # Python 2: no peek() on sockets, let the parent handle it
+                pass
+            except (socket.timeout, socket.error):
+                # Idle connection
+                self.close_connection = True
+                return
+
+        self._nb_requests += 1
+        self._connection_header_sent = False
+        self._response_code = None
+
+        access_log = getattr(self.server, "access_log", None)
+        if access_log is None:
+            SimpleXMLRPCRequestHandler.handle_one_request(self)
+            return
+
+        # Describe the request in the access log
+        self._status = None
+        self._rpc_method = None
+        self._bytes_in = 0
+        self._bytes_out = 0
+        start = _clock()
+        try:
+            SimpleXMLRPCRequestHandler.handle_one_request(self)
+        finally:
+            if self._status is not None:
+                access_log.log(
+                    {
+                        "time": time.time(),
+                        "client": self.address_string(),
+                        "request": self.command,
+                        "path": self.path,
+                        "method": self._rpc_method,
+                        "status": self._status,
+                        "latency": _clock() - start,
+                        "bytes_in": self._bytes_in,
+                        "bytes_out": self._bytes_out,
+                    }
                 )
 
-            # Return immediately
-            return None
-        else:
-            # Synchronous call
-            try:
-                # Call the method
-                if dispatch_method is not None:
-                    response = dispatch_method(method, params)
-                else:
-                    response = self._dispatch(method, params, config)
-            except Exception as ex:
-                # Return a fault
-                fault = Fault(
-                    -32603,
-                    "{0}:{1}".format(type(ex).__name__, ex),
-                    config=config,
-                )
-                _logger.error("Error calling method %s: %s", method, fault)
-                return fault.dump()
+    def log_request(self, code="-", size="-"):
+        """
+        Logs an HTTP response, in the access log of the server if it has one
+        """
+        if getattr(self.server, "access_log", None) is None:
+            SimpleXMLRPCRequestHandler.log_request(self, code, size)
+        else:
+            # Logged once the request has been handled
+            self._status = int(code)
+
+    def send_response_only(self, code, message=None):
+        """
+        Sends the status line, noting the status code
+        """
+        self._response_code = code
+        SimpleXMLRPCRequestHandler.send_response_only(self, code, message)
+
+    def send_header(self, keyword, value):
+        """
+        Sends a header, noting if it is the connection one
+        """
+        if keyword.lower() == "connection":
+            self._connection_header_sent = True
+
+        SimpleXMLRPCRequestHandler.send_header(self, keyword, value)
+
+    def end_headers(self):
+        """
+        Sends the Connection header, if necessary, before ending the headers
+        of a final response (not of an interim 100 Continue)
+        """
+        # Python 2 doesn't use send_response_only(): no interim response
+        code = self._response_code
+        if not self._connection_header_sent and (code is None or code >= 200):
+            server = self.server
+            max_requests = getattr(server, "max_keepalive_requests", None)
+            if (
+                self.close_connection
+                or not getattr(server, "keep_alive", False)
+                or (max_requests and self._nb_requests >= max_requests)
+            ):
+                self.send_header("Connection", "close")
+            elif self.request_version == "HTTP/1.0":
+                # Keep-alive explicitly asked by an HTTP/1.0 client
+                self.send_header("Connection", "keep-alive")
+
+        SimpleXMLRPCRequestHandler.end_headers(self)
+
+    def report_404(self):
+        """
+        Reports a 404 error and closes the connection, as the request body
+        hasn't been read
+        """
+        self.close_connection = True
+        SimpleXMLRPCRequestHandler.report_404(self)
+
+    def send_status(self, code, headers=None):
+        """
+        Sends a response without body and closes the connection. This is used
+        to report errors at the HTTP level.
+
+        :param code: HTTP status code
+        :param headers: Additional headers (dictionary)
+        """
+        self.close_connection = True
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-length", "0")
+        self.end_headers()
 
-            if is_notification:
-                # It's a notification, no result needed
-                # Do not use 'not id' as it might be the integer 0
+    def read_body(self):
+        """
+        Reads the request body in a single buffer, according to its length or
+        to the chunked transfer encoding.
+
+        :return: The body as a bytearray, or None if an error response has
+                 been sent
+        :raise IOError: The client closed the connection too early
+        """
+        transfer_encoding = self.headers.get("transfer-encoding", "")
+        if transfer_encoding:
+            last_coding = transfer_encoding.split(",")[-1].strip().lower()
+            if last_coding != "chunked":
+                # Only the chunked transfer encoding is supported
+                self.send_status(501)
                 return None
 
-        # Prepare a JSON-RPC dictionary
+            return self._read_chunked_body()
+
         try:
-            return jsonrpclib.dump(
-                response, rpcid=request["id"], is_response=True, config=config
-            )
-        except Exception as ex:
-            # JSON conversion exception
-            fault = Fault(
-                -32603, "{0}:{1}".format(type(ex).__name__, ex), config=config
-            )
-            _logger.error("Error preparing JSON-RPC result: %s", fault)
-            return fault.dump()
+            size = int(self.headers["content-length"])
+            if size < 0:
+                raise ValueError("Negative content length")
+        except TypeError:
+            # No content length
+            self.send_status(411)
+            return None
+        except ValueError:
+            # Invalid content length
+            self.send_status(400)
+            return None
 
-    def _dispatch(self, method, params, config=None):
+        if self._is_body_too_large(size):
+            return None
+
+        body = bytearray(size)
+        self._read_into(body)
+        return body
+
+    def _is_body_too_large(self, size):
         """
-        Default method resolver and caller
+        Checks if the given body size is allowed by the server. If not, a 413
+        error is sent.
 
-        :param method: Name of the method to call
-        :param params: List of arguments to give to the method
-        :param config: Request-specific configuration
-        :return: The result of the method
+        :param size: Size of the request body
+        :return: True if the body is too large
         """
-        config = config or self.json_config
+        max_size = getattr(self.server, "max_body_size", None)
+        if max_size is None or size <= max_size:
+            return False
+
+        count_rejection = getattr(self.server, "_count_rejection", None)
+        if count_rejection is not None:
+            count_rejection("body_size")
+
+        self.send_status(413)
+        return True
+
+    def _read_into(self, buffer, position=0):
+        """
+        Fills the given buffer with data from the request stream
 
-        func = None
+        :param buffer: A bytearray
+        :param position: Position of the first byte to fill in the buffer
+        :raise IOError: The client closed the connection too early
+        """
+        readinto = getattr(self.rfile, "readinto", None)
+        size = len(buffer)
+        view = memoryview(buffer)
         try:
-            # Look into registered methods
-            func = self.funcs[method]
-        except KeyError:
-            if self.instance is not None:
-                # Try with the registered instance
-                try:
-                    # Instance has a custom dispatcher
-                    return getattr(self.instance, "_dispatch")(method, params)
-                except AttributeError:
-                    # Resolve the method name in the instance
-                    try:
-                        func = resolve_dotted_attribute(
-                            self.instance, method, True
-                        )
-                    except AttributeError:
-                        # Unknown method
-                        pass
+            while position < size:
+                if readinto is not None:
+                    nb_read = readinto(view[position:])
+                else:
+                    # Python 2
+                    chunk = self.rfile.read(size - position)
+                    nb_read = len(chunk)
+                    view[position : position + nb_read] = chunk
+
+                if not nb_read:
+                    raise IOError(
+                        "Connection closed while reading the request"
+                    )
+
+                position += nb_read
+        finally:
+            try:
+                # Allow the buffer to be resized
+                view.release()
+            except AttributeError:
+                # Python 2
+                pass
+
+    def _read_chunked_body(self):
+        """
+        Reads a request body sent with the chunked transfer encoding
+
+        :return: The body as a bytearray, or None if an error response has
+                 been sent
+        :raise IOError: The client closed the connection too early
+        """
+        body = bytearray()
+        while True:
+            line = self.rfile.readline(65537)
+            if not line:
+                raise IOError("Connection closed while reading the request")
 
-        if func is not None:
             try:
-                # Call the method
-                if isinstance(params, utils.ListType):
-                    return func(*params)
-                else:
-                    return func(**params)
-            except TypeError as ex:
-                # Maybe the parameters are wrong
-                fault = Fault(
-                    -32602, "Invalid parameters: {0}".format(ex), config=config
-                )
-                _logger.warning("Invalid call parameters: %s", fault)
-                return fault
-            except BaseException:
-                # Method exception
-                err_lines = traceback.format_exception(*sys.exc_info())
-                trace_string = "{0} | {1}".format(
-                    err_lines[-2].splitlines()[0].strip(), err_lines[-1]
-                )
-                fault = Fault(
-                    -32603,
-                    "Server error: {0}".format(trace_string),
-                    config=config,
-                )
-                _logger.exception("Server-side exception: %s", fault)
-                return fault
-        else:
-            # Unknown method
-            fault = Fault(
-                -32601,
-                "Method {0} not supported.".format(method),
-                config=config,
-            )
-            _logger.warning("Unknown method: %s", fault)
-            return fault
+                # Ignore chunk extensions
+                chunk_size = int(line.split(b";", 1)[0].strip(), 16)
+                if chunk_size < 0:
+                    raise ValueError("Negative chunk size")
+            except ValueError:
+                self.send_status(400)
+                return None
 
+            if not chunk_size:
+                # Last chunk
+                break
 
-# ------------------------------------------------------------------------------
+            if self._is_body_too_large(len(body) + chunk_size):
+                return None
 
+            # Grow the body in place as the data is received, by bounded
+            # pieces: the announced chunk size is not allocated upfront
+            remaining = chunk_size
+            while remaining:
+                piece = min(remaining, self.chunk_piece_size)
+                position = len(body)
+                body.extend(bytearray(piece))
+                self._read_into(body, position)
+                remaining -= piece
+
+            # Chunk data must be followed by a CRLF
+            if self.rfile.readline(3) not in (b"\r\n", b"\n"):
+                self.send_status(400)
+                return None
 
-class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
-    """
-    HTTP request handler.
+        # Skip the trailer
+        while line not in (b"\r\n", b"\n", b""):
+            line = self.rfile.readline(65537)
 
-    The server that receives the requests must have a json_config member,
-    containing a JSONRPClib Config instance
-    """
+        return body
+
+    def do_GET(self):
+        """
+        Handles GET requests: returns the metrics of the server in the
+        Prometheus text format, if they are enabled
+        """
+        if getattr(self.server, "metrics", None) is None:
+            # Metrics are disabled
+            self.send_status(501)
+            return
+
+        if self.path.partition("?")[0] != self.server.metrics_path:
+            self.report_404()
+            return
+
+        response = utils.to_bytes(self.server.render_metrics())
+        self._bytes_out = len(response)
+        self.send_response(200)
+        self.send_header(
+            "Content-type", jsonrpclib.metrics.PROMETHEUS_CONTENT_TYPE
+        )
+        self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
 
     def do_POST(self):
         """
@@ -471,29 +2600,38 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
         # Retrieve the configuration
         config = getattr(self.server, "json_config", jsonrpclib.config.DEFAULT)
 
+        # Admission control, before reading and decoding the body
+        acquire_slot = getattr(self.server, "_acquire_request_slot", None)
+        if acquire_slot is not None and not acquire_slot():
+            # Too many requests are being handled
+            self.send_status(
+                503, {"Retry-After": str(self.server.retry_after)}
+            )
+            return
+
+        data = None
         try:
             # Read the request body
-            max_chunk_size = 10 * 1024 * 1024
-            size_remaining = int(self.headers["content-length"])
-            chunks = []
-            while size_remaining:
-                chunk_size = min(size_remaining, max_chunk_size)
-                raw_chunk = self.rfile.read(chunk_size)
-                if not raw_chunk:
-                    break
-                chunks.append(utils.from_bytes(raw_chunk))
-                size_remaining -= len(raw_chunk)
-            data = "".join(chunks)
+            data = self.read_body()
+            if data is None:
+                # Invalid request, response has been sent
+                return
 
-            try:
-                # Decode content
-                data = self.decode_request_content(data)
-                if data is None:
-                    # Unknown encoding, response has been sent
-                    return
-            except AttributeError:
-                # Available since Python 2.7
-                pass
+            if getattr(self.server, "access_log", None) is not None:
+                self._bytes_in = len(data)
+                self._rpc_method = _find_method(data)
+
+            encoding = self.headers.get("content-encoding", "identity")
+            if encoding.lower() != "identity":
+                try:
+                    # Decode content
+                    data = self.decode_request_content(bytes(data))
+                    if data is None:
+                        # Unknown encoding, response has been sent
+                        return
+                except AttributeError:
+                    # Available since Python 2.7
+                    pass
 
             # Execute the method
             response = self.server._marshaled_dispatch(
@@ -503,7 +2641,9 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
             # No exception: send a 200 OK
             self.send_response(200)
         except BaseException:
-            # Exception: send 500 Server Error
+            # Exception: send 500 Server Error and drop the connection, as the
+            # request body might not have been fully read
+            self.close_connection = True
             self.send_response(500)
             err_lines = traceback.format_exception(*sys.exc_info())
             trace_string = "{0} | {1}".format(
@@ -514,6 +2654,9 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
             )
             _logger.exception("Server-side error: %s", fault)
             response = fault.response()
+        finally:
+            if acquire_slot is not None:
+                self.server._release_request_slot()
 
         if response is None:
             # Avoid to send None
@@ -522,6 +2665,11 @@ class SimpleJSONRPCRequestHandler(SimpleXMLRPCRequestHandler):
         # Convert the response to the valid string format
         response = utils.to_bytes(response)
 
+        metrics = getattr(self.server, "metrics", None)
+        if metrics is not None:
+            metrics.record_bytes(len(data or b""), len(response))
+        self._bytes_out = len(response)
+
         # Send it
         self.send_header("Content-type", config.content_type)
         self.send_header("Content-length", str(len(response)))
@@ -541,6 +2689,37 @@ class SimpleJSONRPCServer(socketserver.TCPServer, SimpleJSONRPCDispatcher):
     # This simplifies server restart after error
     allow_reuse_address = True
 
+    # Set to True to share the listening port between processes
+    # (see jsonrpclib.prefork)
+    allow_reuse_port = False
+
+    # Set to True to keep HTTP connections open between requests.
+    # Note that this server handles one connection at a time.
+    keep_alive = False
+
+    # Time to wait for the next request on a persistent connection (seconds)
+    keepalive_timeout = 15
+
+    # Maximum number of requests on a persistent connection (None: no limit)
+    max_keepalive_requests = 100
+
+    # Maximum number of requests being dispatched at the same time
+    # (None: no limit). Other requests are rejected with a 503 error.
+    max_in_flight = None
+
+    # Maximum size of a request body, in bytes (None: no limit).
+    # Larger requests are rejected with a 413 error.
+    max_body_size = None
+
+    # Value of the Retry-After header sent with 503 errors (seconds)
+    retry_after = 1
+
+    # Path of the metrics (GET requests), if enabled with enable_metrics()
+    metrics_path = "/metrics"
+
+    # A jsonrpclib.accesslog.AccessLog replacing the synchronous request logs
+    access_log = None
+
     # pylint: disable=C0103
     def __init__(
         self,
@@ -566,6 +2745,16 @@ class SimpleJSONRPCServer(socketserver.TCPServer, SimpleJSONRPCDispatcher):
         # Set up the dispatcher fields
         SimpleJSONRPCDispatcher.__init__(self, encoding, config)
 
+        # Admission control
+        self._admission_lock = threading.Lock()
+        self._nb_in_flight = 0
+        self._rejections = {
+            "in_flight": 0,
+            "queue": 0,
+            "delay": 0,
+            "body_size": 0,
+        }
+
         # Flag to ease handling of Unix socket mode
         unix_socket = address_family == _AF_UNIX
 
@@ -612,6 +2801,80 @@ class SimpleJSONRPCServer(socketserver.TCPServer, SimpleJSONRPCDispatcher):
             flags |= fcntl.FD_CLOEXEC
             fcntl.fcntl(self.fileno(), fcntl.F_SETFD, flags)
 
+    def server_bind(self):
+        """
+        Binds the server socket, setting the SO_REUSEPORT option if requested.
+        The option is handled here as it is ignored before Python 3.11
+        """
+        if self.allow_reuse_port and hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        socketserver.TCPServer.server_bind(self)
+
+    def after_fork(self):
+        """
+        Resets the state of the server in a child process, e.g. in the workers
+        of a pre-fork server. The threads of the parent process don't exist in
+        the child process.
+        """
+        SimpleJSONRPCDispatcher.after_fork(self)
+
+        # The lock might have been held by a thread of the parent process
+        self._admission_lock = threading.Lock()
+        self._nb_in_flight = 0
+
+        if self.access_log is not None:
+            self.access_log.after_fork()
+
+    def _acquire_request_slot(self):
+        """
+        Counts a request being dispatched, if the in-flight limit allows it
+
+        :return: True if the request can be dispatched, False if it must be
+                 rejected
+        """
+        with self._admission_lock:
+            if (
+                self.max_in_flight is not None
+                and self._nb_in_flight >= self.max_in_flight
+            ):
+                self._rejections["in_flight"] += 1
+                return False
+
+            self._nb_in_flight += 1
+            return True
+
+    def _release_request_slot(self):
+        """
+        Counts the end of the dispatch of a request
+        """
+        with self._admission_lock:
+            self._nb_in_flight -= 1
+
+    def _count_rejection(self, reason):
+        """
+        Counts a rejected request
+
+        :param reason: Rejection reason (key of the rejections counters)
+        """
+        with self._admission_lock:
+            self._rejections[reason] += 1
+
+    def get_admission_stats(self):
+        """
+        Returns the current state of the admission control
+
+        :return: A dictionary with the number of requests being dispatched
+                 (``in_flight``) and the counters of rejected requests, by
+                 reason (``rejected_in_flight``, ``rejected_queue``,
+                 ``rejected_delay`` and ``rejected_body_size``)
+        """
+        with self._admission_lock:
+            stats = {"in_flight": self._nb_in_flight}
+            for reason, count in self._rejections.items():
+                stats["rejected_" + reason] = count
+            return stats
+
 
 # ------------------------------------------------------------------------------
 
@@ -621,6 +2884,30 @@ class PooledJSONRPCServer(socketserver.ThreadingMixIn, SimpleJSONRPCServer):
     JSON-RPC server based on a thread pool
     """
 
+    # Maximum number of requests waiting for a thread of the pool
+    # (None: no limit). Other requests are rejected with a 503 error.
+    max_queue_size = None
+
+    # Name of the header giving the priority of a request (None to ignore it)
+    priority_header = None
+
+    # Maximum time to wait for the beginning of a request to classify it
+    classify_timeout = 1.0
+
+    # Number of bytes looked at to classify a request
+    classify_peek_size = 4096
+
+    # If True, the pool threads are shared fairly between clients
+    fair_queuing = False
+
+    # Name of the header identifying the client for the fair queuing
+    # (None to identify clients by their address)
+    client_id_header = None
+
+    # Maximum number of clients whose statistics are kept: those of the
+    # least recently served clients are forgotten
+    max_client_stats = 1000
+
     def __init__(
         self,
         addr,
@@ -642,10 +2929,16 @@ class PooledJSONRPCServer(socketserver.ThreadingMixIn, SimpleJSONRPCServer):
         :param bind_and_activate: If True, starts the server immediately
         :param address_family: The server listening address family
         :param config: A JSONRPClib Config instance
-        :param thread_pool: A ThreadPool object. The pool must be started.
+        :param thread_pool: A ThreadPool object or a thread-based
+                            concurrent.futures Executor. The pool must be
+                            started.
+        :raise ValueError: Process-based pool
         """
         # Normalize the thread pool
-        if thread_pool is None:
+        if _is_process_pool(thread_pool):
+            # Requests are handled by the server, which lives in this process
+            raise ValueError("Requests can't be handled in processes")
+        elif thread_pool is None:
             # Start a thread pool with  30 threads max, 0 thread min
             thread_pool = jsonrpclib.threadpool.ThreadPool(
                 30, 0, logname="PooledJSONRPCServer"
@@ -655,6 +2948,17 @@ class PooledJSONRPCServer(socketserver.ThreadingMixIn, SimpleJSONRPCServer):
         # Store the thread pool
         self.__request_pool = thread_pool
 
+        # Number of requests waiting for a thread
+        self.__nb_queued = 0
+
+        # Per-client queues and statistics (client -> [served, service time],
+        # from the least to the most recently served client)
+        self.__fair_queue = jsonrpclib.threadpool.FairQueue()
+        self.__client_stats = collections.OrderedDict()
+
+        # Set once serve_forever() has been called
+        self.__serving = False
+
         # Prepare the server
         SimpleJSONRPCServer.__init__(
             self,
@@ -671,17 +2975,366 @@ class PooledJSONRPCServer(socketserver.ThreadingMixIn, SimpleJSONRPCServer):
         """
         Handle a client request: queue it in the thread pool
         """
-        self.__request_pool.enqueue(
-            self.process_request_thread, request, client_address
+        with self._admission_lock:
+            if (
+                self.max_queue_size is not None
+                and self.__nb_queued >= self.max_queue_size
+            ):
+                # Too many waiting requests
+                self._rejections["queue"] += 1
+                queue_full = True
+            else:
+                self.__nb_queued += 1
+                queue_full = False
+
+        if queue_full:
+            self._reject_request(request)
+            return
+
+        pool = self.__request_pool
+        enqueue_priority = getattr(pool, "enqueue_priority", None)
+        try:
+            if enqueue_priority is not None and (
+                self.priority_header
+                or self._has_method_priorities()
+                or (self.fair_queuing and self.client_id_header)
+            ):
+                # Classify the request in the pool, before the queued ones
+                future = enqueue_priority(
+                    _CLASSIFY_PRIORITY,
+                    self.__classify_request,
+                    request,
+                    client_address,
+                )
+                self.__watch_request(future, request)
+            else:
+                self.__queue_request(request, client_address)
+        except Exception:
+            with self._admission_lock:
+                self.__nb_queued -= 1
+            raise
+
+    def __queue_request(
+        self, request, client_address, priority=0, client=None
+    ):
+        """
+        Queues the handling of a request in the pool
+
+        :param request: The client socket
+        :param client_address: The client address
+        :param priority: Priority of the request
+        :param client: Key of the client for the fair queuing (its address by
+                       default)
+        :raise Exception: Error queuing the request
+        """
+        pool = self.__request_pool
+        if not self.fair_queuing:
+            future = _enqueue(
+                pool,
+                priority,
+                self.process_request_thread,
+                request,
+                client_address,
+            )
+            self.__watch_request(future, request)
+            return
+
+        if client is None:
+            client = self.get_client_key(client_address)
+
+        # Queue the request in the client queue, and a task to handle the
+        # next request of the queues, chosen when a thread is available
+        self.__fair_queue.put(
+            client, (client, request, client_address), priority
+        )
+        try:
+            future = _enqueue(
+                pool, priority, self.__process_next_request, priority
+            )
+        except Exception:
+            self.__fair_queue.drop(priority)
+            raise
+
+        set_callback = getattr(future, "set_callback", None)
+        if set_callback is not None:
+            set_callback(self.__on_fair_task_done, priority)
+
+    def __watch_request(self, future, request):
+        """
+        Replies to the request if its task is dropped by the pool
+
+        :param future: The future of the task handling the request
+        :param request: The client socket
+        """
+        set_callback = getattr(future, "set_callback", None)
+        if set_callback is not None:
+            set_callback(self.__on_request_done, request)
+
+    def __classify_request(self, request, client_address):
+        """
+        Queues the handling of a request in the pool, with its priority
+
+        :param request: The client socket
+        :param client_address: The client address
+        """
+        data = self.__peek_request(request)
+        priority = self.get_request_priority(data)
+
+        client = None
+        if self.fair_queuing and self.client_id_header:
+            client = _find_header(data, self.client_id_header)
+            if client is not None:
+                client = utils.from_bytes(client)
+
+        try:
+            self.__queue_request(request, client_address, priority, client)
+        except Exception as ex:
+            # Full pool
+            _logger.warning("Error queuing request: %s", ex)
+            with self._admission_lock:
+                self.__nb_queued -= 1
+                self._rejections["queue"] += 1
+            self._reject_request(request)
+
+    def __process_next_request(self, priority):
+        """
+        Handles the next request to be served fairly, with the given priority
+
+        :param priority: Priority of the request
+        """
+        client, request, client_address = self.__fair_queue.get(priority)
+        start = _clock()
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            duration = _clock() - start
+            with self._admission_lock:
+                client_stats = self.__client_stats
+                stats = client_stats.pop(client, None) or [0, 0.0]
+                stats[0] += 1
+                stats[1] += duration
+                client_stats[client] = stats
+
+                # Client keys can come from a header: bound their number
+                while len(client_stats) > max(self.max_client_stats, 1):
+                    client_stats.popitem(last=False)
+
+    def __on_fair_task_done(self, _, exception, priority):
+        """
+        Rejects a request when a fair queuing task has been dropped by the
+        thread pool: the request is taken from the most loaded client
+
+        :param exception: The exception given to the future of the task
+        :param priority: Priority of the dropped task
+        """
+        if isinstance(exception, jsonrpclib.threadpool.TaskDropped):
+            try:
+                _, request, _ = self.__fair_queue.drop(priority)
+            except queue.Empty:
+                return
+
+            with self._admission_lock:
+                self.__nb_queued -= 1
+                self._rejections["delay"] += 1
+            self._reject_request(request)
+
+    def get_client_key(self, client_address):
+        """
+        Returns the key identifying a client for the fair queuing, when no
+        identity header is used
+
+        :param client_address: The client address
+        :return: The client host, or the whole address for non-IP sockets
+        """
+        if isinstance(client_address, tuple):
+            return client_address[0]
+        return client_address
+
+    def set_client_weight(self, client, weight):
+        """
+        Sets the share of the pool given to a client by the fair queuing
+        (1 by default)
+
+        :param client: Client key: its host or the value of its identity
+                       header
+        :param weight: Weight of the client (None to reset it)
+        :raise ValueError: Invalid weight
+        """
+        self.__fair_queue.set_weight(client, weight)
+
+    def get_client_stats(self):
+        """
+        Returns the statistics of the fair queuing, per client
+
+        :return: A client -> statistics dictionary, with the number of queued
+                 requests (``queued``), the number of handled requests
+                 (``served``) and their total handling time in seconds
+                 (``service_time``). Only the ``max_client_stats`` most
+                 recently served clients are described.
+        """
+        stats = {}
+        for client, depth in self.__fair_queue.depths().items():
+            stats[client] = {"queued": depth, "served": 0, "service_time": 0.0}
+
+        with self._admission_lock:
+            for client, (served, service_time) in self.__client_stats.items():
+                client_stats = stats.setdefault(client, {"queued": 0})
+                client_stats["served"] = served
+                client_stats["service_time"] = service_time
+        return stats
+
+    def __peek_request(self, request):
+        """
+        Returns the beginning of the request, without consuming it
+
+        :param request: The client socket
+        :return: The data received so far (can be empty)
+        """
+        try:
+            readable = select.select([request], [], [], self.classify_timeout)
+            if readable[0]:
+                return request.recv(self.classify_peek_size, socket.MSG_PEEK)
+        except (socket.error, ValueError):
+            # Connection error or unsupported peek (SSL)
+            pass
+        return b""
+
+    def get_request_priority(self, data):
+        """
+        Computes the priority of a request from its beginning: the value of
+        the priority header, if any, else the priority of the (first) called
+        method.
+
+        :param data: The beginning of the raw HTTP request
+        :return: The priority of the request (0 by default)
+        """
+        if self.priority_header:
+            value = _find_header(data, self.priority_header)
+            if value is not None:
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+
+        match = _METHOD_PATTERN.search(data.partition(b"\r\n\r\n")[2])
+        if match is not None:
+            return self.get_method_priority(utils.from_bytes(match.group(1)))
+        return 0
+
+    def __on_request_done(self, _, exception, request):
+        """
+        Rejects a request which has been dropped by the thread pool before
+        being handled
+
+        :param exception: The exception given to the future of the task
+        :param request: The client socket
+        """
+        if isinstance(exception, jsonrpclib.threadpool.TaskDropped):
+            with self._admission_lock:
+                self.__nb_queued -= 1
+                self._rejections["delay"] += 1
+            self._reject_request(request)
+
+    def process_request_thread(self, request, client_address):
+        """
+        Handles a client request in a thread of the pool
+        """
+        with self._admission_lock:
+            self.__nb_queued -= 1
+
+        socketserver.ThreadingMixIn.process_request_thread(
+            self, request, client_address
+        )
+
+    def _reject_request(self, request):
+        """
+        Replies to a request with a 503 error, without reading it, and closes
+        its connection
+
+        :param request: The client socket
+        """
+        response = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            "Retry-After: {0}\r\n"
+            "Content-Length: 0\r\n"
+            "Connection: close\r\n\r\n".format(self.retry_after)
         )
+        try:
+            request.sendall(utils.to_bytes(response))
+
+            # Consume what has already been received, to avoid the connection
+            # to be reset before the client reads the response
+            request.setblocking(False)
+            while request.recv(65536):
+                pass
+        except socket.error:
+            pass
+
+        self.shutdown_request(request)
+
+    def after_fork(self):
+        """
+        Resets the state of the server and restarts its request pool in a
+        child process.
+
+        :raise ValueError: The request pool can't be reset
+        """
+        SimpleJSONRPCServer.after_fork(self)
+        self.__nb_queued = 0
+        self.__fair_queue.clear()
+
+        reset = getattr(self.__request_pool, "after_fork", None)
+        if reset is None:
+            raise ValueError(
+                "The request pool of the server can't be used after a fork"
+            )
+        reset()
+
+    def _get_pools(self):
+        """
+        Returns the thread pools used by the server
+
+        :return: A name -> pool dictionary
+        """
+        pools = SimpleJSONRPCServer._get_pools(self)
+        pools["request"] = self.__request_pool
+        return pools
+
+    def get_admission_stats(self):
+        """
+        Returns the current state of the admission control
+
+        :return: See SimpleJSONRPCServer.get_admission_stats(), with the number
+                 of requests waiting for a thread (``queued``)
+        """
+        stats = SimpleJSONRPCServer.get_admission_stats(self)
+        stats["queued"] = self.__nb_queued
+        return stats
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Handles requests until shutdown() is called
+
+        :param poll_interval: Time between checks of the shutdown request
+                              (in seconds)
+        """
+        self.__serving = True
+        SimpleJSONRPCServer.serve_forever(self, poll_interval)
 
     def server_close(self):
         """
         Clean up the server
         """
-        SimpleJSONRPCServer.shutdown(self)
+        if self.__serving:
+            # shutdown() waits for serve_forever() to return: it would block
+            # forever if the loop never ran
+            SimpleJSONRPCServer.shutdown(self)
         SimpleJSONRPCServer.server_close(self)
-        self.__request_pool.stop()
+
+        # Executors are left to the application, which can share them
+        stop = getattr(self.__request_pool, "stop", None)
+        if stop is not None:
+            stop()
 
 
 # ------------------------------------------------------------------------------
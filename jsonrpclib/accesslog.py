@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Buffered access log of the JSON-RPC servers, written by a background thread
+
+:author: Thomas Calmant
+:copyright: Copyright 2025, Thomas Calmant
+:license: Apache License 2.0
+:version: 1.0.0
+
+..
+
+    Copyright 2025 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        https://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import json
+import logging
+import random
+import sys
+
+# Local modules
+import jsonrpclib.threadpool
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (1, 0, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+def format_json(record):
+    """
+    Formats an access log record as a JSON object
+
+    :param record: The record dictionary
+    :return: The log line
+    """
+    return json.dumps(record, sort_keys=True)
+
+
+class AccessLog(object):
+    """
+    Access log queuing its records in a bounded buffer, written by batches
+    from a background thread. Records are dropped when the buffer is full,
+    so that the request threads never wait for the log.
+    """
+
+    def __init__(
+        self,
+        stream=None,
+        logger=None,
+        formatter=format_json,
+        sample_rate=1.0,
+        queue_size=10000,
+        max_batch=500,
+        max_delay=0.5,
+    ):
+        """
+        :param stream: Output stream (sys.stderr by default)
+        :param logger: If given, a logging.Logger to send the lines to, at
+                       the INFO level, instead of the stream
+        :param formatter: Method converting a record dictionary to a line
+        :param sample_rate: Fraction of the successful requests to log (0 to
+                            1). Errors are always logged.
+        :param queue_size: Maximum number of buffered records
+        :param max_batch: Maximum number of records written at once
+        :param max_delay: Maximum time a record stays in the buffer (in
+                          seconds)
+        :raise ValueError: Invalid parameters
+        """
+        try:
+            sample_rate = float(sample_rate)
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid sample rate: {0}".format(ex))
+
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("Sample rate must be between 0 and 1")
+
+        self.stream = stream
+        self.logger = logger
+        self.formatter = formatter
+        self.sample_rate = sample_rate
+        self.__batcher = jsonrpclib.threadpool.MicroBatcher(
+            self.__write,
+            max_size=max_batch,
+            max_delay=max_delay,
+            queue_size=queue_size,
+            overflow=jsonrpclib.threadpool.OVERFLOW_DROP_NEW,
+            logname=__name__,
+        )
+
+    def log(self, record):
+        """
+        Queues a record, unless it is not sampled or the buffer is full
+
+        :param record: A dictionary describing the request; its ``status``
+                       entry is used to always log errors
+        :return: True if the record has been queued
+        """
+        if (
+            self.sample_rate < 1
+            and record.get("status", 0) < 400
+            and random.random() >= self.sample_rate
+        ):
+            return False
+
+        return self.__batcher.put(record)
+
+    def close(self, flush=True):
+        """
+        Stops the writer thread
+
+        :param flush: If True, write the buffered records before returning
+        """
+        self.__batcher.stop(flush)
+
+    def after_fork(self):
+        """
+        Resets the log in a child process: the writer thread of the parent
+        process doesn't exist anymore
+        """
+        self.__batcher.after_fork()
+
+    def get_stats(self):
+        """
+        Returns the statistics of the log
+
+        :return: A dictionary with the number of buffered (``queued``),
+                 written (``delivered``) and dropped (``dropped``) records,
+                 and the number of written batches (``batches``) and of
+                 batches which couldn't be written (``failed``)
+        """
+        return self.__batcher.get_stats()
+
+    def __write(self, records):
+        """
+        Writes a batch of records
+
+        :param records: A list of record dictionaries
+        """
+        lines = [self.formatter(record) for record in records]
+        if self.logger is not None:
+            for line in lines:
+                self.logger.info("%s", line)
+            return
+
+        stream = self.stream or sys.stderr
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
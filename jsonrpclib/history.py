@@ -25,6 +25,11 @@ The history module.
     limitations under the License.
 """
 
+# Standard library
+import threading
+
+# ------------------------------------------------------------------------------
+
 # Module version
 __version_info__ = (1, 0, 0)
 __version__ = ".".join(str(x) for x in __version_info__)
@@ -41,12 +46,15 @@ class History(object):
     session. A server using this should call "clear" after
     each request cycle in order to keep it from clogging
     memory.
+
+    The history can be shared by the threads of a client.
     """
 
     def __init__(self):
         """
         Sets up members
         """
+        self.__lock = threading.Lock()
         self.requests = []
         self.responses = []
 
@@ -56,7 +64,8 @@ class History(object):
 
         :param response_obj: Response content
         """
-        self.responses.append(response_obj)
+        with self.__lock:
+            self.responses.append(response_obj)
 
     def add_request(self, request_obj):
         """
@@ -64,31 +73,35 @@ class History(object):
 
         :param request_obj: A request object
         """
-        self.requests.append(request_obj)
+        with self.__lock:
+            self.requests.append(request_obj)
 
     @property
     def request(self):
         """
         Returns the latest stored request or None
         """
-        try:
-            return self.requests[-1]
-        except IndexError:
-            return None
+        with self.__lock:
+            try:
+                return self.requests[-1]
+            except IndexError:
+                return None
 
     @property
     def response(self):
         """
         Returns the latest stored response or None
         """
-        try:
-            return self.responses[-1]
-        except IndexError:
-            return None
+        with self.__lock:
+            try:
+                return self.responses[-1]
+            except IndexError:
+                return None
 
     def clear(self):
         """
         Clears the history lists
         """
-        del self.requests[:]
-        del self.responses[:]
+        with self.__lock:
+            del self.requests[:]
+            del self.responses[:]
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Execution pool running the CPU-bound methods of the JSON-RPC servers in
+subinterpreters, with a fallback on older Python versions
+
+:author: Thomas Calmant
+:copyright: Copyright 2025, Thomas Calmant
+:license: Apache License 2.0
+:version: 1.0.0
+
+..
+
+    Copyright 2025 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        https://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import importlib
+import inspect
+import json
+import logging
+
+try:
+    # Python 3.2+
+    from concurrent.futures import (
+        Future,
+        ProcessPoolExecutor,
+        ThreadPoolExecutor,
+    )
+except ImportError:
+    # Python 2
+    Future = ProcessPoolExecutor = ThreadPoolExecutor = None  # type: ignore
+
+try:
+    # Python 3.14+
+    from concurrent.futures import InterpreterPoolExecutor
+except ImportError:
+    InterpreterPoolExecutor = None  # type: ignore
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (1, 0, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Execution backends
+BACKEND_INTERPRETER = "interpreter"
+BACKEND_PROCESS = "process"
+BACKEND_THREAD = "thread"
+
+_logger = logging.getLogger(__name__)
+
+# (module, qualified name) -> function, in each interpreter or process
+_FUNCTIONS = {}
+
+# ------------------------------------------------------------------------------
+
+
+def _get_function(module_name, qualname):
+    """
+    Imports a module-level function
+
+    :param module_name: Name of the module of the function
+    :param qualname: Qualified name of the function in its module
+    :return: The function
+    :raise ImportError: Module not found
+    :raise AttributeError: Function not found
+    """
+    key = (module_name, qualname)
+    try:
+        return _FUNCTIONS[key]
+    except KeyError:
+        pass
+
+    function = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        function = getattr(function, part)
+
+    _FUNCTIONS[key] = function
+    return function
+
+
+def _run_json_call(module_name, qualname, payload):
+    """
+    Calls a function in the worker interpreter, process or thread
+
+    :param module_name: Name of the module of the function
+    :param qualname: Qualified name of the function in its module
+    :param payload: The JSON-encoded parameters of the call, as bytes
+    :return: The JSON-encoded result of the call, as bytes
+    """
+    function = _get_function(module_name, qualname)
+    params = json.loads(payload.decode("utf-8"))
+    if isinstance(params, dict):
+        result = function(**params)
+    else:
+        result = function(*params)
+    return json.dumps(result).encode("utf-8")
+
+
+def _decode_result(source, target):
+    """
+    Copies the decoded result of a worker future to the future returned to
+    the caller
+
+    :param source: The future of the worker call
+    :param target: The future returned by submit_call()
+    """
+    exception = source.exception()
+    if exception is not None:
+        target.set_exception(exception)
+        return
+
+    try:
+        result = json.loads(source.result().decode("utf-8"))
+    except Exception as ex:
+        target.set_exception(ex)
+    else:
+        target.set_result(result)
+
+
+class InterpreterPool(object):
+    """
+    Pool executing module-level functions in subinterpreters, each with its
+    own GIL, when concurrent.futures.InterpreterPoolExecutor is available
+    (Python 3.14+). Otherwise, the functions are executed by the fallback
+    backend: a process pool or a thread pool.
+
+    Calls are given to the workers as the names of the functions and their
+    JSON-encoded parameters, and their results are returned JSON-encoded:
+    nothing is shared between the interpreters.
+
+    The pool can be given to SimpleJSONRPCDispatcher.set_cpu_bound_pool().
+    """
+
+    def __init__(self, max_workers=None, fallback=BACKEND_PROCESS):
+        """
+        :param max_workers: Maximum number of workers (default of the
+                            concurrent.futures executors if None)
+        :param fallback: Backend to use if subinterpreters are not available:
+                         BACKEND_PROCESS or BACKEND_THREAD
+        :raise ValueError: Invalid fallback backend
+        :raise NotImplementedError: concurrent.futures is not available
+        """
+        if fallback not in (BACKEND_PROCESS, BACKEND_THREAD):
+            raise ValueError("Invalid fallback backend: {0}".format(fallback))
+
+        if ThreadPoolExecutor is None:
+            raise NotImplementedError("concurrent.futures is not available")
+
+        if InterpreterPoolExecutor is not None:
+            self.__backend = BACKEND_INTERPRETER
+            self.__executor = InterpreterPoolExecutor(max_workers)
+        elif fallback == BACKEND_PROCESS:
+            self.__backend = BACKEND_PROCESS
+            self.__executor = ProcessPoolExecutor(max_workers)
+        else:
+            self.__backend = BACKEND_THREAD
+            self.__executor = ThreadPoolExecutor(max_workers)
+
+        if self.__backend != BACKEND_INTERPRETER:
+            _logger.debug(
+                "Subinterpreters are not available: using the %s backend",
+                self.__backend,
+            )
+
+    @property
+    def backend(self):
+        """
+        The backend executing the calls: BACKEND_INTERPRETER, BACKEND_PROCESS
+        or BACKEND_THREAD
+        """
+        return self.__backend
+
+    def submit_call(self, function, params):
+        """
+        Executes a call to a module-level function in a worker
+
+        :param function: A function defined at the top level of a module
+                         other than __main__
+        :param params: A list or a dictionary of JSON-serializable parameters
+        :return: A concurrent.futures Future giving the JSON-decoded result
+        :raise ValueError: The function is not defined at module level, or
+                           the parameters can't be encoded in JSON
+        """
+        module_name = getattr(function, "__module__", None)
+        qualname = getattr(function, "__qualname__", None)
+        if (
+            not module_name
+            or not qualname
+            or "<" in qualname
+            or inspect.ismethod(function)
+        ):
+            # The workers would import another object, without its instance
+            raise ValueError(
+                "{0!r} is not a module-level function".format(function)
+            )
+        elif module_name == "__main__":
+            # The workers have their own __main__ module
+            raise ValueError(
+                "{0!r} is defined in the __main__ module".format(function)
+            )
+
+        try:
+            payload = json.dumps(params).encode("utf-8")
+        except (TypeError, ValueError) as ex:
+            raise ValueError(
+                "Parameters can't be sent to a worker: {0}".format(ex)
+            )
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.__executor.submit(
+            _run_json_call, module_name, qualname, payload
+        ).add_done_callback(lambda source: _decode_result(source, future))
+        return future
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Executes a method in a worker, as concurrent.futures.Executor does:
+        with subinterpreters or processes, the method and its arguments must
+        be shareable or picklable
+
+        :param method: The method to execute
+        :return: A concurrent.futures Future
+        """
+        return self.__executor.submit(method, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """
+        Stops the workers
+
+        :param wait: If True, wait for the current calls to end
+        """
+        self.__executor.shutdown(wait)
@@ -50,6 +50,9 @@ class JsonHandler(object):
     Parent class for JSON handlers
     """
 
+    # The loads method accepts bytearray objects (mutable buffers)
+    supports_bytearray = not PYTHON_2
+
     def get_methods(self):
         """
         Returns the loads and dumps methods
@@ -69,6 +72,8 @@ class CJsonHandler(JsonHandler):
     Handler based on cjson
     """
 
+    supports_bytearray = False
+
     def get_methods(self):
         import cjson
 
@@ -83,6 +88,8 @@ class SimpleJsonHandler(JsonHandler):
     Handler based on simplejson
     """
 
+    supports_bytearray = False
+
     def get_methods(self):
         import simplejson
 
@@ -94,6 +101,8 @@ class UJsonHandler(JsonHandler):
     Handler based on ujson
     """
 
+    supports_bytearray = False
+
     def get_methods(self):
         import ujson
 
@@ -108,6 +117,8 @@ class OrJsonHandler(JsonHandler):
     Handler based on orjson
     """
 
+    supports_bytearray = True
+
     def get_methods(self):
         import orjson
 
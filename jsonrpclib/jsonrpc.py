@@ -112,7 +112,8 @@ _logger = logging.getLogger(__name__)
 # ------------------------------------------------------------------------------
 # JSON library selection
 
-jloads, jdumps = jsonlib.get_handler_methods()
+_json_handler = jsonlib.get_handler()
+jloads, jdumps = _json_handler.get_methods()
 
 # ------------------------------------------------------------------------------
 # XMLRPClib re-implementations
@@ -413,9 +414,9 @@ class TransportMixIn(object):
         if "user-agent" not in additional_headers:
             connection.putheader("User-Agent", self.user_agent)
 
-        connection.endheaders()
-        if request_body:
-            connection.send(request_body)
+        # Send the body with the headers: sending it separately triggers the
+        # Nagle/delayed ACK stall on persistent connections
+        connection.endheaders(request_body)
 
     @staticmethod
     def getparser():
@@ -1334,14 +1335,18 @@ def loads(data, config=jsonrpclib.config.DEFAULT):
     """
     Loads a JSON-RPC request/response string. Calls jsonclass to load beans
 
-    :param data: A JSON-RPC string
+    :param data: A JSON-RPC string, or its raw bytes (bytes or bytearray)
     :param config: A JSONRPClib Config instance (or None for default values)
     :return: A parsed dictionary or None
     """
-    if data == "":
+    if not data:
         # Notification
         return None
 
+    if isinstance(data, bytearray) and not _json_handler.supports_bytearray:
+        # The JSON library only accepts immutable strings
+        data = bytes(data)
+
     # Parse the JSON dictionary
     result = jloads(data)
 
@@ -0,0 +1,596 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Metrics of the JSON-RPC servers: calls, errors, latencies and thread pools
+
+:author: Thomas Calmant
+:copyright: Copyright 2025, Thomas Calmant
+:license: Apache License 2.0
+:version: 1.0.0
+
+..
+
+    Copyright 2025 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        https://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import bisect
+import itertools
+import threading
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (1, 0, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+# Default upper bounds of the latency histograms buckets (in seconds)
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Phases of the handling of a request
+PHASE_DISPATCH = "dispatch"
+PHASE_SERIALIZATION = "serialization"
+PHASE_TOTAL = "total"
+
+# Label of the requests which are not calls to a known method
+LABEL_BATCH = "(batch)"
+LABEL_INVALID = "(invalid)"
+LABEL_UNKNOWN = "(unknown)"
+
+# Content type of the Prometheus text format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Number of stripes of the structures updated by many threads
+NB_STRIPES = 16
+
+# Stripe index of each thread, assigned on first use
+_STRIPE = threading.local()
+_STRIPE_COUNTER = itertools.count()
+_STRIPE_LOCK = threading.Lock()
+
+# ------------------------------------------------------------------------------
+
+
+def get_stripe():
+    """
+    Returns the stripe index of the calling thread. Indices are given in turn
+    to the threads, so that concurrent threads rarely share a stripe.
+
+    :return: The stripe index of the thread, between 0 and NB_STRIPES - 1
+    """
+    try:
+        return _STRIPE.index
+    except AttributeError:
+        with _STRIPE_LOCK:
+            index = _STRIPE.index = next(_STRIPE_COUNTER) % NB_STRIPES
+        return index
+
+
+class StripedCounter(object):
+    """
+    Counter split in stripes, each with its own lock: threads updating the
+    counter concurrently don't contend on a single lock, which matters when
+    the interpreter runs without the GIL.
+    """
+
+    __slots__ = ("__stripes",)
+
+    def __init__(self):
+        # [lock, value] pairs
+        self.__stripes = tuple(
+            [threading.Lock(), 0] for _ in range(NB_STRIPES)
+        )
+
+    def add(self, value=1):
+        """
+        Adds a value to the counter
+
+        :param value: Value to add (can be negative)
+        """
+        stripe = self.__stripes[get_stripe()]
+        with stripe[0]:
+            stripe[1] += value
+
+    @property
+    def value(self):
+        """
+        The sum of the stripes, each read with its lock
+        """
+        total = 0
+        for stripe in self.__stripes:
+            with stripe[0]:
+                total += stripe[1]
+        return total
+
+
+# ------------------------------------------------------------------------------
+
+
+class Histogram(object):
+    """
+    Distribution of observed values in buckets. Not thread-safe: the
+    registry holding it must serialize the accesses.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: Sorted upper bounds of the buckets
+        """
+        self.buckets = buckets
+        # Last count is for the values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Adds a value to the distribution
+
+        :param value: The observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def add(self, other):
+        """
+        Adds the values of another histogram, with the same buckets
+
+        :param other: Another Histogram
+        """
+        for idx, count in enumerate(other.counts):
+            self.counts[idx] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def to_dict(self):
+        """
+        Returns the content of the histogram
+
+        :return: A dictionary with the number of values (``count``), their
+                 sum (``sum``) and the cumulative counts of the buckets
+                 (``buckets``, a list of (upper bound, count) pairs, the last
+                 bound being ``"+Inf"``)
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            buckets.append((bound, total))
+
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class _MethodMetrics(object):
+    """
+    Metrics of a method
+    """
+
+    __slots__ = ("calls", "errors", "latencies")
+
+    def __init__(self):
+        self.calls = 0
+        # Fault code -> count
+        self.errors = {}
+        # Phase -> Histogram, created on first use
+        self.latencies = {}
+
+
+class _Shard(object):
+    """
+    Part of the metrics of a registry, updated by the threads of a stripe
+    """
+
+    __slots__ = ("lock", "methods", "in_flight", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Method label -> _MethodMetrics
+        self.methods = {}
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+def _escape(value):
+    """
+    Escapes a label value for the Prometheus text format
+    """
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_value(value):
+    """
+    Formats a sample value or a bucket bound for the Prometheus text format
+    """
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry(object):
+    """
+    Collects the metrics of a JSON-RPC dispatcher.
+
+    Metrics are stored in shards, each thread updating the shard of its
+    stripe, and are merged when a snapshot is made.
+    """
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets: Upper bounds of the latency histograms buckets (in
+                        seconds, see DEFAULT_BUCKETS)
+        """
+        if buckets is None:
+            buckets = DEFAULT_BUCKETS
+        self.__buckets = tuple(sorted(float(bound) for bound in buckets))
+
+        self.__shards = tuple(_Shard() for _ in range(NB_STRIPES))
+
+    def __get_shard(self):
+        """
+        Returns the shard of the calling thread
+        """
+        return self.__shards[get_stripe()]
+
+    @staticmethod
+    def __get_method(shard, method):
+        """
+        Returns the metrics of a method in a shard. Must be called with the
+        lock of the shard held.
+
+        :param shard: A _Shard
+        :param method: Label of the method
+        """
+        try:
+            return shard.methods[method]
+        except KeyError:
+            metrics = shard.methods[method] = _MethodMetrics()
+            return metrics
+
+    def __get_histogram(self, metrics, phase):
+        """
+        Returns the latency histogram of a method for a phase, creating it
+        if necessary
+        """
+        try:
+            return metrics.latencies[phase]
+        except KeyError:
+            histogram = metrics.latencies[phase] = Histogram(self.__buckets)
+            return histogram
+
+    def __observe(self, metrics, phase, duration):
+        """
+        Records a duration in a latency histogram of a method. Must be called
+        with the lock of the shard held.
+        """
+        self.__get_histogram(metrics, phase).observe(duration)
+
+    def record_call(self, method, duration, fault_code=None):
+        """
+        Records the dispatch of a method call
+
+        :param method: Label of the method
+        :param duration: Time spent to dispatch the call (in seconds)
+        :param fault_code: Code of the fault returned by the call, if any
+        """
+        shard = self.__get_shard()
+        with shard.lock:
+            metrics = self.__get_method(shard, method)
+            metrics.calls += 1
+            if fault_code is not None:
+                metrics.errors[fault_code] = (
+                    metrics.errors.get(fault_code, 0) + 1
+                )
+            self.__observe(metrics, PHASE_DISPATCH, duration)
+
+    def record_request(self, method, serialization, total):
+        """
+        Records the handling of a request
+
+        :param method: Label of the method, or LABEL_BATCH/LABEL_INVALID
+        :param serialization: Time spent to serialize the response (in
+                              seconds)
+        :param total: Total time spent to handle the request (in seconds)
+        """
+        shard = self.__get_shard()
+        with shard.lock:
+            metrics = self.__get_method(shard, method)
+            self.__observe(metrics, PHASE_SERIALIZATION, serialization)
+            self.__observe(metrics, PHASE_TOTAL, total)
+
+    def record_bytes(self, received, sent):
+        """
+        Records the size of a request and of its response
+
+        :param received: Size of the request body (in bytes)
+        :param sent: Size of the response body (in bytes)
+        """
+        shard = self.__get_shard()
+        with shard.lock:
+            shard.bytes_in += received
+            shard.bytes_out += sent
+
+    def request_started(self):
+        """
+        Counts a request being handled
+        """
+        shard = self.__get_shard()
+        with shard.lock:
+            shard.in_flight += 1
+
+    def request_done(self):
+        """
+        Counts the end of the handling of a request
+        """
+        shard = self.__get_shard()
+        with shard.lock:
+            shard.in_flight -= 1
+
+    def snapshot(self, pools=None):
+        """
+        Returns the current values of the metrics
+
+        :param pools: A name -> pool dictionary of the thread pools to
+                      describe (pools without ``get_stats()`` are ignored)
+        :return: A dictionary with the number of requests being handled
+                 (``in_flight``), the received and sent bytes (``bytes_in``,
+                 ``bytes_out``), the metrics of each method (``methods``:
+                 ``calls``, ``errors`` by fault code and ``latency`` by phase)
+                 and the statistics of the pools (``pools``)
+        """
+        # Merge the shards
+        merged = _Shard()
+        for shard in self.__shards:
+            with shard.lock:
+                merged.in_flight += shard.in_flight
+                merged.bytes_in += shard.bytes_in
+                merged.bytes_out += shard.bytes_out
+                for method, metrics in shard.methods.items():
+                    total = self.__get_method(merged, method)
+                    total.calls += metrics.calls
+                    for code, count in metrics.errors.items():
+                        total.errors[code] = total.errors.get(code, 0) + count
+                    for phase, histogram in metrics.latencies.items():
+                        self.__get_histogram(total, phase).add(histogram)
+
+        methods = {}
+        for method, metrics in merged.methods.items():
+            methods[method] = {
+                "calls": metrics.calls,
+                "errors": dict(
+                    (str(code), count)
+                    for code, count in metrics.errors.items()
+                ),
+                "latency": dict(
+                    (phase, histogram.to_dict())
+                    for phase, histogram in metrics.latencies.items()
+                ),
+            }
+
+        result = {
+            "in_flight": merged.in_flight,
+            "bytes_in": merged.bytes_in,
+            "bytes_out": merged.bytes_out,
+            "methods": methods,
+        }
+
+        pools_stats = {}
+        for name, pool in (pools or {}).items():
+            get_stats = getattr(pool, "get_stats", None)
+            if get_stats is not None:
+                pools_stats[name] = get_stats()
+        result["pools"] = pools_stats
+        return result
+
+    def render(self, pools=None):
+        """
+        Returns the metrics in the Prometheus text exposition format
+
+        :param pools: A name -> pool dictionary of the thread pools to
+                      describe
+        :return: The metrics, as a string
+        """
+        snapshot = self.snapshot(pools)
+        lines = []
+
+        def family(name, kind, description):
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+
+        def sample(name, value, **labels):
+            if labels:
+                name = "{0}{{{1}}}".format(
+                    name,
+                    ",".join(
+                        '{0}="{1}"'.format(key, _escape(labels[key]))
+                        for key in sorted(labels)
+                    ),
+                )
+            lines.append("{0} {1}".format(name, _format_value(value)))
+
+        family("jsonrpc_in_flight_requests", "gauge", "Requests being handled")
+        sample("jsonrpc_in_flight_requests", snapshot["in_flight"])
+        family("jsonrpc_received_bytes_total", "counter", "Received bytes")
+        sample("jsonrpc_received_bytes_total", snapshot["bytes_in"])
+        family("jsonrpc_sent_bytes_total", "counter", "Sent bytes")
+        sample("jsonrpc_sent_bytes_total", snapshot["bytes_out"])
+
+        methods = sorted(snapshot["methods"].items())
+        family("jsonrpc_calls_total", "counter", "Dispatched method calls")
+        for method, metrics in methods:
+            if metrics["calls"]:
+                sample("jsonrpc_calls_total", metrics["calls"], method=method)
+
+        family("jsonrpc_errors_total", "counter", "Method calls by fault code")
+        for method, metrics in methods:
+            for code, count in sorted(metrics["errors"].items()):
+                sample("jsonrpc_errors_total", count, method=method, code=code)
+
+        family(
+            "jsonrpc_latency_seconds",
+            "histogram",
+            "Time spent to dispatch calls, serialize and handle requests",
+        )
+        for method, metrics in methods:
+            for phase, histogram in sorted(metrics["latency"].items()):
+                for bound, count in histogram["buckets"]:
+                    sample(
+                        "jsonrpc_latency_seconds_bucket",
+                        count,
+                        method=method,
+                        phase=phase,
+                        le=_format_value(bound),
+                    )
+                sample(
+                    "jsonrpc_latency_seconds_sum",
+                    histogram["sum"],
+                    method=method,
+                    phase=phase,
+                )
+                sample(
+                    "jsonrpc_latency_seconds_count",
+                    histogram["count"],
+                    method=method,
+                    phase=phase,
+                )
+
+        pools = sorted(snapshot["pools"].items())
+        for key, name, kind, description in (
+            ("queue_depth", "jsonrpc_pool_queue_depth", "gauge", "Queued tasks"),
+            ("threads", "jsonrpc_pool_threads", "gauge", "Pool threads"),
+            (
+                "active_threads",
+                "jsonrpc_pool_active_threads",
+                "gauge",
+                "Pool threads executing a task",
+            ),
+            (
+                "started",
+                "jsonrpc_pool_started_tasks_total",
+                "counter",
+                "Started tasks",
+            ),
+            (
+                "wait_time",
+                "jsonrpc_pool_wait_seconds_total",
+                "counter",
+                "Time spent by the started tasks in the queue",
+            ),
+            (
+                "completed",
+                "jsonrpc_pool_completed_tasks_total",
+                "counter",
+                "Finished tasks",
+            ),
+            (
+                "failed",
+                "jsonrpc_pool_failed_tasks_total",
+                "counter",
+                "Tasks which raised an exception",
+            ),
+            (
+                "busy_time",
+                "jsonrpc_pool_busy_seconds_total",
+                "counter",
+                "Time spent by the threads executing tasks",
+            ),
+            (
+                "rejected",
+                "jsonrpc_pool_rejected_tasks_total",
+                "counter",
+                "Tasks rejected or dropped as the queue was full",
+            ),
+            (
+                "scale_ups",
+                "jsonrpc_pool_scale_ups_total",
+                "counter",
+                "Threads added by the autoscaling",
+            ),
+            (
+                "scale_downs",
+                "jsonrpc_pool_scale_downs_total",
+                "counter",
+                "Threads retired by the autoscaling",
+            ),
+            (
+                "utilization",
+                "jsonrpc_pool_utilization",
+                "gauge",
+                "Fraction of the time the threads spent executing tasks",
+            ),
+        ):
+            family(name, kind, description)
+            for pool, stats in pools:
+                if stats.get(key) is not None:
+                    sample(name, stats[key], pool=pool)
+
+        for key, name, description in (
+            (
+                "wait_histogram",
+                "jsonrpc_pool_task_wait_seconds",
+                "Time spent by the tasks in the queue",
+            ),
+            (
+                "run_histogram",
+                "jsonrpc_pool_task_run_seconds",
+                "Time spent executing the tasks",
+            ),
+        ):
+            family(name, "histogram", description)
+            for pool, stats in pools:
+                histogram = stats.get(key)
+                if histogram is None:
+                    continue
+
+                for bound, count in histogram["buckets"]:
+                    sample(
+                        name + "_bucket",
+                        count,
+                        pool=pool,
+                        le=_format_value(bound),
+                    )
+                sample(name + "_sum", histogram["sum"], pool=pool)
+                sample(name + "_count", histogram["count"], pool=pool)
+
+        lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Pre-fork multi-process runner for the JSON-RPC servers
+
+:author: Thomas Calmant
+:copyright: Copyright 2025, Thomas Calmant
+:license: Apache License 2.0
+:version: 1.0.0
+
+..
+
+    Copyright 2025 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        https://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import errno
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (1, 0, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+
+def _cpu_count():
+    """
+    Returns the number of CPUs available on this host (at least 1)
+    """
+    try:
+        # Python 3.4+
+        count = os.cpu_count()
+    except AttributeError:
+        # Python 2
+        import multiprocessing
+
+        try:
+            count = multiprocessing.cpu_count()
+        except NotImplementedError:
+            count = None
+
+    return count or 1
+
+
+class PreforkServer(object):
+    """
+    Runs a JSON-RPC server loop in several pre-forked worker processes.
+
+    The master process only supervises its workers: it restarts them when
+    they die and stops them when it is shut down.
+    """
+
+    def __init__(
+        self,
+        server,
+        nb_workers=None,
+        reuse_port=False,
+        initializer=None,
+        logname=None,
+    ):
+        """
+        Sets up the pre-fork runner.
+
+        In the default mode, the listening socket of the given server is
+        shared by all the workers. In ``reuse_port`` mode, each worker binds
+        its own socket with ``SO_REUSEPORT`` and lets the kernel balance the
+        connections: the server must then have been created with
+        ``bind_and_activate=False``.
+
+        :param server: A SimpleJSONRPCServer (or PooledJSONRPCServer) with its
+                       functions already registered
+        :param nb_workers: Number of worker processes (one per CPU by default)
+        :param reuse_port: If True, each worker listens on its own socket
+        :param initializer: Method without argument called in each worker
+                            process, before it starts serving
+        :param logname: Name of the logger
+        :raise ValueError: Invalid number of workers or unsupported mode
+        :raise OSError: The platform doesn't support fork()
+        """
+        if not hasattr(os, "fork"):
+            raise OSError("Pre-fork mode requires os.fork()")
+
+        if nb_workers is None:
+            nb_workers = _cpu_count()
+
+        try:
+            nb_workers = int(nb_workers)
+            if nb_workers < 1:
+                raise ValueError("Number of workers must be greater than 0")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid number of workers: {0}".format(ex))
+
+        if reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise ValueError("SO_REUSEPORT is not supported here")
+
+            if server.address_family not in (socket.AF_INET, socket.AF_INET6):
+                raise ValueError("SO_REUSEPORT requires a TCP/IP server")
+
+        self._server = server
+        self._nb_workers = nb_workers
+        self._reuse_port = reuse_port
+        self._initializer = initializer
+
+        # The logger
+        self._logger = logging.getLogger(logname or __name__)
+
+        # PIDs of the running workers
+        self._workers = set()
+        self.__lock = threading.Lock()
+
+        # Supervision loop control
+        self._started = False
+        self._shutdown_event = threading.Event()
+
+    @property
+    def server_address(self):
+        """
+        The address the workers are listening to
+        """
+        return self._server.server_address
+
+    @property
+    def workers(self):
+        """
+        The PIDs of the current worker processes
+        """
+        with self.__lock:
+            return sorted(self._workers)
+
+    def start(self):
+        """
+        Prepares the listening socket and forks the workers.
+        Does nothing if the workers have already been started.
+        """
+        if self._started:
+            return
+
+        if self._reuse_port:
+            # Reserve the address (and resolve the port) without listening:
+            # the master must not receive any connection
+            self._server.allow_reuse_port = True
+            self._server.server_bind()
+
+        self._started = True
+        self._shutdown_event.clear()
+        self.__spawn_workers()
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Starts the workers and supervises them until shutdown() is called.
+        The workers are stopped before this method returns.
+
+        :param poll_interval: Delay between two checks of the workers state
+        """
+        self.start()
+        try:
+            while not self._shutdown_event.is_set():
+                self._shutdown_event.wait(poll_interval)
+                self.__reap_workers()
+                if not self._shutdown_event.is_set():
+                    self.__spawn_workers()
+        finally:
+            self.stop()
+
+    def shutdown(self):
+        """
+        Stops the supervision loop of serve_forever()
+        """
+        self._shutdown_event.set()
+
+    def stop(self, timeout=10):
+        """
+        Gracefully stops the workers and closes the listening socket.
+        Workers still alive after the timeout are killed.
+
+        :param timeout: Time given to the workers to stop (in seconds)
+        """
+        self._shutdown_event.set()
+        if not self._started:
+            return
+
+        with self.__lock:
+            pids = list(self._workers)
+
+        # Ask workers to stop
+        for pid in pids:
+            self.__kill(pid, signal.SIGTERM)
+
+        deadline = time.time() + timeout
+        for pid in pids:
+            while not self.__wait_worker(pid):
+                if time.time() > deadline:
+                    self._logger.warning(
+                        "Worker %d didn't stop in time: killing it", pid
+                    )
+                    self.__kill(pid, signal.SIGKILL)
+                    self.__wait_worker(pid, True)
+                    break
+
+                time.sleep(0.05)
+
+        with self.__lock:
+            self._workers.clear()
+
+        # The master doesn't run the server loop: only close its socket
+        self._server.socket.close()
+        self._started = False
+
+    def __kill(self, pid, signum):
+        """
+        Sends a signal to a worker, ignoring already dead processes
+
+        :param pid: PID of the worker
+        :param signum: Signal to send
+        """
+        try:
+            os.kill(pid, signum)
+        except OSError as ex:
+            if ex.errno != errno.ESRCH:
+                raise
+
+    def __wait_worker(self, pid, block=False):
+        """
+        Checks if the given worker has stopped, and forgets it if so
+
+        :param pid: PID of the worker
+        :param block: If True, waits for the worker to stop
+        :return: True if the worker has stopped
+        """
+        try:
+            result, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+        except OSError as ex:
+            if ex.errno != errno.ECHILD:
+                raise
+
+            # Not our child anymore
+            result, status = pid, 0
+
+        if result == 0:
+            # Still running
+            return False
+
+        with self.__lock:
+            self._workers.discard(pid)
+
+        if status and not self._shutdown_event.is_set():
+            self._logger.warning(
+                "Worker %d stopped unexpectedly (status %d)", pid, status
+            )
+        return True
+
+    def __reap_workers(self):
+        """
+        Forgets about the workers which have stopped
+        """
+        with self.__lock:
+            pids = list(self._workers)
+
+        for pid in pids:
+            self.__wait_worker(pid)
+
+    def __spawn_workers(self):
+        """
+        Forks as many workers as necessary
+        """
+        while True:
+            with self.__lock:
+                if len(self._workers) >= self._nb_workers:
+                    return
+
+            pid = os.fork()
+            if pid == 0:
+                # Never returns
+                self.__run_worker()
+
+            with self.__lock:
+                self._workers.add(pid)
+            self._logger.debug("Started worker %d", pid)
+
+    def __run_worker(self):
+        """
+        Worker process main loop
+        """
+        server = self._server
+        exit_code = 0
+
+        try:
+            if self._reuse_port:
+                # Listen on a socket of our own
+                server.socket.close()
+                server.socket = socket.socket(
+                    server.address_family, server.socket_type
+                )
+                server.allow_reuse_port = True
+                server.server_bind()
+                server.server_activate()
+
+            def on_terminate(signum, frame):
+                """
+                Stops the server loop (from another thread, as shutdown()
+                waits for serve_forever() to return)
+                """
+                thread = threading.Thread(target=server.shutdown)
+                thread.daemon = True
+                thread.start()
+
+            try:
+                signal.signal(signal.SIGTERM, on_terminate)
+                # The master handles keyboard interruptions
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+            except ValueError:
+                # Not in the main thread
+                pass
+
+            # Restart the thread pools of the server
+            after_fork = getattr(server, "after_fork", None)
+            if after_fork is not None:
+                after_fork()
+
+            if self._initializer is not None:
+                self._initializer()
+
+            server.serve_forever()
+        except BaseException as ex:
+            self._logger.exception("Error in worker %d: %s", os.getpid(), ex)
+            exit_code = 1
+        finally:
+            try:
+                server.server_close()
+            except Exception:
+                pass
+
+            # Don't return to the caller of fork()
+            os._exit(exit_code)
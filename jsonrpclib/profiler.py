@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -- Content-Encoding: UTF-8 --
+"""
+Sampling profiler of the requests handled by the JSON-RPC servers
+
+:author: Thomas Calmant
+:copyright: Copyright 2025, Thomas Calmant
+:license: Apache License 2.0
+:version: 1.0.0
+
+..
+
+    Copyright 2025 Thomas Calmant
+
+    Licensed under the Apache License, Version 2.0 (the "License");
+    you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+        https://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software
+    distributed under the License is distributed on an "AS IS" BASIS,
+    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and
+    limitations under the License.
+"""
+
+# Standard library
+import collections
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import traceback
+
+# ------------------------------------------------------------------------------
+
+# Module version
+__version_info__ = (1, 0, 0)
+__version__ = ".".join(str(x) for x in __version_info__)
+
+# Documentation strings format
+__docformat__ = "restructuredtext en"
+
+# ------------------------------------------------------------------------------
+
+try:
+    # Python 3.3+
+    _clock = time.monotonic
+except AttributeError:
+    # Python 2
+    _clock = time.time
+
+# Characters replaced in the names of the dump files
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+_logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------------------
+
+
+def _copy_stats(stats):
+    """
+    Copies profiling statistics
+
+    :param stats: A pstats.Stats object
+    :return: A new pstats.Stats object
+    """
+    copy = pstats.Stats()
+    copy.add(stats)
+    return copy
+
+
+class RequestProfiler(object):
+    """
+    Profiles a sample of the method calls with cProfile, aggregating the
+    statistics by method, and logs the calls slower than a threshold with
+    the stack of their thread.
+
+    The profiler does nothing until it is enabled, which can be done at
+    runtime: with enable() or toggle(), from a signal handler (see
+    install_signal_handler()) or through RPC methods (see
+    SimpleJSONRPCDispatcher.register_profiler_functions()).
+    """
+
+    def __init__(
+        self,
+        sample_rate=0.01,
+        slow_threshold=None,
+        slow_log_size=100,
+        dump_dir=None,
+    ):
+        """
+        :param sample_rate: Fraction of the calls to profile (0 to 1)
+        :param slow_threshold: Duration above which a call is logged as slow
+                               (in seconds, None to disable the slow log)
+        :param slow_log_size: Maximum number of entries in the slow log
+        :param dump_dir: Default directory where to dump the statistics
+        :raise ValueError: Invalid parameters
+        """
+        try:
+            sample_rate = float(sample_rate)
+            if not 0 <= sample_rate <= 1:
+                raise ValueError("Sample rate must be between 0 and 1")
+
+            if slow_threshold is not None:
+                slow_threshold = float(slow_threshold)
+                if slow_threshold <= 0:
+                    raise ValueError("Slow threshold must be greater than 0")
+
+            slow_log_size = int(slow_log_size)
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid profiler parameters: {0}".format(ex))
+
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.dump_dir = dump_dir
+        self.enabled = False
+
+        # Re-entrant: the signal handler can be called while it is held
+        self.__lock = threading.RLock()
+
+        # Only one call is profiled at a time (cProfile can't nest)
+        self.__profile_lock = threading.Lock()
+
+        # Method -> (number of profiled calls, pstats.Stats)
+        self.__stats = {}
+
+        # Slow calls log
+        self.__slow_log = collections.deque(maxlen=slow_log_size)
+
+        # Thread ID -> [method, start time, stack] of the running calls
+        self.__running = {}
+        self.__watchdog = None
+        self.__watchdog_stop = threading.Event()
+
+    def enable(self):
+        """
+        Starts profiling the calls
+        """
+        with self.__lock:
+            if self.enabled:
+                return
+
+            self.enabled = True
+            if self.slow_threshold is not None:
+                self.__watchdog_stop.clear()
+                self.__watchdog = threading.Thread(
+                    target=self.__watch, name="jsonrpclib-profiler"
+                )
+                self.__watchdog.daemon = True
+                self.__watchdog.start()
+
+    def disable(self):
+        """
+        Stops profiling the calls. The collected statistics are kept.
+        """
+        with self.__lock:
+            self.enabled = False
+            watchdog = self.__watchdog
+            self.__watchdog = None
+            self.__watchdog_stop.set()
+
+        if watchdog is not None and watchdog is not threading.current_thread():
+            watchdog.join()
+
+    def toggle(self):
+        """
+        Enables the profiler if it is disabled, else disables it and dumps
+        the statistics in the default dump directory, if any
+
+        :return: True if the profiler is now enabled
+        """
+        if not self.enabled:
+            self.enable()
+            return True
+
+        self.disable()
+        if self.dump_dir:
+            try:
+                self.dump()
+            except (IOError, OSError) as ex:
+                _logger.error("Error dumping the profiler statistics: %s", ex)
+        return False
+
+    def install_signal_handler(self, signum=None):
+        """
+        Toggles the profiler when the process receives the given signal
+
+        :param signum: Signal number (SIGUSR2 by default)
+        :return: The previous handler of the signal
+        """
+        if signum is None:
+            signum = signal.SIGUSR2
+
+        def handler(*_):
+            enabled = self.toggle()
+            _logger.warning(
+                "Request profiler %s", "enabled" if enabled else "disabled"
+            )
+
+        return signal.signal(signum, handler)
+
+    def call(self, method, params, function, *args):
+        """
+        Executes a method call, profiling it if it is sampled
+
+        :param method: Name of the called method
+        :param params: Parameters of the call (for the slow log)
+        :param function: Function to execute
+        :param args: Arguments of the function
+        :return: The result of the function
+        """
+        sampled = (
+            self.sample_rate > 0
+            and random.random() < self.sample_rate
+            and self.__profile_lock.acquire(False)
+        )
+        tracked = self.slow_threshold is not None
+        if not sampled and not tracked:
+            return function(*args)
+
+        ident = threading.current_thread().ident
+        start = _clock()
+        if tracked:
+            entry = [method, start, None]
+            with self.__lock:
+                self.__running[ident] = entry
+
+        try:
+            if not sampled:
+                return function(*args)
+
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(function, *args)
+            finally:
+                self.__profile_lock.release()
+                self.__add_profile(method, profile)
+        finally:
+            if tracked:
+                duration = _clock() - start
+                with self.__lock:
+                    self.__running.pop(ident, None)
+
+                if duration >= self.slow_threshold:
+                    self.__log_slow_call(entry, params, duration)
+
+    def __add_profile(self, method, profile):
+        """
+        Aggregates the statistics of a profiled call
+
+        :param method: Name of the called method
+        :param profile: The cProfile.Profile of the call
+        """
+        stats = pstats.Stats(profile)
+        with self.__lock:
+            try:
+                count, method_stats = self.__stats[method]
+            except KeyError:
+                self.__stats[method] = (1, stats)
+            else:
+                method_stats.add(stats)
+                self.__stats[method] = (count + 1, method_stats)
+
+    def __log_slow_call(self, entry, params, duration):
+        """
+        Adds a call to the slow log
+
+        :param entry: The [method, start time, stack] entry of the call
+        :param params: Parameters of the call
+        :param duration: Duration of the call (in seconds)
+        """
+        try:
+            params_size = len(repr(params))
+        except Exception:
+            params_size = None
+
+        method, _, stack = entry
+        _logger.warning("Slow call to %s: %.3fs", method, duration)
+        with self.__lock:
+            self.__slow_log.append(
+                {
+                    "method": method,
+                    "duration": duration,
+                    "params_size": params_size,
+                    "time": time.time(),
+                    "stack": stack,
+                }
+            )
+
+    def __watch(self):
+        """
+        Captures the stack of the calls running for longer than the slow
+        threshold
+        """
+        get_frames = getattr(sys, "_current_frames", None)
+        if get_frames is None:
+            # Not supported by this interpreter
+            return
+
+        period = min(max(self.slow_threshold / 4, 0.01), 1.0)
+        while not self.__watchdog_stop.wait(period):
+            now = _clock()
+            with self.__lock:
+                late = [
+                    (ident, entry)
+                    for ident, entry in self.__running.items()
+                    if entry[2] is None
+                    and now - entry[1] >= self.slow_threshold
+                ]
+
+            if not late:
+                continue
+
+            frames = get_frames()
+            for ident, entry in late:
+                frame = frames.get(ident)
+                if frame is not None:
+                    entry[2] = "".join(traceback.format_stack(frame))
+
+    def get_profiled_methods(self):
+        """
+        Returns the number of profiled calls of each method
+
+        :return: A method name -> number of profiled calls dictionary
+        """
+        with self.__lock:
+            return dict(
+                (method, count) for method, (count, _) in self.__stats.items()
+            )
+
+    def get_stats(self, method):
+        """
+        Returns the aggregated statistics of the profiled calls to a method
+
+        :param method: Name of the method
+        :return: A pstats.Stats object, or None if the method hasn't been
+                 profiled
+        """
+        with self.__lock:
+            try:
+                _, stats = self.__stats[method]
+            except KeyError:
+                return None
+
+            # Copy the statistics, as they're still updated
+            return _copy_stats(stats)
+
+    def get_slow_calls(self):
+        """
+        Returns the slow log, oldest calls first
+
+        :return: A list of dictionaries with the name of the method
+                 (``method``), the duration of the call (``duration``), the
+                 size of the representation of its parameters
+                 (``params_size``), its end time (``time``) and the stack of
+                 its thread while it was running late (``stack``, None if the
+                 call ended before it could be captured)
+        """
+        with self.__lock:
+            return list(self.__slow_log)
+
+    def dump(self, directory=None):
+        """
+        Dumps the statistics of each method in a pstats file, named after
+        the method
+
+        :param directory: Output directory (default dump directory if None)
+        :return: The list of the written files
+        :raise ValueError: No output directory
+        :raise IOError: Error writing a file
+        """
+        directory = directory or self.dump_dir
+        if not directory:
+            raise ValueError("No output directory given")
+
+        with self.__lock:
+            stats = [
+                (method, _copy_stats(method_stats))
+                for method, (_, method_stats) in self.__stats.items()
+            ]
+
+        paths = []
+        for method, method_stats in stats:
+            path = os.path.join(
+                directory, "{0}.pstats".format(_UNSAFE_CHARS.sub("_", method))
+            )
+            method_stats.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def reset(self):
+        """
+        Clears the collected statistics and the slow log
+        """
+        with self.__lock:
+            self.__stats.clear()
+            self.__slow_log.clear()
@@ -26,8 +26,11 @@ Cached thread pool, inspired from Pelix/iPOPO Thread Pool
 """
 
 # Standard library
+import bisect
+import collections
 import logging
 import threading
+import time
 
 try:
     # Python 3
@@ -36,6 +39,16 @@ except ImportError:
     # Python 2
     import Queue as queue  # type: ignore # pylint: disable=F0401
 
+try:
+    # Python 3.2+
+    from concurrent.futures import Future as _StandardFuture
+except ImportError:
+    # Python 2
+    _StandardFuture = None  # type: ignore
+
+# Local modules
+import jsonrpclib.metrics
+
 # ------------------------------------------------------------------------------
 
 # Module version
@@ -47,6 +60,319 @@ __docformat__ = "restructuredtext en"
 
 # ------------------------------------------------------------------------------
 
+try:
+    # Python 3.3+
+    _clock = time.monotonic
+except AttributeError:
+    # Python 2
+    _clock = time.time
+
+try:
+    # Python 3.7+
+    _SimpleQueue = queue.SimpleQueue
+except AttributeError:
+    _SimpleQueue = queue.Queue  # type: ignore
+
+# Token telling a thread to take the next task from the priority queue
+_PRIORITY_TASK = object()
+
+# Returned to a thread which got the token of a dropped or cleared task
+_STALE_TASK = object()
+
+# Locks protecting the lazy creation of the events and the callbacks of the
+# FutureResult objects, shared by stripes of futures
+_FUTURE_LOCKS = tuple(
+    threading.Lock() for _ in range(jsonrpclib.metrics.NB_STRIPES)
+)
+
+# Overflow policies of the MicroBatcher
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_DROP_NEW = "drop-new"
+
+# Rejection policies of the ThreadPool, applied when its queue is full
+REJECT_BLOCK = "block"
+REJECT_ABORT = "reject"
+REJECT_CALLER_RUNS = "caller-runs"
+REJECT_DROP_OLDEST = "drop-oldest"
+
+# ------------------------------------------------------------------------------
+
+
+def _get_future_lock(future):
+    """
+    Returns the lock of the stripe of a FutureResult
+
+    :param future: A FutureResult
+    :return: A lock
+    """
+    # Objects are aligned on 16 bytes
+    return _FUTURE_LOCKS[(id(future) >> 4) % len(_FUTURE_LOCKS)]
+
+
+class TaskDropped(Exception):
+    """
+    Exception given to the future of a task dropped by the pool before its
+    execution
+    """
+
+    pass
+
+
+class CoDel(object):
+    """
+    Queue delay controller, based on the CoDel algorithm as adapted to request
+    queues: when the minimum delay spent by tasks in the queue stays above the
+    target during a whole interval, the queue is considered overloaded. Tasks
+    which waited more than twice the target are then dropped, until the
+    minimum delay goes back under the target.
+
+    As the oldest tasks are the first ones to be dequeued, they are the first
+    to be dropped.
+    """
+
+    def __init__(self, target, interval=0.1):
+        """
+        :param target: Acceptable queue delay (in seconds)
+        :param interval: Duration of the minimum delay observation window
+                         (in seconds)
+        :raise ValueError: Invalid target or interval
+        """
+        try:
+            target = float(target)
+            interval = float(interval)
+            if target <= 0 or interval <= 0:
+                raise ValueError("Delays must be greater than 0")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid CoDel parameters: {0}".format(ex))
+
+        self.target = target
+        self.interval = interval
+        self.__lock = threading.Lock()
+
+        # Minimum delay in the current interval
+        self.__min_delay = None
+        self.__interval_end = None
+        self.__overloaded = False
+
+        # Number of dropped tasks
+        self.__nb_dropped = 0
+
+    @property
+    def overloaded(self):
+        """
+        True if the queue was overloaded during the last interval
+        """
+        return self.__overloaded
+
+    @property
+    def nb_dropped(self):
+        """
+        The number of tasks dropped since the creation of the controller
+        """
+        return self.__nb_dropped
+
+    def should_drop(self, delay, now=None):
+        """
+        Updates the state of the controller with the delay of a dequeued task
+        and checks if that task must be dropped
+
+        :param delay: Time spent by the task in the queue (in seconds)
+        :param now: Current time (monotonic clock)
+        :return: True if the task must be dropped
+        """
+        if now is None:
+            now = _clock()
+
+        with self.__lock:
+            if self.__interval_end is None:
+                # First task
+                self.__interval_end = now + self.interval
+            elif now >= self.__interval_end:
+                # End of the observation window
+                self.__overloaded = (
+                    self.__min_delay is not None
+                    and self.__min_delay > self.target
+                )
+                self.__min_delay = None
+                self.__interval_end = now + self.interval
+
+            if self.__min_delay is None or delay < self.__min_delay:
+                self.__min_delay = delay
+
+            if self.__overloaded and delay > 2 * self.target:
+                self.__nb_dropped += 1
+                return True
+
+            return False
+
+    def reset(self):
+        """
+        Resets the state of the controller (keeps the drops counter)
+        """
+        with self.__lock:
+            self.__min_delay = None
+            self.__interval_end = None
+            self.__overloaded = False
+
+
+class AutoScaler(object):
+    """
+    Thread pool sizing policy driven by the queue delay: the pool grows when
+    tasks wait in the queue for more than the target delay, and shrinks with
+    hysteresis.
+
+    A thread idle for a whole interval is only retired if no thread was added
+    during that interval, and if the remaining threads would stay under the
+    low utilization threshold. The utilization is the fraction of their time
+    the threads spend executing tasks, measured over an interval.
+    """
+
+    def __init__(self, target, interval=10.0, low_utilization=0.5):
+        """
+        :param target: Acceptable queue delay (in seconds)
+        :param interval: Time a thread must stay idle before being retired,
+                         and duration of the utilization observation window
+                         (in seconds)
+        :param low_utilization: Utilization (0 to 1) under which the threads
+                                can be retired
+        :raise ValueError: Invalid parameters
+        """
+        try:
+            target = float(target)
+            interval = float(interval)
+            low_utilization = float(low_utilization)
+            if target <= 0 or interval <= 0:
+                raise ValueError("Delays must be greater than 0")
+            if not 0 < low_utilization <= 1:
+                raise ValueError("Utilization must be between 0 and 1")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid autoscaling parameters: {0}".format(ex))
+
+        self.target = target
+        self.interval = interval
+        self.low_utilization = low_utilization
+        self.__lock = threading.Lock()
+
+        # Time of the last addition of a thread
+        self.__last_up = None
+
+        # Start time and busy time of the observation window
+        self.__window = None
+
+        # Average number of busy threads and their utilization during the
+        # last window
+        self.__load = None
+        self.__utilization = None
+
+        # Number of decisions
+        self.__nb_ups = 0
+        self.__nb_downs = 0
+
+    @property
+    def nb_scale_ups(self):
+        """
+        The number of times a thread has been added
+        """
+        return self.__nb_ups
+
+    @property
+    def nb_scale_downs(self):
+        """
+        The number of times a thread has been retired
+        """
+        return self.__nb_downs
+
+    @property
+    def utilization(self):
+        """
+        The utilization of the threads during the last observation window,
+        None before the end of the first one
+        """
+        return self.__utilization
+
+    def should_grow(self, delay, now=None):
+        """
+        Checks if a thread must be added, given the delay spent by a task in
+        the queue. Threads are added at most once per target delay, to let
+        the last one start working.
+
+        :param delay: Time spent by a task in the queue (in seconds)
+        :param now: Current time (monotonic clock)
+        :return: True if a thread must be added
+        """
+        if delay <= self.target:
+            return False
+
+        if now is None:
+            now = _clock()
+
+        with self.__lock:
+            if (
+                self.__last_up is not None
+                and now - self.__last_up < self.target
+            ):
+                return False
+
+            self.__last_up = now
+            self.__nb_ups += 1
+            return True
+
+    def should_shrink(self, busy, nb_threads, now=None):
+        """
+        Checks if a thread idle for a whole interval can be retired
+
+        :param busy: Total time spent by the threads executing tasks (in
+                     seconds, since the creation of the pool)
+        :param nb_threads: Current number of threads
+        :param now: Current time (monotonic clock)
+        :return: True if the thread must be retired
+        """
+        if now is None:
+            now = _clock()
+
+        with self.__lock:
+            if self.__window is None:
+                # First observation
+                self.__window = (now, busy)
+            elif now - self.__window[0] >= self.interval:
+                # End of the observation window
+                start, start_busy = self.__window
+                self.__load = max(0.0, busy - start_busy) / (now - start)
+                self.__utilization = self.__load / max(nb_threads, 1)
+                self.__window = (now, busy)
+
+            if self.__load is None:
+                # Unknown load: wait for the end of the first window
+                return False
+
+            if (
+                self.__last_up is not None
+                and now - self.__last_up < self.interval
+            ):
+                # Hysteresis: the pool grew recently
+                return False
+
+            if self.__load / max(nb_threads - 1, 1) >= self.low_utilization:
+                # The remaining threads would be too busy
+                return False
+
+            self.__nb_downs += 1
+            return True
+
+    def reset(self):
+        """
+        Resets the state of the policy (keeps the decisions counters)
+        """
+        with self.__lock:
+            self.__last_up = None
+            self.__window = None
+            self.__load = None
+            self.__utilization = None
+
+
+# ------------------------------------------------------------------------------
+
 
 class EventData(object):
     """
@@ -126,104 +452,865 @@ class EventData(object):
 
 class FutureResult(object):
     """
-    An object to wait for the result of a threaded execution
+    An object to wait for the result of a threaded execution.
+
+    The event used to wait for the result is only allocated if a thread
+    waits for it before the end of the execution: the futures of the tasks
+    nobody waits for cost no lock.
     """
 
+    __slots__ = (
+        "_logger",
+        "__done",
+        "__data",
+        "__exception",
+        "__event",
+        "__callback",
+        "__extra",
+        "__done_callbacks",
+    )
+
     def __init__(self, logger=None):
         """
         Sets up the FutureResult object
 
         :param logger: The Logger to use in case of error (optional)
         """
-        self._logger = logger or logging.getLogger(__name__)
-        self._done_event = EventData()
+        self._logger = logger
+        self.__done = False
+        self.__data = None
+        self.__exception = None
+        self.__event = None
         self.__callback = None
         self.__extra = None
+        self.__done_callbacks = None
+
+    def __notify(self):
+        """
+        Notify the given callback about the result of the execution
+        """
+        if self.__callback is not None:
+            # Take the callback: set_callback() might call it too if it sees
+            # the end of the execution
+            with _get_future_lock(self):
+                callback = self.__callback
+                extra = self.__extra
+                self.__callback = self.__extra = None
+
+            if callback is not None:
+                self.__call_callback(callback, extra)
+
+        if self.__done_callbacks is not None:
+            self.__run_done_callbacks()
+
+    def __run_done_callbacks(self):
+        """
+        Calls the callbacks given to add_done_callback(), once
+        """
+        with _get_future_lock(self):
+            callbacks = self.__done_callbacks
+            self.__done_callbacks = None
+
+        for callback in callbacks or ():
+            self.__call_done_callback(callback)
+
+    def __call_callback(self, callback, extra):
+        """
+        Calls the callback given to set_callback()
+
+        :param callback: A method accepting the result, the exception and the
+                         extra parameter
+        :param extra: Extra parameter given to set_callback()
+        """
+        try:
+            callback(self.__data, self.__exception, extra)
+        except Exception as ex:
+            logger = self._logger or logging.getLogger(__name__)
+            logger.exception("Error calling back method: %s", ex)
+
+    def __call_done_callback(self, callback):
+        """
+        Calls a callback given to add_done_callback()
+
+        :param callback: A method accepting this future as argument
+        """
+        try:
+            callback(self)
+        except Exception as ex:
+            logger = self._logger or logging.getLogger(__name__)
+            logger.exception("Error calling back method: %s", ex)
+
+    def __set_done(self, data, exception):
+        """
+        Stores the result of the execution and wakes up the waiting threads
+
+        :param data: The result of the execution
+        :param exception: The exception raised by the execution
+        """
+        self.__data = data
+        self.__exception = exception
+        # The flag must be set before looking for the event: see __wait()
+        self.__done = True
+        event = self.__event
+        if event is not None:
+            event.set()
+
+    def __wait(self, timeout):
+        """
+        Waits for the end of the execution
+
+        :param timeout: Wait timeout (in seconds)
+        :return: True if the execution has finished, else False
+        """
+        if self.__done:
+            return True
+
+        event = self.__event
+        if event is None:
+            with _get_future_lock(self):
+                event = self.__event
+                if event is None:
+                    event = self.__event = threading.Event()
+
+            # The execution might have finished before the event was created
+            if self.__done:
+                return True
+
+        event.wait(timeout)
+        return self.__done
+
+    def set_callback(self, method, extra=None):
+        """
+        Sets a callback method, called once the result has been computed or in
+        case of exception.
+
+        The callback method must have the following signature:
+        ``callback(result, exception, extra)``.
+
+        :param method: The method to call back in the end of the execution
+        :param extra: Extra parameter to be given to the callback method
+        """
+        with _get_future_lock(self):
+            done = self.__done
+            if not done:
+                self.__callback = method
+                self.__extra = extra
+
+        if done:
+            # The execution has already finished
+            self.__call_callback(method, extra)
+
+    def add_done_callback(self, method):
+        """
+        Adds a method to call with this future as argument once the result has
+        been computed or in case of exception, like the method of
+        concurrent.futures.Future. The method is called immediately if the
+        execution has already finished.
+
+        :param method: A method accepting this future as argument
+        """
+        with _get_future_lock(self):
+            added = not self.__done
+            if added:
+                if self.__done_callbacks is None:
+                    self.__done_callbacks = []
+                self.__done_callbacks.append(method)
+
+        if not added:
+            self.__call_done_callback(method)
+        elif self.__done:
+            # The execution finished while the callback was being added: the
+            # end of the execution might not have seen it
+            self.__run_done_callbacks()
+
+    def to_future(self):
+        """
+        Returns a concurrent.futures.Future getting the result of this one,
+        which can be given to the concurrent.futures functions or to
+        asyncio.wrap_future()
+
+        :return: A running concurrent.futures.Future
+        :raise NotImplementedError: concurrent.futures is not available
+        """
+        if _StandardFuture is None:
+            raise NotImplementedError("concurrent.futures is not available")
+
+        future = _StandardFuture()
+        future.set_running_or_notify_cancel()
+
+        def copy_result(_):
+            if self.__exception is not None:
+                future.set_exception(self.__exception)
+            else:
+                future.set_result(self.__data)
+
+        self.add_done_callback(copy_result)
+        return future
+
+    def execute(self, method, args, kwargs):
+        """
+        Execute the given method and stores its result.
+        The result is considered "done" even if the method raises an exception
+
+        :param method: The method to execute
+        :param args: Method positional arguments
+        :param kwargs: Method keyword arguments
+        :raise Exception: The exception raised by the method
+        """
+        # Normalize arguments
+        if args is None:
+            args = []
+
+        if kwargs is None:
+            kwargs = {}
+
+        try:
+            # Call the method
+            result = method(*args, **kwargs)
+        except Exception as ex:
+            # Something went wrong: propagate to the waiters and to the caller
+            self.__set_done(None, ex)
+            raise
+        else:
+            # Store the result
+            self.__set_done(result, None)
+        finally:
+            # In any case: notify the call back (if any)
+            self.__notify()
+
+    def drop(self, exception):
+        """
+        Marks the job as done without executing it
+
+        :param exception: The exception to raise in result()
+        """
+        self.__set_done(None, exception)
+        self.__notify()
+
+    def done(self):
+        """
+        Returns True if the job has finished, else False
+        """
+        return self.__done
+
+    def result(self, timeout=None):
+        """
+        Waits up to timeout for the result the threaded job.
+        Returns immediately the result if the job has already been done.
+
+        :param timeout: The maximum time to wait for a result (in seconds)
+        :raise OSError: The timeout raised before the job finished
+        :raise Exception: The exception encountered during the call, if any
+        """
+        if not self.__wait(timeout):
+            raise OSError("Timeout raised")
+
+        if self.__exception is not None:
+            # pylint: disable=E0702
+            raise self.__exception
+        return self.__data
+
+    def exception(self, timeout=None):
+        """
+        Waits up to timeout for the end of the threaded job and returns the
+        exception it raised, like the method of concurrent.futures.Future
+
+        :param timeout: The maximum time to wait (in seconds)
+        :return: The exception raised by the job, or None
+        :raise OSError: The timeout raised before the job finished
+        """
+        if not self.__wait(timeout):
+            raise OSError("Timeout raised")
+        return self.__exception
+
+
+# ------------------------------------------------------------------------------
+
+
+class PriorityTaskQueue(queue.Queue):
+    """
+    Task queue serving the tasks by priority (lowest value first), in FIFO
+    order for a same priority.
+
+    To avoid the starvation of low priority tasks, the oldest task waiting
+    behind a higher priority one is served first if it has waited more than
+    the starvation delay.
+
+    Tasks are the tuples queued by the ThreadPool, whose last items are the
+    time of queuing and the priority. Other objects (control events) are
+    served before the tasks.
+    """
+
+    def __init__(self, maxsize=0, starvation_delay=None):
+        """
+        :param maxsize: Maximum size of the queue (0 for infinite)
+        :param starvation_delay: Maximum time a task can wait behind higher
+                                 priority tasks (in seconds, None to always
+                                 serve by priority)
+        """
+        self.starvation_delay = starvation_delay
+        queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        # Priority -> FIFO of tasks
+        self._fifos = {}
+        # Sorted priorities having tasks
+        self._priorities = []
+        # Control events
+        self._controls = collections.deque()
+        self._size = 0
+
+    def _qsize(self, *_):
+        return self._size
+
+    def _put(self, item):
+        self._size += 1
+        if not isinstance(item, tuple):
+            self._controls.append(item)
+            return
+
+        priority = item[-1]
+        try:
+            self._fifos[priority].append(item)
+        except KeyError:
+            self._fifos[priority] = collections.deque((item,))
+            bisect.insort(self._priorities, priority)
+
+    def _get(self):
+        self._size -= 1
+        if self._controls:
+            return self._controls.popleft()
+
+        priority = self._priorities[0]
+        if self.starvation_delay is not None and len(self._priorities) > 1:
+            # Look for the oldest task waiting behind higher priorities
+            oldest = min(
+                self._priorities[1:],
+                key=lambda prio: self._fifos[prio][0][-2],
+            )
+            waited = _clock() - self._fifos[oldest][0][-2]
+            if waited > self.starvation_delay:
+                priority = oldest
+
+        return self.__pop(priority)
+
+    def __pop(self, priority):
+        """
+        Removes the first task of a priority
+        """
+        fifo = self._fifos[priority]
+        item = fifo.popleft()
+        if not fifo:
+            del self._fifos[priority]
+            self._priorities.remove(priority)
+        return item
+
+    def put_many(self, items):
+        """
+        Queues as many items as possible without blocking, in order, holding
+        the lock of the queue once
+
+        :param items: A list of items
+        :return: The number of queued items
+        """
+        with self.not_full:
+            count = len(items)
+            if self.maxsize > 0:
+                count = max(0, min(count, self.maxsize - self._qsize()))
+
+            for item in items[:count]:
+                self._put(item)
+
+            if count:
+                self.unfinished_tasks += count
+                self.not_empty.notify(count)
+            return count
+
+    def drop_oldest(self):
+        """
+        Removes the task which has been queued for the longest time, whatever
+        its priority
+
+        :return: The removed task, or None if there is no queued task
+        """
+        with self.not_full:
+            if not self._priorities:
+                return None
+
+            priority = min(
+                self._priorities, key=lambda prio: self._fifos[prio][0][-2]
+            )
+            self._size -= 1
+            self.unfinished_tasks -= 1
+            if not self.unfinished_tasks:
+                self.all_tasks_done.notify_all()
+            self.not_full.notify()
+            return self.__pop(priority)
+
+
+# ------------------------------------------------------------------------------
+
+
+class FairQueue(object):
+    """
+    Queue of the items of several clients, served in weighted round-robin
+    (deficit round-robin): each client has its own FIFO and, while several
+    clients have queued items, gets a share of the service proportional to
+    its weight.
+
+    Items of different priorities are served in separate rounds.
+    """
+
+    def __init__(self):
+        """
+        Sets up the queue
+        """
+        self.__lock = threading.Lock()
+
+        # Client -> weight
+        self.__weights = {}
+
+        # Priority -> OrderedDict(client -> FIFO), in round-robin order
+        self.__rounds = {}
+
+        # Priority -> client -> service credit in the current round
+        self.__deficits = {}
+
+        self.__size = 0
+
+    def __len__(self):
+        """
+        Returns the number of queued items
+        """
+        return self.__size
+
+    def clear(self):
+        """
+        Removes all the queued items (keeps the weights of the clients).
+        Can be used in a child process, after a fork.
+        """
+        self.__lock = threading.Lock()
+        self.__rounds = {}
+        self.__deficits = {}
+        self.__size = 0
+
+    def set_weight(self, client, weight):
+        """
+        Sets the weight of a client (1 by default)
+
+        :param client: Client key
+        :param weight: Weight of the client (None to reset it)
+        :raise ValueError: Invalid weight
+        """
+        if weight is None:
+            with self.__lock:
+                self.__weights.pop(client, None)
+            return
+
+        try:
+            weight = float(weight)
+            if weight <= 0:
+                raise ValueError("Weight must be greater than 0")
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid weight: {0}".format(ex))
+
+        with self.__lock:
+            self.__weights[client] = weight
+
+    def get_weight(self, client):
+        """
+        Returns the weight of a client
+        """
+        return self.__weights.get(client, 1)
+
+    def depths(self):
+        """
+        Returns the number of items queued by each client
+
+        :return: A client -> number of items dictionary
+        """
+        depths = {}
+        with self.__lock:
+            for clients in self.__rounds.values():
+                for client, fifo in clients.items():
+                    depths[client] = depths.get(client, 0) + len(fifo)
+        return depths
+
+    def put(self, client, item, priority=0):
+        """
+        Queues an item
+
+        :param client: Key of the client queuing the item
+        :param item: The queued item
+        :param priority: Priority of the item
+        """
+        with self.__lock:
+            clients = self.__rounds.get(priority)
+            if clients is None:
+                clients = self.__rounds[priority] = collections.OrderedDict()
+                self.__deficits[priority] = {}
+
+            try:
+                clients[client].append(item)
+            except KeyError:
+                clients[client] = collections.deque((item,))
+            self.__size += 1
+
+    def get(self, priority=0):
+        """
+        Returns the next item to serve, with the given priority
+
+        :param priority: Priority of the item
+        :return: The item
+        :raise queue.Empty: No item of this priority
+        """
+        with self.__lock:
+            clients = self.__rounds.get(priority)
+            if not clients:
+                raise queue.Empty
+
+            deficits = self.__deficits[priority]
+            while True:
+                client = next(iter(clients))
+                if deficits.get(client, 0) < 1:
+                    # New turn for this client
+                    deficits[client] = deficits.get(
+                        client, 0
+                    ) + self.__weights.get(client, 1)
+                    if deficits[client] < 1:
+                        # Not enough credit yet (weight lower than 1)
+                        clients[client] = clients.pop(client)
+                        continue
+
+                deficits[client] -= 1
+                return self.__pop(priority, client, deficits[client] < 1)
+
+    def drop(self, priority=0):
+        """
+        Removes the oldest item of the client with the most queued items,
+        with the given priority
+
+        :param priority: Priority of the item
+        :return: The removed item
+        :raise queue.Empty: No item of this priority
+        """
+        with self.__lock:
+            clients = self.__rounds.get(priority)
+            if not clients:
+                raise queue.Empty
+
+            client = max(clients, key=lambda key: len(clients[key]))
+            return self.__pop(priority, client, False)
+
+    def __pop(self, priority, client, end_of_turn):
+        """
+        Pops the first item of a client FIFO (lock must be held)
+
+        :param priority: Priority of the item
+        :param client: Client key
+        :param end_of_turn: If True, the client goes to the end of the round
+        :return: The item
+        """
+        clients = self.__rounds[priority]
+        fifo = clients[client]
+        item = fifo.popleft()
+        self.__size -= 1
+
+        if not fifo:
+            # Client has nothing left to do: forget its credit
+            del clients[client]
+            self.__deficits[priority].pop(client, None)
+            if not clients:
+                del self.__rounds[priority]
+                del self.__deficits[priority]
+        elif end_of_turn:
+            clients[client] = clients.pop(client)
+
+        return item
+
+
+# ------------------------------------------------------------------------------
+
+
+class MicroBatcher(object):
+    """
+    Accumulates items and gives them by batches to a consumer, from a
+    dedicated thread. A batch is delivered when it reaches its maximum size
+    or when its oldest item waited for the maximum delay.
+
+    When the queue is full, the overflow policy tells to either block the
+    producer (OVERFLOW_BLOCK), drop the oldest queued item
+    (OVERFLOW_DROP_OLDEST) or drop the new item (OVERFLOW_DROP_NEW).
+    """
+
+    def __init__(
+        self,
+        consumer,
+        max_size=100,
+        max_delay=0.1,
+        queue_size=1000,
+        overflow=OVERFLOW_BLOCK,
+        logname=None,
+    ):
+        """
+        :param consumer: Method called with the list of items of a batch
+        :param max_size: Maximum number of items in a batch
+        :param max_delay: Maximum time an item waits for its batch to be
+                          delivered (in seconds)
+        :param queue_size: Maximum number of queued items
+        :param overflow: Policy to apply when the queue is full
+        :param logname: Name of the logger
+        :raise ValueError: Invalid parameters
+        """
+        try:
+            max_size = int(max_size)
+            max_delay = float(max_delay)
+            queue_size = int(queue_size)
+        except (TypeError, ValueError) as ex:
+            raise ValueError("Invalid batch parameters: {0}".format(ex))
+
+        if max_size < 1 or queue_size < max_size:
+            raise ValueError(
+                "The batch size must be between 1 and the queue size"
+            )
+        if max_delay < 0:
+            raise ValueError("The batch delay must be positive")
+        if overflow not in (
+            OVERFLOW_BLOCK,
+            OVERFLOW_DROP_OLDEST,
+            OVERFLOW_DROP_NEW,
+        ):
+            raise ValueError("Unknown overflow policy: {0}".format(overflow))
+
+        self._logger = logging.getLogger(logname or __name__)
+        self.__consumer = consumer
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.overflow = overflow
+
+        # Queued (time, item) tuples
+        self.__items = collections.deque()
+        self.__condition = threading.Condition()
+        self.__thread = None
+        self.__running = False
+
+        # Statistics
+        self.__nb_delivered = 0
+        self.__nb_batches = 0
+        self.__nb_dropped = 0
+        self.__nb_failed = 0
+
+    def put(self, item):
+        """
+        Queues an item, starting the delivery thread if necessary
+
+        :param item: The item to queue
+        :return: False if the item has been dropped
+        """
+        with self.__condition:
+            if not self.__running:
+                self.__start()
+
+            while len(self.__items) >= self.queue_size:
+                if self.overflow == OVERFLOW_DROP_NEW:
+                    self.__nb_dropped += 1
+                    return False
+                elif self.overflow == OVERFLOW_DROP_OLDEST:
+                    self.__items.popleft()
+                    self.__nb_dropped += 1
+                else:
+                    self.__condition.wait()
+
+            self.__items.append((_clock(), item))
+            if len(self.__items) in (1, self.max_size):
+                # Wake up the delivery thread: new batch, or full batch
+                self.__condition.notify_all()
+            return True
+
+    def stop(self, flush=True):
+        """
+        Stops the delivery thread
+
+        :param flush: If True, deliver the queued items before returning,
+                      else drop them
+        """
+        with self.__condition:
+            if not flush:
+                self.__nb_dropped += len(self.__items)
+                self.__items.clear()
+
+            self.__running = False
+            self.__condition.notify_all()
+            thread = self.__thread
+            self.__thread = None
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
 
-    def __notify(self):
+    def after_fork(self):
         """
-        Notify the given callback about the result of the execution
+        Resets the batcher in a child process: the delivery thread of the
+        parent process doesn't exist anymore and its queued items belong to
+        the parent.
         """
-        if self.__callback is not None:
-            try:
-                self.__callback(
-                    self._done_event.data,
-                    self._done_event.exception,
-                    self.__extra,
-                )
-            except Exception as ex:
-                self._logger.exception("Error calling back method: %s", ex)
+        self.__condition = threading.Condition()
+        self.__items = collections.deque()
+        self.__thread = None
+        self.__running = False
 
-    def set_callback(self, method, extra=None):
+    def get_stats(self):
         """
-        Sets a callback method, called once the result has been computed or in
-        case of exception.
-
-        The callback method must have the following signature:
-        ``callback(result, exception, extra)``.
+        Returns the statistics of the batcher
 
-        :param method: The method to call back in the end of the execution
-        :param extra: Extra parameter to be given to the callback method
+        :return: A dictionary with the number of queued items (``queued``),
+                 delivered items (``delivered``) and batches (``batches``),
+                 dropped items (``dropped``) and batches which raised an
+                 error (``failed``)
         """
-        self.__callback = method
-        self.__extra = extra
-        if self._done_event.is_set():
-            # The execution has already finished
-            self.__notify()
+        with self.__condition:
+            return {
+                "queued": len(self.__items),
+                "delivered": self.__nb_delivered,
+                "batches": self.__nb_batches,
+                "dropped": self.__nb_dropped,
+                "failed": self.__nb_failed,
+            }
+
+    def __start(self):
+        """
+        Starts the delivery thread. Must be called with the lock held.
+        """
+        self.__running = True
+        self.__thread = threading.Thread(
+            target=self.__run, name="{0}-batch".format(self._logger.name)
+        )
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __next_batch(self):
+        """
+        Waits for the next batch to deliver
 
-    def execute(self, method, args, kwargs):
+        :return: A list of items, or None if the batcher has been stopped
         """
-        Execute the given method and stores its result.
-        The result is considered "done" even if the method raises an exception
+        with self.__condition:
+            while True:
+                while not self.__items:
+                    if not self.__running:
+                        return None
+                    self.__condition.wait()
+
+                # Wait for the batch to be full or for its oldest item to
+                # expire
+                deadline = self.__items[0][0] + self.max_delay
+                while self.__running and len(self.__items) < self.max_size:
+                    remaining = deadline - _clock()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+
+                if self.__items:
+                    # Items might have been dropped while waiting
+                    break
+
+            size = min(self.max_size, len(self.__items))
+            batch = [self.__items.popleft()[1] for _ in range(size)]
+
+            # Wake up blocked producers
+            self.__condition.notify_all()
+            return batch
 
-        :param method: The method to execute
-        :param args: Method positional arguments
-        :param kwargs: Method keyword arguments
-        :raise Exception: The exception raised by the method
+    def __run(self):
         """
-        # Normalize arguments
-        if args is None:
-            args = []
+        The delivery loop
+        """
+        while True:
+            batch = self.__next_batch()
+            if batch is None:
+                return
 
-        if kwargs is None:
-            kwargs = {}
+            try:
+                self.__consumer(batch)
+            except Exception as ex:
+                self._logger.exception("Error delivering a batch: %s", ex)
+                failed = True
+            else:
+                failed = False
 
-        try:
-            # Call the method
-            result = method(*args, **kwargs)
-        except Exception as ex:
-            # Something went wrong: propagate to the event and to the caller
-            self._done_event.raise_exception(ex)
-            raise
-        else:
-            # Store the result
-            self._done_event.set(result)
-        finally:
-            # In any case: notify the call back (if any)
-            self.__notify()
+            with self.__condition:
+                self.__nb_batches += 1
+                self.__nb_delivered += len(batch)
+                if failed:
+                    self.__nb_failed += 1
 
-    def done(self):
+
+# ------------------------------------------------------------------------------
+
+
+class _WorkerStats(object):
+    """
+    Statistics of a thread of a ThreadPool, only updated by that thread, or
+    the totals of the stopped threads
+    """
+
+    __slots__ = (
+        "active",
+        "started",
+        "completed",
+        "failed",
+        "wait_time",
+        "busy_time",
+        "task_start",
+        "since",
+        "wait_histogram",
+        "run_histogram",
+    )
+
+    def __init__(self, buckets=None):
         """
-        Returns True if the job has finished, else False
+        :param buckets: Upper bounds of the timing histograms buckets (None
+                        to disable the histograms)
         """
-        return self._done_event.is_set()
+        self.active = False
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.busy_time = 0.0
+        self.task_start = 0.0
+        self.since = _clock()
+        if buckets is not None:
+            self.wait_histogram = jsonrpclib.metrics.Histogram(buckets)
+            self.run_histogram = jsonrpclib.metrics.Histogram(buckets)
+        else:
+            self.wait_histogram = None
+            self.run_histogram = None
 
-    def result(self, timeout=None):
+    def get_busy_time(self, now):
         """
-        Waits up to timeout for the result the threaded job.
-        Returns immediately the result if the job has already been done.
+        Returns the time spent executing tasks, including the current one
 
-        :param timeout: The maximum time to wait for a result (in seconds)
-        :raise OSError: The timeout raised before the job finished
-        :raise Exception: The exception encountered during the call, if any
+        :param now: Current time (monotonic clock)
         """
-        if self._done_event.wait(timeout):
-            return self._done_event.data
-        else:
-            raise OSError("Timeout raised")
+        if self.active:
+            return self.busy_time + now - self.task_start
+        return self.busy_time
 
+    def add(self, other):
+        """
+        Adds the counters of another thread to these ones
 
-# ------------------------------------------------------------------------------
+        :param other: Another _WorkerStats object
+        """
+        self.started += other.started
+        self.completed += other.completed
+        self.failed += other.failed
+        self.wait_time += other.wait_time
+        self.busy_time += other.busy_time
+        if self.wait_histogram is not None:
+            self.wait_histogram.add(other.wait_histogram)
+            self.run_histogram.add(other.run_histogram)
 
 
 class ThreadPool(object):
@@ -232,19 +1319,75 @@ class ThreadPool(object):
     """
 
     def __init__(
-        self, max_threads, min_threads=1, queue_size=0, timeout=60, logname=None
+        self,
+        max_threads,
+        min_threads=1,
+        queue_size=0,
+        timeout=60,
+        logname=None,
+        codel_target=None,
+        codel_interval=0.1,
+        starvation_delay=1.0,
+        autoscale_target=None,
+        autoscale_interval=10.0,
+        autoscale_utilization=0.5,
+        timing=False,
+        timing_buckets=None,
+        rejection=REJECT_BLOCK,
     ):
         """
         Sets up the thread pool.
 
         Threads are kept alive 60 seconds (timeout argument).
 
+        If an autoscaling target is given, the pool starts threads when tasks
+        wait for longer than the target, instead of when all threads are
+        busy. Threads idle for the autoscaling interval are retired when the
+        others can handle the load (see the AutoScaler class).
+
+        With timing enabled, the pool keeps the histograms of the time spent
+        by the tasks in the queue and executing (see get_stats()).
+
+        Tasks are executed by priority (see enqueue_priority()), then in FIFO
+        order. A task waiting behind higher priority tasks for more than the
+        starvation delay is executed first.
+
+        If a CoDel target is given, the pool drops the oldest tasks when the
+        queue delay stays above it (see the CoDel class). The futures of the
+        dropped tasks get a TaskDropped exception.
+
+        When the queue is full, the rejection policy tells to either wait up
+        to the timeout for a free slot then raise queue.Full (REJECT_BLOCK),
+        raise queue.Full immediately (REJECT_ABORT), execute the task in the
+        calling thread (REJECT_CALLER_RUNS) or drop the oldest queued task
+        (REJECT_DROP_OLDEST).
+
         :param max_threads: Maximum size of the thread pool
         :param min_threads: Minimum size of the thread pool
         :param queue_size: Size of the task queue (0 for infinite)
         :param timeout: Queue timeout (in seconds, 60s by default)
         :param logname: Name of the logger
-        :raise ValueError: Invalid number of threads
+        :param codel_target: Acceptable queue delay (in seconds, None to
+                             never drop tasks)
+        :param codel_interval: CoDel observation window (in seconds)
+        :param starvation_delay: Maximum time a task can wait behind higher
+                                 priority tasks (in seconds, None for no
+                                 limit)
+        :param autoscale_target: Acceptable queue delay before adding a
+                                 thread (in seconds, None to disable the
+                                 autoscaling)
+        :param autoscale_interval: Time a thread must be idle before being
+                                   retired by the autoscaling (in seconds)
+        :param autoscale_utilization: Utilization of the threads (0 to 1)
+                                      under which the autoscaling retires
+                                      idle threads
+        :param timing: If True, keep the histograms of the queue and
+                       execution times of the tasks
+        :param timing_buckets: Upper bounds of the timing histograms buckets
+                               (in seconds, see metrics.DEFAULT_BUCKETS)
+        :param rejection: Policy to apply when the queue is full
+        :raise ValueError: Invalid number of threads, CoDel or autoscaling
+                           parameters, or unknown rejection policy
         """
         # Validate parameters
         try:
@@ -263,6 +1406,14 @@ class ThreadPool(object):
         except (TypeError, ValueError) as ex:
             raise ValueError("Invalid pool size: {0}".format(ex))
 
+        if rejection not in (
+            REJECT_BLOCK,
+            REJECT_ABORT,
+            REJECT_CALLER_RUNS,
+            REJECT_DROP_OLDEST,
+        ):
+            raise ValueError("Unknown rejection policy: {0}".format(rejection))
+
         # The logger
         self._logger = logging.getLogger(logname or __name__)
 
@@ -277,9 +1428,45 @@ class ThreadPool(object):
             # Not a valid integer
             queue_size = 0
 
-        self._queue = queue.Queue(queue_size)
+        # Tasks are given to the threads through a SimpleQueue, which doesn't
+        # hold any Python lock. The priority queue is only used once a task
+        # with a non-default priority has been queued, or to bound the number
+        # of queued tasks: the threads then get a _PRIORITY_TASK token from
+        # the SimpleQueue for each task stored in the priority queue.
+        self._queue = PriorityTaskQueue(queue_size, starvation_delay)
+        self.__tasks = _SimpleQueue()
+        self.__by_priority = self._queue.maxsize > 0
         self._timeout = timeout
-        self.__lock = threading.RLock()
+        self.rejection = rejection
+
+        # Number of tasks the queue couldn't accept
+        self.__nb_rejected = 0
+
+        # Protects the threads lists and counters. Tasks are accounted for
+        # without it.
+        self.__lock = threading.Lock()
+        self.__all_done = threading.Condition(self.__lock)
+
+        # A token per thread waiting for a task: a new thread is only
+        # started when no token can be taken
+        self.__idle = _SimpleQueue()
+
+        # Adaptive queue management
+        if codel_target is not None:
+            self._codel = CoDel(codel_target, codel_interval)
+        else:
+            self._codel = None
+
+        # Sizing policy
+        if autoscale_target is not None:
+            self._scaler = AutoScaler(
+                autoscale_target, autoscale_interval, autoscale_utilization
+            )
+        else:
+            self._scaler = None
+
+        # Last time a thread took a task from the queue
+        self.__last_dequeue = _clock()
 
         # The thread pool
         self._min_threads = min_threads
@@ -289,11 +1476,34 @@ class ThreadPool(object):
         # Thread count
         self._thread_id = 0
 
-        # Current number of threads, active and alive,
-        # and number of task waiting
+        # Current number of threads
         self.__nb_threads = 0
-        self.__nb_active_threads = 0
-        self.__nb_pending_task = 0
+
+        # Number of queued tasks and of finished (executed or dropped) ones,
+        # updated without the lock: the difference is the number of pending
+        # tasks
+        self.__nb_queued = jsonrpclib.metrics.StripedCounter()
+        self.__nb_finished = jsonrpclib.metrics.StripedCounter()
+
+        # Number of threads in join(), waiting for the end of the tasks
+        self.__nb_joining = 0
+
+        # Timing histograms buckets
+        if timing:
+            self.__buckets = tuple(
+                sorted(
+                    float(bound)
+                    for bound in (
+                        timing_buckets or jsonrpclib.metrics.DEFAULT_BUCKETS
+                    )
+                )
+            )
+        else:
+            self.__buckets = None
+
+        # Thread -> _WorkerStats, and totals of the threads which have stopped
+        self.__workers = {}
+        self.__stopped_workers = _WorkerStats(self.__buckets)
 
     def start(self):
         """
@@ -303,24 +1513,21 @@ class ThreadPool(object):
             # Stop event not set: we're running
             return
 
+        # Forget the idle tokens of the previous threads
+        self.__idle = _SimpleQueue()
+        self.__last_dequeue = _clock()
+
         # Clear the stop event
         self._done_event.clear()
 
         # Compute the number of threads to start to handle pending tasks
-        nb_pending_tasks = self._queue.qsize()
-        if nb_pending_tasks > self._max_threads:
-            nb_threads = self._max_threads
-            nb_pending_tasks = self._max_threads
-        elif nb_pending_tasks < self._min_threads:
-            nb_threads = self._min_threads
-        else:
-            nb_threads = nb_pending_tasks
+        nb_pending_tasks = self.__get_nb_pending()
+        nb_threads = min(
+            max(nb_pending_tasks, self._min_threads), self._max_threads
+        )
 
         # Create the threads
-        for _ in range(nb_pending_tasks):
-            self.__nb_pending_task += 1
-            self.__start_thread()
-        for _ in range(nb_threads - nb_pending_tasks):
+        for _ in range(nb_threads):
             self.__start_thread()
 
     def __start_thread(self):
@@ -363,13 +1570,9 @@ class ThreadPool(object):
         self._done_event.set()
 
         with self.__lock:
-            # Add something in the queue (to unlock the join())
-            try:
-                for _ in self._threads:
-                    self._queue.put(self._done_event, True, self._timeout)
-            except queue.Full:
-                # There is already something in the queue
-                pass
+            # Wake up the threads waiting for a task
+            for _ in self._threads:
+                self.__tasks.put(self._done_event)
 
             # Copy the list of threads to wait for
             threads = self._threads[:]
@@ -389,15 +1592,74 @@ class ThreadPool(object):
         del self._threads[:]
         self.clear()
 
+    @property
+    def nb_dropped(self):
+        """
+        The number of tasks dropped by the adaptive queue management
+        """
+        if self._codel is None:
+            return 0
+        return self._codel.nb_dropped
+
+    def after_fork(self):
+        """
+        Resets the pool in a child process, forked while the pool was running.
+
+        The threads of the parent process don't exist in the child process:
+        the pool is reset, dropping the pending tasks, and restarted if it was
+        running.
+        """
+        running = not self._done_event.is_set()
+
+        # The lock might have been held by a thread of the parent process
+        self.__lock = threading.Lock()
+        self.__all_done = threading.Condition(self.__lock)
+        self._queue = PriorityTaskQueue(
+            self._queue.maxsize, self._queue.starvation_delay
+        )
+        self.__tasks = _SimpleQueue()
+        self.__idle = _SimpleQueue()
+        self.__by_priority = self._queue.maxsize > 0
+        self._threads = []
+        self.__nb_threads = 0
+        self.__nb_queued = jsonrpclib.metrics.StripedCounter()
+        self.__nb_finished = jsonrpclib.metrics.StripedCounter()
+        self.__nb_joining = 0
+        self.__workers = {}
+        self.__stopped_workers = _WorkerStats(self.__buckets)
+        self.__nb_rejected = 0
+        if self._codel is not None:
+            self._codel.reset()
+        if self._scaler is not None:
+            self._scaler.reset()
+
+        self._done_event = threading.Event()
+        self._done_event.set()
+        if running:
+            self.start()
+
     def enqueue(self, method, *args, **kwargs):
         """
-        Queues a task in the pool
+        Queues a task in the pool, with the default priority (0)
 
         :param method: Method to call
         :return: A FutureResult object, to get the result of the task
         :raise ValueError: Invalid method
         :raise Full: The task queue is full
         """
+        return self.enqueue_priority(0, method, *args, **kwargs)
+
+    def enqueue_priority(self, priority, method, *args, **kwargs):
+        """
+        Queues a task in the pool with the given priority. Tasks with the
+        lowest priority value are executed first.
+
+        :param priority: Priority of the task (0 by default in enqueue())
+        :param method: Method to call
+        :return: A FutureResult object, to get the result of the task
+        :raise ValueError: Invalid method
+        :raise Full: The task queue is full (see the rejection policy)
+        """
         if not hasattr(method, "__call__"):
             raise ValueError(
                 "{0} has no __call__ member.".format(method.__name__)
@@ -405,36 +1667,353 @@ class ThreadPool(object):
 
         # Prepare the future result object
         future = FutureResult(self._logger)
+        task = (method, args, kwargs, future, _clock(), priority)
 
-        # Use a lock, as we might be "resetting" the queue
-        with self.__lock:
-            # Add the task to the queue
-            self._queue.put((method, args, kwargs, future), True, self._timeout)
-            self.__nb_pending_task += 1
+        self.__nb_queued.add()
+
+        if priority != 0 and not self.__by_priority:
+            self.__use_priorities()
 
-            if self.__nb_pending_task > self.__nb_threads:
-                # All threads are taken: start a new one
-                self.__start_thread()
+        if self.__by_priority:
+            if not self.__put_priority_task(task):
+                # Executed by the calling thread
+                return future
+        else:
+            self.__tasks.put(task)
 
+        self.__wake_threads(1)
         return future
 
-    def clear(self):
+    def enqueue_many(self, method, args_iterable, priority=0):
         """
-        Empties the current queue content.
-        Returns once the queue have been emptied.
+        Queues a task for each set of arguments, accounting for all of them
+        at once. With a bounded queue, the tasks which fit in the queue are
+        queued holding its lock once.
+
+        Unlike enqueue(), the tasks which can't be queued don't raise
+        queue.Full: the rejection policy is applied to each of them, their
+        futures getting a TaskDropped exception instead of the error.
+
+        :param method: Method to call
+        :param args_iterable: An iterable of tuples of positional arguments
+        :param priority: Priority of the tasks
+        :return: The list of the FutureResult objects of the tasks, in order
+        :raise ValueError: Invalid method
+        """
+        if not hasattr(method, "__call__"):
+            raise ValueError("{0!r} has no __call__ member.".format(method))
+
+        now = _clock()
+        logger = self._logger
+        tasks = [
+            (method, tuple(args), {}, FutureResult(logger), now, priority)
+            for args in args_iterable
+        ]
+        if not tasks:
+            return []
+
+        self.__nb_queued.add(len(tasks))
+
+        if priority != 0 and not self.__by_priority:
+            self.__use_priorities()
+
+        if self.__by_priority:
+            nb_queued = self._queue.put_many(tasks)
+            for _ in range(nb_queued):
+                self.__tasks.put(_PRIORITY_TASK)
+
+            # Let the threads handle the queued tasks before applying the
+            # rejection policy, which can block or run tasks in this thread
+            self.__wake_threads(nb_queued)
+            for task in tasks[nb_queued:]:
+                try:
+                    if self.__put_priority_task(task):
+                        self.__wake_threads(1)
+                except queue.Full:
+                    task[3].drop(TaskDropped("Task rejected: queue full"))
+        else:
+            for task in tasks:
+                self.__tasks.put(task)
+            self.__wake_threads(len(tasks))
+
+        return [task[3] for task in tasks]
+
+    def map(self, method, *iterables, **kwargs):
+        """
+        Executes the method in the pool with the arguments taken from the
+        iterables, like the built-in map(). All tasks are queued before the
+        first result is returned.
+
+        :param method: Method to call
+        :param iterables: Iterables giving the positional arguments
+        :param timeout: Maximum time to wait for all the results (in seconds,
+                        None for no limit)
+        :return: A generator of the results, in order
+        :raise ValueError: Invalid method
+        :raise TypeError: Unknown keyword argument
+        """
+        timeout = kwargs.pop("timeout", None)
+        if kwargs:
+            raise TypeError(
+                "Unexpected keyword arguments: {0}".format(", ".join(kwargs))
+            )
+
+        futures = self.enqueue_many(method, zip(*iterables))
+        return self.__results(futures, timeout)
+
+    @staticmethod
+    def __results(futures, timeout):
+        """
+        Yields the results of the given futures, in order
+
+        :param futures: A list of FutureResult objects
+        :param timeout: Maximum time to wait for all the results
+        :raise OSError: The timeout raised before a task finished
+        :raise Exception: The exception raised by a task
+        """
+        deadline = None if timeout is None else _clock() + timeout
+        for future in futures:
+            if deadline is None:
+                yield future.result()
+            else:
+                yield future.result(max(0, deadline - _clock()))
+
+    def __put_priority_task(self, task):
+        """
+        Puts a task in the priority queue, applying the rejection policy if
+        the queue is full. The task has already been accounted for.
+
+        :param task: A task tuple
+        :return: True if the task has been queued, False if it has been
+                 executed by the calling thread
+        :raise Full: The task has been rejected
+        """
+        policy = self.rejection
+        while True:
+            try:
+                if policy == REJECT_BLOCK:
+                    self._queue.put(task, True, self._timeout)
+                else:
+                    self._queue.put_nowait(task)
+            except queue.Full:
+                if policy == REJECT_DROP_OLDEST:
+                    oldest = self._queue.drop_oldest()
+                    if oldest is not None:
+                        # Its token stays in the tasks queue: the thread
+                        # taking the extra token will get _STALE_TASK
+                        self.__reject()
+                        self.__drop_task(oldest[3], "queue full")
+                    continue
+
+                self.__reject()
+                if policy == REJECT_CALLER_RUNS:
+                    method, args, kwargs, future = task[:4]
+                    try:
+                        future.execute(method, args, kwargs)
+                    except Exception as ex:
+                        self._logger.exception(
+                            "Error executing %s: %s", method.__name__, ex
+                        )
+                    finally:
+                        self.__task_done()
+                    return False
+
+                self.__task_done()
+                raise
+            else:
+                self.__tasks.put(_PRIORITY_TASK)
+                return True
+
+    def __reject(self):
+        """
+        Counts a task the queue couldn't accept
+        """
+        with self.__lock:
+            self.__nb_rejected += 1
+
+    def __wake_threads(self, nb_tasks):
+        """
+        Lets idle threads handle the queued tasks, starting new threads when
+        all of them are busy, if possible
+
+        :param nb_tasks: Number of queued tasks
+        """
+        if self._done_event.is_set():
+            return
+
+        for _ in range(nb_tasks):
+            try:
+                # Let an idle thread handle the task
+                self.__idle.get_nowait()
+            except queue.Empty:
+                # All threads are busy: start a new one, if possible
+                if self.__nb_threads < self._max_threads and (
+                    self._scaler is None or self.__stalled()
+                ):
+                    self.__start_thread()
+                else:
+                    break
+
+    def __stalled(self):
+        """
+        Checks if the autoscaling must add a thread as no thread took a task
+        from the queue for longer than the target delay, or if there is no
+        thread at all
+
+        :return: True if a thread must be started
+        """
+        if self.__nb_threads < max(self._min_threads, 1):
+            return True
+
+        now = _clock()
+        return self._scaler.should_grow(now - self.__last_dequeue, now)
+
+    def __use_priorities(self):
+        """
+        Switches to the priority queue, moving the tasks already queued
         """
         with self.__lock:
-            # Empty the current queue
+            if self.__by_priority:
+                # Already done by another thread
+                return
+            self.__by_priority = True
+
+            moved = []
             try:
                 while True:
-                    self._queue.get_nowait()
-                    self._queue.task_done()
+                    moved.append(self.__tasks.get_nowait())
             except queue.Empty:
-                # Queue is now empty
                 pass
 
-            # Wait for the tasks currently executed
-            self.join()
+            for item in moved:
+                if isinstance(item, tuple):
+                    self._queue.put(item)
+                    item = _PRIORITY_TASK
+                self.__tasks.put(item)
+
+    def __get_nb_pending(self):
+        """
+        Returns the number of queued or running tasks.
+
+        Finished tasks are counted first: the result can't be 0 while a task
+        is pending.
+        """
+        nb_finished = self.__nb_finished.value
+        return self.__nb_queued.value - nb_finished
+
+    def __task_done(self, nb_tasks=1):
+        """
+        Accounts for the end of tasks (executed or not)
+
+        :param nb_tasks: Number of finished tasks
+        """
+        self.__nb_finished.add(nb_tasks)
+        if self.__nb_joining and self.__tasks.empty():
+            # Tasks are still pending while the queue holds some: the
+            # threads executing them will check again
+            self.__notify_if_done()
+
+    def __notify_if_done(self):
+        """
+        Wakes up the threads in join() if all tasks are done.
+
+        The counters are read with the locks of their stripes, so either
+        join() sees the last task as finished or the thread which finished
+        it sees join() waiting.
+        """
+        with self.__lock:
+            if not self.__get_nb_pending():
+                self.__all_done.notify_all()
+
+    def get_stats(self):
+        """
+        Returns the statistics of the pool
+
+        :return: A dictionary with the number of queued tasks
+                 (``queue_depth``), of threads (``threads``) and of threads
+                 executing a task (``active_threads``), the number of started
+                 tasks (``started``), of finished ones (``completed``) and of
+                 those which raised an exception (``failed``), the total time
+                 the tasks spent in the queue (``wait_time``, in seconds) and
+                 executing (``busy_time``), and the fraction of its lifetime
+                 each thread spent executing tasks (``busy_ratio``, by thread
+                 name), and the number of tasks rejected or dropped by the
+                 rejection policy as the queue was full (``rejected``).
+                 With timing, the histograms of the time spent by the tasks
+                 in the queue (``wait_histogram``) and executing
+                 (``run_histogram``, see metrics.Histogram.to_dict()).
+                 With autoscaling, the number of threads added
+                 (``scale_ups``) and retired (``scale_downs``) by the policy,
+                 and the utilization of the threads during its last
+                 observation window (``utilization``, None before its end)
+        """
+        now = _clock()
+        totals = _WorkerStats(self.__buckets)
+        busy_ratio = {}
+        with self.__lock:
+            totals.add(self.__stopped_workers)
+            nb_active = 0
+            for thread, worker in self.__workers.items():
+                totals.add(worker)
+                busy = worker.get_busy_time(now)
+                totals.busy_time += busy - worker.busy_time
+                busy_ratio[thread.name] = busy / max(now - worker.since, 1e-9)
+                if worker.active:
+                    nb_active += 1
+
+            stats = {
+                "queue_depth": max(0, self.__get_nb_pending() - nb_active),
+                "threads": self.__nb_threads,
+                "active_threads": nb_active,
+                "started": totals.started,
+                "completed": totals.completed,
+                "failed": totals.failed,
+                "wait_time": totals.wait_time,
+                "busy_time": totals.busy_time,
+                "busy_ratio": busy_ratio,
+                "rejected": self.__nb_rejected,
+            }
+
+        if totals.wait_histogram is not None:
+            stats["wait_histogram"] = totals.wait_histogram.to_dict()
+            stats["run_histogram"] = totals.run_histogram.to_dict()
+
+        if self._scaler is not None:
+            stats["scale_ups"] = self._scaler.nb_scale_ups
+            stats["scale_downs"] = self._scaler.nb_scale_downs
+            stats["utilization"] = self._scaler.utilization
+        return stats
+
+    def clear(self):
+        """
+        Empties the current queue content.
+        Returns once the queue have been emptied.
+        """
+        nb_cleared = 0
+        try:
+            while True:
+                if isinstance(self.__tasks.get_nowait(), tuple):
+                    nb_cleared += 1
+        except queue.Empty:
+            # Queue is now empty
+            pass
+
+        try:
+            while True:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                nb_cleared += 1
+        except queue.Empty:
+            pass
+
+        if nb_cleared:
+            self.__nb_finished.add(nb_cleared)
+        if self.__nb_joining:
+            # The queue might have held the stop events of the threads
+            self.__notify_if_done()
+
+        # Wait for the tasks currently executed
+        self.join()
 
     def join(self, timeout=None):
         """
@@ -443,82 +2022,188 @@ class ThreadPool(object):
         :param timeout: Maximum time to wait (in seconds)
         :return: True if the queue has been emptied, else False
         """
-        if self._queue.empty():
-            # Nothing to wait for...
-            return True
-        elif timeout is None:
-            # Use the original join
-            self._queue.join()
+        with self.__all_done:
+            self.__nb_joining += 1
+            try:
+                if timeout is None:
+                    while self.__get_nb_pending():
+                        self.__all_done.wait()
+                    return True
+
+                deadline = _clock() + timeout
+                while self.__get_nb_pending():
+                    remaining = deadline - _clock()
+                    if remaining <= 0:
+                        return False
+                    self.__all_done.wait(remaining)
+                return True
+            finally:
+                self.__nb_joining -= 1
+
+    def __drop_task(self, future, reason="queue delay too long"):
+        """
+        Drops a task taken from the queue, without executing it
+
+        :param future: The future of the task
+        :param reason: Why the task is dropped
+        """
+        self.__task_done()
+
+        # Notify the future outside the lock
+        future.drop(TaskDropped("Task dropped: {0}".format(reason)))
+
+    def __next_task(self):
+        """
+        Waits for the next task to execute
+
+        :return: A task tuple, None if there is nothing to do yet,
+                 _STALE_TASK if the task of a token has been dropped or the
+                 stop event if the thread must stop
+        """
+        tasks = self.__tasks
+        try:
+            item = tasks.get_nowait()
+        except queue.Empty:
+            # Nothing to do: tell the pool this thread is idle, then wait
+            self.__idle.put(None)
+            if self._scaler is not None:
+                timeout = self._scaler.interval
+            else:
+                timeout = self._timeout
+
+            try:
+                item = tasks.get(True, timeout)
+            except queue.Empty:
+                return None
+
+        if item is _PRIORITY_TASK:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                # The queue has been cleared or its task has been dropped
+                if self.__nb_joining:
+                    self.__notify_if_done()
+                return _STALE_TASK
+            self._queue.task_done()
+        return item
+
+    def __retire(self):
+        """
+        Checks if the calling thread, idle for too long, can stop
+
+        :return: True if the thread has been accounted as stopped
+        """
+        with self.__lock:
+            try:
+                # Take back the idle token of this thread
+                self.__idle.get_nowait()
+            except queue.Empty:
+                # A task is being given to this idle thread
+                return False
+
+            if self.__nb_threads <= self._min_threads:
+                return False
+
+            if self._scaler is not None and not self._scaler.should_shrink(
+                self.__get_busy_time(), self.__nb_threads
+            ):
+                return False
+
+            self.__nb_threads -= 1
             return True
-        else:
-            # Wait for the condition
-            with self._queue.all_tasks_done:
-                self._queue.all_tasks_done.wait(timeout)
-                return not bool(self._queue.unfinished_tasks)
+
+    def __get_busy_time(self):
+        """
+        Returns the total time spent by the threads executing tasks, including
+        the current tasks. Must be called with the lock held.
+        """
+        now = _clock()
+        busy = self.__stopped_workers.busy_time
+        for worker in self.__workers.values():
+            busy += worker.get_busy_time(now)
+        return busy
 
     def __run(self):
         """
         The main loop
         """
+        current = threading.current_thread()
+        worker = _WorkerStats(self.__buckets)
+        with self.__lock:
+            self.__workers[current] = worker
+
         already_cleaned = False
         try:
             while not self._done_event.is_set():
-                try:
-                    # Wait for an action (blocking)
-                    task = self._queue.get(True, self._timeout)
-                    if task is self._done_event:
-                        # Stop event in the queue: get out
-                        self._queue.task_done()
-                        return
-                except queue.Empty:
+                task = self.__next_task()
+                if task is self._done_event:
+                    # Stop event in the queue: get out
+                    return
+                elif task is _STALE_TASK:
+                    # This thread isn't idle: don't retire it
+                    continue
+                elif task is None:
                     # Nothing to do yet
-                    pass
-                else:
-                    with self.__lock:
-                        self.__nb_active_threads += 1
-                    # Extract elements
-                    method, args, kwargs, future = task
-                    try:
-                        # Call the method
-                        future.execute(method, args, kwargs)
-                    except Exception as ex:
-                        self._logger.exception(
-                            "Error executing %s: %s", method.__name__, ex
-                        )
-                    finally:
-                        # Mark the action as executed
-                        self._queue.task_done()
-
-                        # Thread is not active anymore
-                        with self.__lock:
-                            self.__nb_pending_task -= 1
-                            self.__nb_active_threads -= 1
-
-                # Clean up thread if necessary
-                with self.__lock:
-                    extra_threads = self.__nb_threads - self.__nb_active_threads
-                    if (
-                        self.__nb_threads > self._min_threads
-                        and extra_threads > self._queue.qsize()
-                    ):
-                        # No more work for this thread
-                        # if there are more non active_thread than task
-                        # and we're above the  minimum number of threads:
-                        # stop this one
-                        self.__nb_threads -= 1
-
-                        # To avoid a race condition: decrease the number of
-                        # threads here and mark it as already accounted for
+                    if self.__retire():
+                        # To avoid a race condition: the number of threads
+                        # has been decreased by __retire()
                         already_cleaned = True
                         return
+                    continue
+
+                # Extract elements
+                method, args, kwargs, future, queued_at, _ = task
+                now = self.__last_dequeue = _clock()
+                if self._codel is not None and self._codel.should_drop(
+                    now - queued_at, now
+                ):
+                    self.__drop_task(future)
+                    continue
+
+                if (
+                    self._scaler is not None
+                    and self.__nb_threads < self._max_threads
+                    and self._scaler.should_grow(now - queued_at, now)
+                ):
+                    # Tasks wait for too long: add a thread
+                    self.__start_thread()
+
+                wait = now - queued_at
+                worker.task_start = now
+                worker.active = True
+                worker.started += 1
+                worker.wait_time += wait
+                try:
+                    # Call the method
+                    future.execute(method, args, kwargs)
+                except Exception as ex:
+                    worker.failed += 1
+                    self._logger.exception(
+                        "Error executing %s: %s", method.__name__, ex
+                    )
+                finally:
+                    run = _clock() - now
+                    worker.busy_time += run
+                    worker.completed += 1
+                    if worker.wait_histogram is not None:
+                        worker.wait_histogram.observe(wait)
+                        worker.run_histogram.observe(run)
+
+                    # Thread is not active anymore (after the end of the
+                    # task, so that it is never seen as queued)
+                    self.__task_done()
+                    worker.active = False
         finally:
             # Always clean up
             with self.__lock:
                 # Thread stops: clean up references
                 try:
-                    self._threads.remove(threading.current_thread())
+                    self._threads.remove(current)
                 except ValueError:
                     pass
 
+                if self.__workers.pop(current, None) is worker:
+                    self.__stopped_workers.add(worker)
+
                 if not already_cleaned:
                     self.__nb_threads -= 1
@@ -0,0 +1,1205 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the JSON-RPC dispatcher, without the HTTP layer
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from concurrent.futures import (
+        Future,
+        ProcessPoolExecutor,
+        ThreadPoolExecutor,
+    )
+except ImportError:
+    # Python 2
+    Future = ProcessPoolExecutor = ThreadPoolExecutor = None  # type: ignore
+
+# JSON-RPC library
+import jsonrpclib.config
+from jsonrpclib import Fault
+from jsonrpclib.SimpleJSONRPCServer import (
+    BUSY_FAULT_CODE,
+    ResultCache,
+    SimpleJSONRPCDispatcher,
+    cpu_bound,
+)
+from jsonrpclib.profiler import RequestProfiler
+from jsonrpclib.threadpool import ThreadPool
+
+# ------------------------------------------------------------------------------
+
+
+def make_batch(calls):
+    """
+    Prepares a batch request string
+
+    :param calls: A list of (method, params, id) tuples. A None ID means a
+                  notification
+    :return: A JSON-RPC batch string
+    """
+    batch = []
+    for method, params, rpcid in calls:
+        entry = {"jsonrpc": "2.0", "method": method, "params": params}
+        if rpcid is not None:
+            entry["id"] = rpcid
+        batch.append(entry)
+    return json.dumps(batch)
+
+
+class ParallelBatchTests(unittest.TestCase):
+    """
+    Tests the concurrent execution of batch entries
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher with a slow method
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+        def slow(value):
+            """
+            Returns the given value after a while, tracking concurrency
+            """
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.2)
+            with self.lock:
+                self.running -= 1
+            return value
+
+        self.dispatcher.register_function(slow)
+        self.pool = ThreadPool(10, 0)
+        self.pool.start()
+
+    def tearDown(self):
+        """
+        Cleans up the pool
+        """
+        self.pool.stop()
+
+    def _run_batch(self, nb_calls):
+        """
+        Runs a batch of slow calls, with a notification in the middle
+
+        :return: The parsed responses and the execution time
+        """
+        calls = [("slow", [idx], idx) for idx in range(nb_calls)]
+        calls.insert(nb_calls // 2, ("slow", [-1], None))
+
+        start = time.time()
+        response = self.dispatcher._marshaled_dispatch(make_batch(calls))
+        return json.loads(response), time.time() - start
+
+    def test_sequential(self):
+        """
+        Without pool, entries are executed one after the other
+        """
+        responses, duration = self._run_batch(4)
+        self.assertEqual([resp["result"] for resp in responses], list(range(4)))
+        self.assertEqual(self.max_running, 1)
+        self.assertGreaterEqual(duration, 1)
+
+    def test_parallel(self):
+        """
+        With a pool, entries are executed concurrently and in order
+        """
+        self.dispatcher.set_batch_pool(self.pool)
+        responses, duration = self._run_batch(8)
+
+        self.assertEqual([resp["id"] for resp in responses], list(range(8)))
+        self.assertEqual([resp["result"] for resp in responses], list(range(8)))
+        self.assertGreater(self.max_running, 1)
+        self.assertLess(duration, 1)
+
+    def test_max_parallel(self):
+        """
+        Checks the per-batch concurrency limit
+        """
+        self.dispatcher.set_batch_pool(self.pool, 2)
+        responses, _ = self._run_batch(6)
+
+        self.assertEqual([resp["result"] for resp in responses], list(range(6)))
+        self.assertEqual(self.max_running, 2)
+
+        for invalid in (0, -1, "abc"):
+            self.assertRaises(
+                ValueError, self.dispatcher.set_batch_pool, self.pool, invalid
+            )
+
+    def test_invalid_entries(self):
+        """
+        Invalid entries and errors must keep their position in the responses
+        """
+        self.dispatcher.set_batch_pool(self.pool)
+        batch = json.loads(
+            make_batch([("slow", [1], 1), ("unknown", [], 2), ("slow", [], 3)])
+        )
+        batch.insert(1, 42)
+
+        responses = json.loads(
+            self.dispatcher._marshaled_dispatch(json.dumps(batch))
+        )
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(responses[0]["result"], 1)
+        self.assertEqual(responses[1]["error"]["code"], -32600)
+        self.assertEqual(responses[2]["error"]["code"], -32601)
+        self.assertEqual(responses[3]["error"]["code"], -32602)
+
+    @unittest.skipIf(ThreadPoolExecutor is None, "No concurrent.futures")
+    def test_executor(self):
+        """
+        Standard executors can be used as batch pool
+        """
+        executor = ThreadPoolExecutor(8)
+        try:
+            self.dispatcher.set_batch_pool(executor, 4)
+            responses, duration = self._run_batch(8)
+        finally:
+            executor.shutdown()
+
+        self.assertEqual([resp["result"] for resp in responses], list(range(8)))
+        self.assertEqual(self.max_running, 4)
+        self.assertLess(duration, 1)
+
+
+    def test_priorities(self):
+        """
+        Batch entries are queued with the priority of their method
+        """
+        pool = ThreadPool(1, 1)
+        pool.start()
+        order = []
+
+        def record(name):
+            order.append(name)
+            time.sleep(0.05)
+            return name
+
+        self.dispatcher.register_function(record)
+        self.dispatcher.register_function(record, "urgent")
+        self.dispatcher.set_method_priority("urgent", -1)
+        self.assertEqual(self.dispatcher.get_method_priority("urgent"), -1)
+        self.assertEqual(self.dispatcher.get_method_priority("record"), 0)
+        self.assertRaises(
+            ValueError, self.dispatcher.set_method_priority, "record", "abc"
+        )
+
+        try:
+            # Keep the pool busy while the entries are queued
+            pool.enqueue(time.sleep, 0.2)
+
+            self.dispatcher.set_batch_pool(pool)
+            calls = [("record", ["bulk-{0}".format(i)], i) for i in range(3)]
+            calls.append(("urgent", ["urgent"], 3))
+            responses = json.loads(
+                self.dispatcher._marshaled_dispatch(make_batch(calls))
+            )
+        finally:
+            pool.stop()
+
+        # Responses are still in the order of the requests
+        self.assertEqual(
+            [resp["result"] for resp in responses],
+            ["bulk-0", "bulk-1", "bulk-2", "urgent"],
+        )
+        self.assertEqual(order, ["urgent", "bulk-0", "bulk-1", "bulk-2"])
+
+        self.dispatcher.set_method_priority("urgent", None)
+        self.assertEqual(self.dispatcher.get_method_priority("urgent"), 0)
+
+    @unittest.skipIf(Future is None, "No concurrent.futures")
+    def test_failed_tasks(self):
+        """
+        Entries whose task never runs must not block the batch
+        """
+
+        class FailingExecutor(object):
+            """
+            Executor returning failed futures without running the tasks
+            """
+
+            def submit(self, method, *args, **kwargs):
+                future = Future()
+                future.set_exception(RuntimeError("Task dropped"))
+                return future
+
+        self.dispatcher.set_batch_pool(FailingExecutor(), 1)
+        responses = json.loads(
+            self.dispatcher._marshaled_dispatch(
+                make_batch([("slow", [idx], idx) for idx in range(3)])
+            )
+        )
+
+        self.assertEqual([resp["id"] for resp in responses], list(range(3)))
+        for response in responses:
+            self.assertEqual(response["error"]["code"], -32603)
+            self.assertIn("Task dropped", response["error"]["message"])
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "No concurrent.futures")
+    def test_process_pool(self):
+        """
+        Process pools can't be used to execute batch entries
+        """
+        executor = ProcessPoolExecutor(1)
+        try:
+            self.assertRaises(
+                ValueError, self.dispatcher.set_batch_pool, executor
+            )
+        finally:
+            executor.shutdown()
+
+
+# ------------------------------------------------------------------------------
+
+
+class NotificationPoolTests(unittest.TestCase):
+    """
+    Tests the pools executing the notifications
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+
+    @staticmethod
+    def _notification(method, params):
+        """
+        Prepares a notification string
+        """
+        return json.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": params}
+        )
+
+    @unittest.skipIf(ThreadPoolExecutor is None, "No concurrent.futures")
+    def test_executor(self):
+        """
+        Standard executors can execute the notifications
+        """
+        event = threading.Event()
+        threads = []
+
+        def notify():
+            threads.append(threading.current_thread())
+            event.set()
+
+        self.dispatcher.register_function(notify)
+        executor = ThreadPoolExecutor(1)
+        try:
+            self.dispatcher.set_notification_pool(executor)
+            self.assertFalse(
+                self.dispatcher._marshaled_dispatch(
+                    self._notification("notify", [])
+                )
+            )
+            self.assertTrue(event.wait(5))
+        finally:
+            executor.shutdown()
+
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "No concurrent.futures")
+    def test_process_pool(self):
+        """
+        Notified functions can be executed in other processes
+        """
+        path = tempfile.mkdtemp()
+        self.dispatcher.register_function(os.mkdir, "mkdir")
+        self.dispatcher.register_function(lambda: None, "unpicklable")
+
+        executor = ProcessPoolExecutor(1)
+        try:
+            self.dispatcher.set_notification_pool(executor)
+            for method, params in (
+                ("mkdir", [os.path.join(path, "child")]),
+                ("unpicklable", []),
+                ("mkdir", {"unknown": 1}),
+                ("unknown", []),
+            ):
+                self.assertFalse(
+                    self.dispatcher._marshaled_dispatch(
+                        self._notification(method, params)
+                    )
+                )
+        finally:
+            executor.shutdown()
+
+        try:
+            self.assertTrue(os.path.isdir(os.path.join(path, "child")))
+        finally:
+            shutil.rmtree(path)
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "No concurrent.futures")
+    def test_process_pool_dispatch_method(self):
+        """
+        Errors of notifications given to a custom dispatch method in other
+        processes are logged
+        """
+        executor = ProcessPoolExecutor(1)
+        with self.assertLogs("jsonrpclib.SimpleJSONRPCServer", "ERROR"):
+            try:
+                self.dispatcher.set_notification_pool(executor)
+                self.assertFalse(
+                    self.dispatcher._marshaled_dispatch(
+                        self._notification("unknown", []),
+                        lambda method, params: None,
+                    )
+                )
+            finally:
+                executor.shutdown()
+
+
+class CpuBoundTests(unittest.TestCase):
+    """
+    Tests the execution of CPU-bound methods in a pool
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+
+    def _call(self, method, params):
+        """
+        Calls a method of the dispatcher
+
+        :return: The response dictionary
+        """
+        return json.loads(
+            self.dispatcher._marshaled_dispatch(
+                json.dumps(
+                    {
+                        "jsonrpc": "2.0",
+                        "method": method,
+                        "params": params,
+                        "id": 1,
+                    }
+                )
+            )
+        )
+
+    @unittest.skipIf(ThreadPoolExecutor is None, "No concurrent.futures")
+    def test_routing(self):
+        """
+        Only the CPU-bound methods are executed in the pool
+        """
+
+        @cpu_bound
+        def heavy(value):
+            return value, threading.current_thread().name
+
+        def light(value):
+            return value, threading.current_thread().name
+
+        self.dispatcher.register_function(heavy)
+        self.dispatcher.register_function(light)
+        self.dispatcher.register_function(name="forced", cpu_bound=True)(light)
+        self.dispatcher.register_function(heavy, "unforced", cpu_bound=False)
+        self.assertEqual(
+            self.dispatcher.get_cpu_bound_methods(), ["forced", "heavy"]
+        )
+
+        # No pool: executed in the calling thread
+        current = threading.current_thread().name
+        self.assertEqual(self._call("heavy", [1])["result"], [1, current])
+
+        executor = ThreadPoolExecutor(1, thread_name_prefix="cpu")
+        try:
+            self.dispatcher.set_cpu_bound_pool(executor)
+            for method, in_pool in (
+                ("heavy", True),
+                ("forced", True),
+                ("light", False),
+                ("unforced", False),
+            ):
+                value, thread = self._call(method, {"value": 42})["result"]
+                self.assertEqual(value, 42)
+                self.assertEqual(thread.startswith("cpu"), in_pool, method)
+
+            # Parameters are still checked before being sent to the pool
+            self.assertEqual(self._call("heavy", [])["error"]["code"], -32602)
+        finally:
+            executor.shutdown()
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "No concurrent.futures")
+    def test_process_pool(self):
+        """
+        CPU-bound methods can be executed in other processes
+        """
+        self.dispatcher.register_function(os.getpid, "pid", cpu_bound=True)
+        self.dispatcher.register_function(
+            lambda: 42, "unpicklable", cpu_bound=True
+        )
+        self.dispatcher.register_function(os.rmdir, "rmdir", cpu_bound=True)
+
+        executor = ProcessPoolExecutor(1)
+        try:
+            self.dispatcher.set_cpu_bound_pool(executor)
+            pid = self._call("pid", [])["result"]
+            self.assertNotEqual(pid, os.getpid())
+
+            # Errors are returned as faults
+            for method, params in (
+                ("unpicklable", []),
+                ("rmdir", ["/does/not/exist"]),
+            ):
+                error = self._call(method, params)["error"]
+                self.assertEqual(error["code"], -32603)
+        finally:
+            executor.shutdown()
+
+
+# ------------------------------------------------------------------------------
+
+
+class MethodResolutionTests(unittest.TestCase):
+    """
+    Tests the resolution cache and the parameters checks of the dispatcher
+    """
+
+    def setUp(self):
+        """
+        Prepares the dispatcher
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+
+    def _call(self, method, params):
+        """
+        Calls a method through the dispatcher
+
+        :return: The parsed response dictionary
+        """
+        request = json.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        )
+        return json.loads(self.dispatcher._marshaled_dispatch(request))
+
+    def _assert_error(self, response, code):
+        """
+        Checks the error code of a response
+        """
+        self.assertNotIn("result", response)
+        self.assertEqual(response["error"]["code"], code)
+
+    def test_params_shape(self):
+        """
+        Invalid parameters must be detected before the call
+        """
+
+        def method(a, b=2, *args, **kwargs):
+            return [a, b, list(args), kwargs]
+
+        def pair(a, b=2):
+            return [a, b]
+
+        self.dispatcher.register_function(method)
+        self.dispatcher.register_function(pair)
+
+        self.assertEqual(self._call("method", [1])["result"], [1, 2, [], {}])
+        self.assertEqual(
+            self._call("method", [1, 3, 4])["result"], [1, 3, [4], {}]
+        )
+        self.assertEqual(
+            self._call("method", {"a": 1, "c": 3})["result"],
+            [1, 2, [], {"c": 3}],
+        )
+        self._assert_error(self._call("method", []), -32602)
+        self._assert_error(self._call("method", {"b": 1}), -32602)
+
+        self.assertEqual(self._call("pair", {"a": 1})["result"], [1, 2])
+        self._assert_error(self._call("pair", [1, 2, 3]), -32602)
+        self._assert_error(self._call("pair", {"a": 1, "c": 3}), -32602)
+
+    def test_inner_type_error(self):
+        """
+        A TypeError raised by the method is a server error
+        """
+
+        def buggy(value):
+            return value + "text"
+
+        self.dispatcher.register_function(buggy)
+        response = self._call("buggy", [42])
+        self._assert_error(response, -32603)
+        self.assertIn("TypeError", response["error"]["message"])
+
+    def test_cache_invalidation(self):
+        """
+        Registering methods must invalidate the resolution cache
+        """
+        self.dispatcher.register_function(lambda: 1, "value")
+        self.assertEqual(self._call("value", [])["result"], 1)
+
+        self.dispatcher.register_function(lambda: 2, "value")
+        self.assertEqual(self._call("value", [])["result"], 2)
+
+        # Unknown methods are not cached
+        self._assert_error(self._call("other", []), -32601)
+        self.dispatcher.register_function(lambda: 3, "other")
+        self.assertEqual(self._call("other", [])["result"], 3)
+
+        # Direct modification of the registered functions
+        self.assertEqual(self._call("value", [])["result"], 2)
+        self.dispatcher.funcs["value"] = lambda: 4
+        self.assertEqual(self._call("value", [])["result"], 2)
+        self.dispatcher.clear_methods_cache()
+        self.assertEqual(self._call("value", [])["result"], 4)
+
+    def test_concurrent_invalidation(self):
+        """
+        A method resolved while the cache is cleared must not be cached
+        """
+        dispatcher = self.dispatcher
+        dispatcher.register_function(lambda: 1, "value")
+
+        class ClearingFuncs(dict):
+            """
+            Replaces the method and clears the cache during its resolution
+            """
+
+            def __getitem__(self, key):
+                value = dict.__getitem__(self, key)
+                if key == "value":
+                    dict.__setitem__(self, key, lambda: 2)
+                    dispatcher.clear_methods_cache()
+                return value
+
+        dispatcher.funcs = ClearingFuncs(dispatcher.funcs)
+        self.assertEqual(self._call("value", [])["result"], 1)
+
+        dispatcher.funcs = dict(dispatcher.funcs)
+        self.assertEqual(self._call("value", [])["result"], 2)
+
+    def test_instance(self):
+        """
+        Checks the resolution of the methods of the registered instance
+        """
+
+        class Instance(object):
+            def add(self, a, b):
+                return a + b
+
+        class Dispatching(object):
+            def _dispatch(self, method, params):
+                return [method, params]
+
+        self.dispatcher.register_instance(Instance())
+        self.assertEqual(self._call("add", [1, 2])["result"], 3)
+        self._assert_error(self._call("add", [1]), -32602)
+        self._assert_error(self._call("sub", [1, 2]), -32601)
+
+        # Changes of the instance are taken into account
+        instance = Instance()
+        self.dispatcher.register_instance(instance)
+        self.assertEqual(self._call("add", [1, 2])["result"], 3)
+        instance.add = lambda a, b: a * b
+        self.assertEqual(self._call("add", [2, 3])["result"], 6)
+
+        self.dispatcher.register_instance(Dispatching())
+        self.assertEqual(self._call("add", [1])["result"], ["add", [1]])
+
+        # Registered functions have priority over the instance
+        self.dispatcher.register_function(lambda: 42, "add")
+        self.assertEqual(self._call("add", [])["result"], 42)
+
+
+# ------------------------------------------------------------------------------
+
+
+class BulkheadTests(unittest.TestCase):
+    """
+    Tests the per-method concurrency limits
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher with blocking methods
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.event = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.threads = []
+
+        def block():
+            self.started.release()
+            self.event.wait(5)
+            return True
+
+        self.dispatcher.register_function(block)
+        self.dispatcher.register_function(block, "export.csv")
+        self.dispatcher.register_function(block, "export.json")
+        self.dispatcher.register_function(lambda: True, "ping")
+
+    def tearDown(self):
+        """
+        Releases the blocked calls
+        """
+        self.event.set()
+        for thread in self.threads:
+            thread.join(5)
+
+    def _call(self, method):
+        """
+        Calls a method through the dispatcher
+
+        :return: The parsed response dictionary
+        """
+        request = json.dumps({"jsonrpc": "2.0", "method": method, "id": 1})
+        return json.loads(self.dispatcher._marshaled_dispatch(request))
+
+    def _call_in_thread(self, method):
+        """
+        Calls a method from another thread and waits for it to start
+        """
+        thread = threading.Thread(target=self._call, args=(method,))
+        thread.start()
+        self.threads.append(thread)
+        self.assertTrue(self.started.acquire(timeout=5))
+
+    def test_fail_fast(self):
+        """
+        Calls over the limit are rejected immediately
+        """
+        self.dispatcher.set_method_limit("block", 2)
+        for _ in range(2):
+            self._call_in_thread("block")
+
+        response = self._call("block")
+        self.assertEqual(response["error"]["code"], BUSY_FAULT_CODE)
+
+        # Other methods are not limited
+        self.assertTrue(self._call("ping")["result"])
+
+        self.assertEqual(
+            self.dispatcher.get_method_limits(),
+            {"block": {"limit": 2, "in_flight": 2, "waiting": 0, "rejected": 1}},
+        )
+
+        self.event.set()
+        for thread in self.threads:
+            thread.join(5)
+        self.assertEqual(
+            self.dispatcher.get_method_limits()["block"]["in_flight"], 0
+        )
+
+        for invalid in (0, -1, "abc"):
+            self.assertRaises(
+                ValueError, self.dispatcher.set_method_limit, "ping", invalid
+            )
+
+        self.dispatcher.set_method_limit("block", None)
+        self.assertEqual(self.dispatcher.get_method_limits(), {})
+
+    def test_bounded_wait(self):
+        """
+        Calls over the limit wait for a slot, up to a timeout
+        """
+        self.dispatcher.set_method_limit("block", 1, 0.2)
+        self._call_in_thread("block")
+
+        start = time.time()
+        response = self._call("block")
+        self.assertEqual(response["error"]["code"], BUSY_FAULT_CODE)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        # Release the slot while waiting
+        self.dispatcher.set_method_limit("block", 1, 5)
+        threading.Timer(0.1, self.event.set).start()
+        self.assertTrue(self._call("block")["result"])
+        self.assertEqual(
+            self.dispatcher.get_method_limits()["block"]["rejected"], 1
+        )
+
+    def test_namespace(self):
+        """
+        Namespace limits apply to all the methods of the namespace
+        """
+        self.dispatcher.set_method_limit("export.*", 1)
+        self._call_in_thread("export.csv")
+
+        response = self._call("export.json")
+        self.assertEqual(response["error"]["code"], BUSY_FAULT_CODE)
+        self.assertEqual(
+            self.dispatcher.get_method_limits()["export.*"]["in_flight"], 1
+        )
+
+
+# ------------------------------------------------------------------------------
+
+
+class ResultCacheTests(unittest.TestCase):
+    """
+    Tests the memoization of method results
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher with a counting method
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.calls = []
+
+    def _register(self, cache):
+        """
+        Registers the "add" method with the given cache
+        """
+
+        @self.dispatcher.register_function(cache=cache)
+        def add(a, b):
+            self.calls.append((a, b))
+            return {"sum": a + b}
+
+    def _call(self, params, rpcid=1):
+        """
+        Calls the "add" method through the dispatcher
+
+        :return: The parsed response dictionary
+        """
+        request = json.dumps(
+            {"jsonrpc": "2.0", "method": "add", "params": params, "id": rpcid}
+        )
+        return json.loads(self.dispatcher._marshaled_dispatch(request))
+
+    def test_hits(self):
+        """
+        Calls with the same parameters are computed once
+        """
+        for serialize in (False, True):
+            self.calls = []
+            self._register(ResultCache(serialize=serialize))
+
+            for rpcid in range(3):
+                response = self._call([1, 2], rpcid)
+                self.assertEqual(response["id"], rpcid)
+                self.assertEqual(response["result"], {"sum": 3})
+
+            self.assertEqual(self._call({"b": 2, "a": 3})["result"]["sum"], 5)
+            self.assertEqual(self._call({"a": 3, "b": 2})["result"]["sum"], 5)
+            self.assertEqual(len(self.calls), 2)
+
+            stats = self.dispatcher.get_cache_stats()["add"]
+            self.assertEqual(stats["hits"], 3)
+            self.assertEqual(stats["misses"], 2)
+            self.assertEqual(stats["size"], 2)
+
+    def test_batch(self):
+        """
+        Serialized results are reused in batch responses
+        """
+        self._register(ResultCache(serialize=True))
+        self.dispatcher.register_function(lambda: True, "ping")
+        batch = make_batch(
+            [("add", [1, 2], 1), ("ping", [], 2), ("add", [1, 2], 3)]
+        )
+        responses = json.loads(self.dispatcher._marshaled_dispatch(batch))
+        self.assertEqual(
+            [(entry["id"], entry["result"]) for entry in responses],
+            [(1, {"sum": 3}), (2, True), (3, {"sum": 3})],
+        )
+        self.assertEqual(len(self.calls), 1)
+
+    def test_expiration(self):
+        """
+        Entries expire after their TTL and the oldest are evicted first
+        """
+        self._register(ResultCache(ttl=0.1, max_size=2))
+        self._call([1, 1])
+        self._call([2, 2])
+        self._call([1, 1])
+        self._call([3, 3])
+        self.assertEqual(self.dispatcher.get_cache_stats()["add"]["evictions"], 1)
+
+        # [2, 2] has been evicted
+        self._call([2, 2])
+        self.assertEqual(len(self.calls), 4)
+
+        time.sleep(0.15)
+        self._call([2, 2])
+        self.assertEqual(len(self.calls), 5)
+
+    def test_errors(self):
+        """
+        Faults and notifications are not cached
+        """
+        self._register(ResultCache())
+        self.assertIn("error", self._call(["a", 1]))
+        self.assertIn("error", self._call(["a", 1]))
+        self.assertEqual(len(self.calls), 2)
+
+        notification = json.dumps(
+            {"jsonrpc": "2.0", "method": "add", "params": [1, 2]}
+        )
+        self.dispatcher._marshaled_dispatch(notification)
+        self.assertEqual(self.dispatcher.get_cache_stats()["add"]["size"], 0)
+
+    def test_invalid(self):
+        """
+        Invalid cache parameters are rejected
+        """
+        for kwargs in ({"ttl": 0}, {"max_size": 0}, {"ttl": "abc"}):
+            self.assertRaises(ValueError, ResultCache, **kwargs)
+
+
+class SingleFlightTests(unittest.TestCase):
+    """
+    Tests the coalescing of identical concurrent calls
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher with a blocking method
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.event = threading.Event()
+        self.calls = []
+
+        def fetch(key):
+            self.calls.append(key)
+            self.event.wait(5)
+            if key == "error":
+                raise KeyError(key)
+            return key.upper()
+
+        self.dispatcher.register_function(fetch)
+
+    def _call_all(self, keys):
+        """
+        Calls the "fetch" method concurrently, once per key
+
+        :return: The parsed responses, in the order of the keys
+        """
+        responses = [None] * len(keys)
+
+        def call(idx):
+            request = json.dumps(
+                {
+                    "jsonrpc": "2.0",
+                    "method": "fetch",
+                    "params": [keys[idx]],
+                    "id": idx,
+                }
+            )
+            responses[idx] = json.loads(
+                self.dispatcher._marshaled_dispatch(request)
+            )
+
+        threads = [
+            threading.Thread(target=call, args=(idx,))
+            for idx in range(len(keys))
+        ]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(0.2)
+        self.event.set()
+        for thread in threads:
+            thread.join(5)
+        return responses
+
+    def test_coalescing(self):
+        """
+        Identical concurrent calls are executed once
+        """
+        self.dispatcher.set_single_flight("fetch")
+        responses = self._call_all(["a", "a", "a", "b"])
+
+        self.assertEqual(sorted(self.calls), ["a", "b"])
+        self.assertEqual(
+            [(response["id"], response["result"]) for response in responses],
+            [(0, "A"), (1, "A"), (2, "A"), (3, "B")],
+        )
+        self.assertEqual(
+            self.dispatcher.get_single_flight_stats(), {"fetch": 2}
+        )
+
+        # Later calls are executed again
+        self.assertEqual(self._call_all(["a"])[0]["result"], "A")
+        self.assertEqual(len(self.calls), 3)
+
+    def test_errors(self):
+        """
+        Errors are propagated to all the coalesced calls
+        """
+        self.dispatcher.set_single_flight("fetch")
+        responses = self._call_all(["error", "error"])
+        self.assertEqual(self.calls, ["error"])
+        self.assertEqual([response["id"] for response in responses], [0, 1])
+        for response in responses:
+            self.assertIn("KeyError", response["error"]["message"])
+
+    def test_disabled(self):
+        """
+        Calls are not coalesced by default
+        """
+        self._call_all(["a", "a"])
+        self.assertEqual(self.calls, ["a", "a"])
+
+        self.dispatcher.set_single_flight("fetch")
+        self.dispatcher.set_single_flight("fetch", False)
+        self.assertEqual(self.dispatcher.get_single_flight_stats(), {})
+
+
+class BulkConsumerTests(unittest.TestCase):
+    """
+    Tests the delivery of notifications by batches
+    """
+
+    def test_batches(self):
+        """
+        Notifications of a bulk method are delivered by batches
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        batches = []
+
+        @dispatcher.register_bulk_consumer(max_size=2, max_delay=0.1)
+        def log(batch):
+            batches.append(batch)
+
+        dispatcher.register_function(lambda: True, "ping")
+        self.addCleanup(dispatcher.stop_bulk_consumers)
+
+        calls = [("log", ["a"], None), ("log", {"b": 1}, None)]
+        calls.append(("ping", [], 1))
+        calls.append(("log", ["c"], None))
+        responses = json.loads(
+            dispatcher._marshaled_dispatch(make_batch(calls))
+        )
+        self.assertEqual([response["id"] for response in responses], [1])
+
+        time.sleep(0.2)
+        self.assertEqual(batches, [[["a"], {"b": 1}], [["c"]]])
+
+        stats = dispatcher.get_bulk_stats()["log"]
+        self.assertEqual(stats["delivered"], 3)
+        self.assertEqual(stats["batches"], 2)
+        self.assertEqual(stats["dropped"], 0)
+
+
+class VectorizedTests(unittest.TestCase):
+    """
+    Tests the vectorized implementations of methods
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher with a vectorized method
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.calls = []
+        self.prices = {"a": 1, "b": 2}
+
+        def get_price(sku):
+            self.calls.append(sku)
+            return self.prices[sku]
+
+        def get_prices(params_list):
+            self.calls.append(params_list)
+            return [
+                self.prices.get(params[0], Fault(404, "Unknown SKU"))
+                for params in params_list
+            ]
+
+        self.dispatcher.register_function(get_price, vectorized=get_prices)
+        self.dispatcher.register_function(lambda: True, "ping")
+
+    def _call(self, calls):
+        """
+        Dispatches a batch
+
+        :return: The (id, result or error code) list of responses
+        """
+        responses = json.loads(
+            self.dispatcher._marshaled_dispatch(make_batch(calls))
+        )
+        return [
+            (
+                response["id"],
+                response["result"]
+                if "result" in response
+                else response["error"]["code"],
+            )
+            for response in responses
+        ]
+
+    def test_vectorized(self):
+        """
+        Calls of a batch to the same method are handled at once
+        """
+        responses = self._call(
+            [
+                ("get_price", ["a"], 1),
+                ("ping", [], 2),
+                ("get_price", ["b"], 3),
+                ("get_price", ["c"], 4),
+                ("get_price", ["a"], None),
+                ("get_price", [], 5),
+            ]
+        )
+        self.assertEqual(
+            responses, [(1, 1), (2, True), (3, 2), (4, 404), (5, -32602)]
+        )
+        self.assertEqual(self.calls, [[["a"], ["b"], ["c"], ["a"]]])
+
+    def test_single_call(self):
+        """
+        A single call uses the usual implementation
+        """
+        self.assertEqual(
+            self._call([("get_price", ["a"], 1), ("ping", [], 2)]),
+            [(1, 1), (2, True)],
+        )
+        self.assertEqual(self.calls, ["a"])
+
+    def test_errors(self):
+        """
+        Errors of the vectorized implementation are returned to all calls
+        """
+        self.dispatcher.register_function(
+            lambda sku: sku, "echo", vectorized=lambda params_list: [1]
+        )
+        responses = self._call([("echo", ["a"], 1), ("echo", ["b"], 2)])
+        self.assertEqual(responses, [(1, -32603), (2, -32603)])
+
+
+class ProfilerTests(unittest.TestCase):
+    """
+    Tests the sampling profiler of method calls
+    """
+
+    def setUp(self):
+        """
+        Prepares a dispatcher with a profiler
+        """
+        self.dispatcher = SimpleJSONRPCDispatcher()
+        self.dispatcher.register_function(lambda: sum(range(100)), "compute")
+        self.dispatcher.register_function(lambda t: time.sleep(t), "sleep")
+
+    def _call(self, method, *params):
+        """
+        Calls a method through the dispatcher
+
+        :return: The parsed response dictionary
+        """
+        request = json.dumps(
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        )
+        return json.loads(self.dispatcher._marshaled_dispatch(request))
+
+    def test_sampling(self):
+        """
+        Sampled calls are profiled and dumped by method
+        """
+        profiler = RequestProfiler(sample_rate=1)
+        self.dispatcher.set_profiler(profiler)
+
+        # Disabled profiler
+        self._call("compute")
+        self.assertEqual(profiler.get_profiled_methods(), {})
+
+        profiler.enable()
+        for _ in range(3):
+            self.assertEqual(self._call("compute")["result"], 4950)
+        self.assertEqual(profiler.get_profiled_methods(), {"compute": 3})
+        self.assertGreater(profiler.get_stats("compute").total_calls, 0)
+        self.assertIsNone(profiler.get_stats("sleep"))
+
+        directory = tempfile.mkdtemp()
+        try:
+            paths = profiler.dump(directory)
+            self.assertEqual(
+                paths, [os.path.join(directory, "compute.pstats")]
+            )
+            self.assertGreater(pstats.Stats(paths[0]).total_calls, 0)
+        finally:
+            shutil.rmtree(directory)
+
+        profiler.disable()
+        self._call("compute")
+        self.assertEqual(profiler.get_profiled_methods(), {"compute": 3})
+
+    def test_slow_calls(self):
+        """
+        Slow calls are logged with their stack
+        """
+        profiler = RequestProfiler(sample_rate=0, slow_threshold=0.1)
+        self.dispatcher.set_profiler(profiler)
+        self.dispatcher.register_profiler_functions()
+        self.assertTrue(self._call("system.profiler.enable")["result"])
+        self.addCleanup(profiler.disable)
+
+        self._call("sleep", 0.01)
+        self._call("sleep", 0.3)
+
+        slow_calls = self._call("system.profiler.slow_calls")["result"]
+        self.assertEqual([call["method"] for call in slow_calls], ["sleep"])
+        self.assertGreaterEqual(slow_calls[0]["duration"], 0.3)
+        self.assertEqual(slow_calls[0]["params_size"], len(repr([0.3])))
+        self.assertIn("sleep", slow_calls[0]["stack"])
+
+        # No dump directory
+        self.assertIn("error", self._call("system.profiler.dump"))
+
+    def test_invalid(self):
+        """
+        Invalid parameters are rejected
+        """
+        for kwargs in ({"sample_rate": 2}, {"slow_threshold": 0}):
+            self.assertRaises(ValueError, RequestProfiler, **kwargs)
+
+        self.assertRaises(
+            ValueError, self.dispatcher.register_profiler_functions
+        )
+
+
+class RequestConfigTests(unittest.TestCase):
+    """
+    Tests the configuration used to answer JSON-RPC 1.0 requests on a
+    JSON-RPC 2.0 dispatcher
+    """
+
+    def test_json_rpc_1_0(self):
+        """
+        JSON-RPC 1.0 requests get JSON-RPC 1.0 responses, following the
+        changes of the server configuration
+        """
+        config = jsonrpclib.config.Config()
+        dispatcher = SimpleJSONRPCDispatcher(config=config)
+        dispatcher.register_function(lambda: 1.5, "value")
+
+        def call(**extra):
+            request = {"method": "value", "params": [], "id": 1}
+            request.update(extra)
+            return json.loads(
+                dispatcher._marshaled_dispatch(json.dumps(request))
+            )
+
+        for _ in range(2):
+            self.assertEqual(call(), {"result": 1.5, "error": None, "id": 1})
+            self.assertEqual(
+                call(jsonrpc="2.0"), {"jsonrpc": "2.0", "result": 1.5, "id": 1}
+            )
+
+        # Serialization handlers added later are used
+        config.serialize_handlers[float] = lambda obj, *_: int(obj)
+        self.assertEqual(call()["result"], 1)
+        self.assertEqual(call(jsonrpc="2.0")["result"], 1)
+        self.assertEqual(config.version, 2.0)
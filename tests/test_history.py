@@ -10,6 +10,8 @@ Tests the History class
 from jsonrpclib.history import History
 
 # Standard library
+import threading
+
 try:
     import unittest2 as unittest
 except ImportError:
@@ -81,3 +83,24 @@ class HistoryTests(unittest.TestCase):
         self.assertIs(history.responses, original_responses)
         self.assertIsNone(history.request)
         self.assertIsNone(history.response)
+
+    def test_threads(self):
+        """
+        Ensures that the history can be filled by concurrent threads
+        """
+        history = History()
+
+        def fill():
+            for idx in range(1000):
+                history.add_request(idx)
+                history.add_response(idx)
+
+        threads = [threading.Thread(target=fill) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(history.requests), 8000)
+        self.assertEqual(len(history.responses), 8000)
+        self.assertEqual(history.request, 999)
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the execution of CPU-bound methods in subinterpreters
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import json
+import os
+import threading
+import unittest
+
+# JSON-RPC library
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher
+import jsonrpclib.interpreters as interpreters
+
+# ------------------------------------------------------------------------------
+
+
+def describe(value, scale=1):
+    """
+    Module-level function executed by the pools
+    """
+    return {
+        "value": value * scale,
+        "thread": threading.current_thread().name,
+        "pid": os.getpid(),
+    }
+
+
+# ------------------------------------------------------------------------------
+
+
+@unittest.skipIf(
+    interpreters.ThreadPoolExecutor is None, "No concurrent.futures"
+)
+class InterpreterPoolTests(unittest.TestCase):
+    """
+    Tests the InterpreterPool
+    """
+
+    def test_backend(self):
+        """
+        Subinterpreters are used where available, else the fallback
+        """
+        self.assertRaises(
+            ValueError, interpreters.InterpreterPool, 1, "interpreter"
+        )
+
+        for fallback in (
+            interpreters.BACKEND_PROCESS,
+            interpreters.BACKEND_THREAD,
+        ):
+            pool = interpreters.InterpreterPool(1, fallback)
+            try:
+                if interpreters.InterpreterPoolExecutor is not None:
+                    expected = interpreters.BACKEND_INTERPRETER
+                else:
+                    expected = fallback
+                self.assertEqual(pool.backend, expected)
+            finally:
+                pool.shutdown()
+
+    def test_submit_call(self):
+        """
+        Calls are exchanged as JSON messages
+        """
+        pool = interpreters.InterpreterPool(1, interpreters.BACKEND_THREAD)
+        try:
+            self.assertEqual(
+                pool.submit_call(describe, [21, 2]).result()["value"], 42
+            )
+            future = pool.submit_call(describe, {"value": "a", "scale": 3})
+            self.assertEqual(future.result()["value"], "aaa")
+
+            # Errors of the function are given by the future
+            future = pool.submit_call(describe, [])
+            self.assertRaises(TypeError, future.result)
+
+            # Only module-level functions and JSON parameters are accepted
+            self.assertRaises(ValueError, pool.submit_call, lambda: None, [])
+            self.assertRaises(
+                ValueError, pool.submit_call, self.test_submit_call, []
+            )
+
+            def main_function():
+                return None
+
+            main_function.__module__ = "__main__"
+            main_function.__qualname__ = "main_function"
+            self.assertRaises(ValueError, pool.submit_call, main_function, [])
+            self.assertRaises(
+                ValueError, pool.submit_call, describe, [object()]
+            )
+        finally:
+            pool.shutdown()
+
+    def test_process_fallback(self):
+        """
+        The process fallback executes the calls in other processes
+        """
+        pool = interpreters.InterpreterPool(1)
+        try:
+            pid = pool.submit_call(os.getpid, []).result()
+            if pool.backend == interpreters.BACKEND_PROCESS:
+                self.assertNotEqual(pid, os.getpid())
+            elif pool.backend == interpreters.BACKEND_INTERPRETER:
+                # Subinterpreters live in the same process
+                self.assertEqual(pid, os.getpid())
+        finally:
+            pool.shutdown()
+
+    def test_dispatcher(self):
+        """
+        The pool can execute the CPU-bound methods of a dispatcher
+        """
+        dispatcher = SimpleJSONRPCDispatcher()
+        dispatcher.register_function(describe, cpu_bound=True)
+        pool = interpreters.InterpreterPool(1, interpreters.BACKEND_THREAD)
+        try:
+            dispatcher.set_cpu_bound_pool(pool)
+            for params in ([21, 2], {"value": 21, "scale": 2}):
+                response = json.loads(
+                    dispatcher._marshaled_dispatch(
+                        json.dumps(
+                            {
+                                "jsonrpc": "2.0",
+                                "method": "describe",
+                                "params": params,
+                                "id": 1,
+                            }
+                        )
+                    )
+                )
+                result = response["result"]
+                self.assertEqual(result["value"], 42)
+                if pool.backend == interpreters.BACKEND_THREAD:
+                    self.assertNotEqual(
+                        result["thread"], threading.current_thread().name
+                    )
+        finally:
+            pool.shutdown()
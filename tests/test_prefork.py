@@ -0,0 +1,219 @@
+#!/usr/bin/python
+# -- Content-Encoding: UTF-8 --
+"""
+Tests the pre-fork multi-process runner
+
+:license: Apache License 2.0
+"""
+
+# Standard library
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+# JSON-RPC library
+from jsonrpclib import ServerProxy
+from jsonrpclib.SimpleJSONRPCServer import (
+    PooledJSONRPCServer,
+    SimpleJSONRPCServer,
+)
+from jsonrpclib.prefork import PreforkServer
+from jsonrpclib.threadpool import ThreadPool
+
+# ------------------------------------------------------------------------------
+
+if not hasattr(os, "fork"):
+    raise unittest.SkipTest("fork() is not supported here.")
+
+
+class PreforkServerTests(unittest.TestCase):
+    """
+    Checks the behaviour of the pre-fork runner
+    """
+
+    def _start(self, reuse_port=False, server=None):
+        """
+        Starts a pre-fork runner with two workers, supervised in a thread
+
+        :param reuse_port: Use the SO_REUSEPORT mode
+        :param server: The server to run (a new SimpleJSONRPCServer if None)
+        :return: The runner and its supervision thread
+        """
+        if server is None:
+            server = SimpleJSONRPCServer(
+                ("localhost", 0),
+                logRequests=False,
+                bind_and_activate=not reuse_port,
+            )
+        server.register_function(os.getpid, "pid")
+
+        runner = PreforkServer(server, 2, reuse_port=reuse_port)
+        runner.start()
+
+        thread = threading.Thread(target=runner.serve_forever, args=(0.1,))
+        thread.daemon = True
+        thread.start()
+        return runner, thread
+
+    def _stop(self, runner, thread):
+        """
+        Stops the given runner
+        """
+        runner.shutdown()
+        thread.join(15)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(runner.workers, [])
+
+    def _call_pid(self, runner):
+        """
+        Calls the pid() method on a new connection
+
+        :return: The PID of the worker which handled the call
+        """
+        url = "http://localhost:{0}".format(runner.server_address[1])
+        return ServerProxy(url).pid()
+
+    def _check_serving(self, runner):
+        """
+        Checks that calls are handled by the workers
+        """
+        workers = runner.workers
+        self.assertEqual(len(workers), 2)
+        for _ in range(10):
+            self.assertIn(self._call_pid(runner), workers)
+
+    def test_shared_socket(self):
+        """
+        Workers accept connections on the socket bound by the master
+        """
+        runner, thread = self._start()
+        try:
+            self._check_serving(runner)
+        finally:
+            self._stop(runner, thread)
+
+    @unittest.skipUnless(hasattr(socket, "SO_REUSEPORT"), "No SO_REUSEPORT")
+    def test_reuse_port(self):
+        """
+        Workers listen on their own socket, with SO_REUSEPORT
+        """
+        runner, thread = self._start(True)
+        try:
+            # Give some time to the workers to bind their sockets
+            time.sleep(0.5)
+            self._check_serving(runner)
+        finally:
+            self._stop(runner, thread)
+
+    def test_pooled_server(self):
+        """
+        The running request pool of a pooled server is restarted in workers
+        """
+        pool = ThreadPool(4, 2)
+        pool.start()
+        server = PooledJSONRPCServer(
+            ("localhost", 0), logRequests=False, thread_pool=pool
+        )
+
+        runner, thread = self._start(server=server)
+        try:
+            self._check_serving(runner)
+        finally:
+            self._stop(runner, thread)
+            pool.stop()
+
+    def test_restart(self):
+        """
+        Dead workers must be replaced
+        """
+        runner, thread = self._start()
+        try:
+            killed = runner.workers[0]
+            os.kill(killed, signal.SIGKILL)
+
+            # Wait for the replacement
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                workers = runner.workers
+                if killed not in workers and len(workers) == 2:
+                    break
+                time.sleep(0.1)
+            else:
+                self.fail("Worker hasn't been replaced")
+
+            self._check_serving(runner)
+        finally:
+            self._stop(runner, thread)
+
+    def test_failing_initializer(self):
+        """
+        A worker whose initializer fails must exit and be replaced
+        """
+        marker = os.path.join(
+            tempfile.mkdtemp(), "failed-{0}".format(os.getpid())
+        )
+
+        def initializer():
+            # The first worker to get here fails
+            try:
+                fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            raise ValueError("Initialization error")
+
+        pool = ThreadPool(4, 2)
+        pool.start()
+        server = PooledJSONRPCServer(
+            ("localhost", 0), logRequests=False, thread_pool=pool
+        )
+        server.register_function(os.getpid, "pid")
+        runner = PreforkServer(server, 2, initializer=initializer)
+        runner.start()
+        thread = threading.Thread(target=runner.serve_forever, args=(0.1,))
+        thread.daemon = True
+        thread.start()
+
+        try:
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                try:
+                    with open(marker) as marker_file:
+                        failed = int(marker_file.read())
+                    break
+                except (IOError, ValueError):
+                    time.sleep(0.05)
+            else:
+                self.fail("Initializer hasn't been called")
+
+            # Wait for the replacement
+            while time.time() < deadline:
+                workers = runner.workers
+                if failed not in workers and len(workers) == 2:
+                    break
+                time.sleep(0.1)
+            else:
+                self.fail("Worker hasn't been replaced")
+
+            self._check_serving(runner)
+        finally:
+            self._stop(runner, thread)
+            pool.stop()
+            shutil.rmtree(os.path.dirname(marker))
+
+    def test_invalid_workers(self):
+        """
+        Checks the validation of the number of workers
+        """
+        server = SimpleJSONRPCServer(("localhost", 0), logRequests=False)
+        try:
+            for invalid in (0, -1, "abc"):
+                self.assertRaises(ValueError, PreforkServer, server, invalid)
+        finally:
+            server.server_close()
@@ -7,15 +7,32 @@ Tests the pooled server
 """
 
 # Standard library
+import json
 import random
 import socket
 import threading
 import time
 import unittest
 
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    # Python 2
+    ProcessPoolExecutor = ThreadPoolExecutor = None  # type: ignore
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
 # JSON-RPC library
 from jsonrpclib import ServerProxy
-from jsonrpclib.SimpleJSONRPCServer import PooledJSONRPCServer
+from jsonrpclib.accesslog import AccessLog
+from jsonrpclib.SimpleJSONRPCServer import (
+    PooledJSONRPCServer,
+    SimpleJSONRPCRequestHandler,
+)
 from jsonrpclib.threadpool import ThreadPool
 
 # ------------------------------------------------------------------------------
@@ -113,3 +130,915 @@ class PooledServerTests(unittest.TestCase):
             self.test_default_pool(pool, 6)
         finally:
             pool.stop()
+
+    @unittest.skipIf(ThreadPoolExecutor is None, "No concurrent.futures")
+    def test_executor(self):
+        """
+        Tests the use of a standard executor, which is left running
+        """
+        executor = ThreadPoolExecutor(5)
+        try:
+            self.test_default_pool(executor)
+            self.assertEqual(executor.submit(add, 1, 2).result(1), 3)
+        finally:
+            executor.shutdown()
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "No concurrent.futures")
+    def test_process_pool(self):
+        """
+        Requests can't be handled by a process pool
+        """
+        executor = ProcessPoolExecutor(1)
+        try:
+            self.assertRaises(
+                ValueError,
+                PooledJSONRPCServer,
+                ("localhost", 0),
+                thread_pool=executor,
+            )
+        finally:
+            executor.shutdown()
+
+
+# ------------------------------------------------------------------------------
+
+
+class CountingRequestHandler(SimpleJSONRPCRequestHandler):
+    """
+    Request handler counting the connections it handles
+    """
+
+    connections = 0
+
+    def setup(self):
+        CountingRequestHandler.connections += 1
+        SimpleJSONRPCRequestHandler.setup(self)
+
+
+class KeepAliveTests(unittest.TestCase):
+    """
+    Tests the support of persistent HTTP connections
+    """
+
+    def setUp(self):
+        """
+        Starts a pooled server with keep-alive enabled
+        """
+        CountingRequestHandler.connections = 0
+        self.server = PooledJSONRPCServer(
+            ("localhost", 0),
+            requestHandler=CountingRequestHandler,
+            logRequests=False,
+        )
+        self.server.keep_alive = True
+        self.server.register_function(add)
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.port = self.server.socket.getsockname()[1]
+
+    def tearDown(self):
+        """
+        Stops the server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _calls(self, nb_calls):
+        """
+        Calls the add() method the given number of times, with the same proxy
+        """
+        client = ServerProxy("http://localhost:{0}".format(self.port))
+        try:
+            for idx in range(nb_calls):
+                self.assertEqual(client.add(idx, 1), idx + 1)
+        finally:
+            client("close")()
+
+    def test_reuse(self):
+        """
+        The client must reuse its connection
+        """
+        self._calls(5)
+        self.assertEqual(CountingRequestHandler.connections, 1)
+
+    def test_disabled(self):
+        """
+        Connections are closed after each request if keep-alive is disabled
+        """
+        self.server.keep_alive = False
+        self._calls(5)
+        self.assertEqual(CountingRequestHandler.connections, 5)
+
+    def test_continue(self):
+        """
+        The Connection header is only sent in the final response
+        """
+        self.server.keep_alive = False
+        body = json.dumps(
+            {"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}
+        ).encode()
+
+        sock = socket.create_connection(("localhost", self.port), 5)
+        try:
+            # Send the body without waiting for the interim response, which
+            # is buffered until the final one
+            sock.sendall(
+                b"POST / HTTP/1.1\r\nHost: localhost\r\n"
+                + b"Expect: 100-continue\r\n"
+                + "Content-Length: {0}\r\n\r\n".format(len(body)).encode()
+                + body
+            )
+            stream = sock.makefile("rb")
+            status, headers, _ = read_response(stream)
+            self.assertEqual(status, 100)
+            self.assertNotIn("connection", headers)
+
+            status, headers, _ = read_response(stream)
+            self.assertEqual(status, 200)
+            self.assertEqual(headers["connection"], "close")
+        finally:
+            sock.close()
+
+    def test_max_requests(self):
+        """
+        Connections are closed after the maximum number of requests
+        """
+        self.server.max_keepalive_requests = 2
+        self._calls(5)
+        self.assertEqual(CountingRequestHandler.connections, 3)
+
+    def test_idle_timeout(self):
+        """
+        Idle connections are closed by the server
+        """
+        self.server.keepalive_timeout = 0.2
+        client = ServerProxy("http://localhost:{0}".format(self.port))
+        try:
+            self.assertEqual(client.add(1, 2), 3)
+            time.sleep(0.5)
+
+            # The client must reconnect transparently
+            self.assertEqual(client.add(3, 4), 7)
+        finally:
+            client("close")()
+
+        self.assertEqual(CountingRequestHandler.connections, 2)
+
+    def test_pipelining(self):
+        """
+        Pipelined requests must be handled in order
+        """
+        requests = []
+        for idx in range(3):
+            request = {"jsonrpc": "2.0", "method": "add", "id": idx}
+            request["params"] = [idx, 1]
+            body = json.dumps(request).encode("utf-8")
+            requests.append(
+                b"POST / HTTP/1.1\r\nHost: localhost\r\n"
+                + b"Content-Type: application/json-rpc\r\n"
+                + "Content-Length: {0}\r\n\r\n".format(len(body)).encode()
+                + body
+            )
+
+        sock = socket.create_connection(("localhost", self.port))
+        try:
+            # Send all requests at once
+            sock.sendall(b"".join(requests))
+
+            stream = sock.makefile("rb")
+            for idx in range(3):
+                status, headers, body = read_response(stream)
+                self.assertEqual(status, 200)
+                self.assertNotEqual(headers.get("connection"), "close")
+                result = json.loads(body.decode("utf-8"))
+                self.assertEqual(result["id"], idx)
+                self.assertEqual(result["result"], idx + 1)
+        finally:
+            sock.close()
+
+        self.assertEqual(CountingRequestHandler.connections, 1)
+
+
+def read_response(stream):
+    """
+    Reads an HTTP response from the given stream
+
+    :param stream: A file-like object
+    :return: The status code, the headers (lower-case) and the body
+    """
+    status = int(stream.readline().split()[1])
+    headers = {}
+    while True:
+        line = stream.readline().decode("iso-8859-1").strip()
+        if not line:
+            break
+        key, value = line.split(":", 1)
+        headers[key.strip().lower()] = value.strip()
+
+    body = stream.read(int(headers.get("content-length", 0)))
+    return status, headers, body
+
+
+def send_raw_request(address, headers, body, method="POST", path="/"):
+    """
+    Sends a raw request on a new connection
+
+    :param address: Address of the server
+    :param headers: Additional request headers
+    :param body: Raw request body
+    :param method: HTTP method
+    :param path: Request path
+    :return: The status code, the headers and the body of the response
+    """
+    lines = ["{0} {1} HTTP/1.1".format(method, path), "Host: localhost"]
+    lines.extend(headers)
+    raw_request = ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+    sock = socket.create_connection(address)
+    try:
+        sock.sendall(raw_request)
+        return read_response(sock.makefile("rb"))
+    finally:
+        sock.close()
+
+
+# ------------------------------------------------------------------------------
+
+
+class RequestBodyTests(unittest.TestCase):
+    """
+    Tests the reading of request bodies
+    """
+
+    def setUp(self):
+        """
+        Starts a server
+        """
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+        self.server.register_function(lambda value: value, "echo")
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        """
+        Stops the server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _send(self, headers, body):
+        """
+        Sends a raw POST request
+
+        :param headers: Additional request headers
+        :param body: Raw request body
+        :return: The status code, the headers and the body of the response
+        """
+        return send_raw_request(self.server.server_address, headers, body)
+
+    @staticmethod
+    def _echo_request(value):
+        """
+        Prepares the body of an echo() request
+        """
+        request = {"jsonrpc": "2.0", "method": "echo", "id": 1}
+        request["params"] = [value]
+        return json.dumps(request, ensure_ascii=False).encode("utf-8")
+
+    def test_content_length(self):
+        """
+        Body with a content length, including multi-bytes characters
+        """
+        value = u"été ☃" * 1000
+        body = self._echo_request(value)
+        status, _, response = self._send(
+            ["Content-Length: {0}".format(len(body))], body
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(response.decode("utf-8"))["result"], value)
+
+    def test_chunked(self):
+        """
+        Body sent with the chunked transfer encoding, with chunks splitting
+        multi-bytes characters
+        """
+        value = u"☃" * 100
+        body = self._echo_request(value)
+
+        chunked = b""
+        for idx in range(0, len(body), 7):
+            chunk = body[idx : idx + 7]
+            chunked += "{0:x};ext=1\r\n".format(len(chunk)).encode()
+            chunked += chunk + b"\r\n"
+        chunked += b"0\r\nX-Trailer: value\r\n\r\n"
+
+        status, _, response = self._send(
+            ["Transfer-Encoding: chunked"], chunked
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(response.decode("utf-8"))["result"], value)
+
+    def test_invalid_length(self):
+        """
+        Checks the errors on missing or invalid body length
+        """
+        body = self._echo_request("test")
+        self.assertEqual(self._send([], body)[0], 411)
+        self.assertEqual(self._send(["Content-Length: abc"], body)[0], 400)
+        self.assertEqual(self._send(["Content-Length: -1"], body)[0], 400)
+        self.assertEqual(
+            self._send(["Transfer-Encoding: chunked"], b"xyz\r\n")[0], 400
+        )
+        self.assertEqual(self._send(["Transfer-Encoding: gzip"], body)[0], 501)
+
+        # Chunk data not followed by a CRLF
+        chunked = "{0:x}\r\n".format(len(body)).encode() + body + b"xx\r\n"
+        self.assertEqual(
+            self._send(["Transfer-Encoding: chunked"], chunked)[0], 400
+        )
+
+    def test_large_chunk(self):
+        """
+        Chunks larger than the read piece size are fully read
+        """
+        value = u"☃" * 50000
+        body = self._echo_request(value)
+        chunked = "{0:x}\r\n".format(len(body)).encode()
+        chunked += body + b"\r\n0\r\n\r\n"
+
+        status, _, response = self._send(
+            ["Transfer-Encoding: chunked"], chunked
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(response.decode("utf-8"))["result"], value)
+
+    def test_parse_error(self):
+        """
+        The parse error message must show the request content
+        """
+        status, _, response = self._send(["Content-Length: 4"], b"{bad")
+        self.assertEqual(status, 200)
+        message = json.loads(response.decode("utf-8"))["error"]["message"]
+        self.assertIn("Request {bad invalid", message)
+
+    def test_max_body_size(self):
+        """
+        Bodies larger than the limit must be rejected
+        """
+        self.server.max_body_size = 100
+        body = self._echo_request("a" * 200)
+
+        status, headers, _ = self._send(
+            ["Content-Length: {0}".format(len(body))], body
+        )
+        self.assertEqual(status, 413)
+        self.assertEqual(headers["connection"], "close")
+
+        chunked = b""
+        for idx in range(0, len(body), 50):
+            chunk = body[idx : idx + 50]
+            chunked += "{0:x}\r\n".format(len(chunk)).encode()
+            chunked += chunk + b"\r\n"
+        chunked += b"0\r\n\r\n"
+        status, _, _ = self._send(["Transfer-Encoding: chunked"], chunked)
+        self.assertEqual(status, 413)
+
+        # Smaller bodies are still accepted
+        body = self._echo_request("a")
+        status, _, _ = self._send(
+            ["Content-Length: {0}".format(len(body))], body
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            self.server.get_admission_stats()["rejected_body_size"], 2
+        )
+
+
+# ------------------------------------------------------------------------------
+
+
+class AdmissionControlTests(unittest.TestCase):
+    """
+    Tests the limits on concurrent and queued requests
+    """
+
+    def setUp(self):
+        """
+        Prepares the blocking method
+        """
+        self.event = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.server = None
+        self.threads = []
+
+    def tearDown(self):
+        """
+        Stops the server and the clients
+        """
+        self.event.set()
+        for thread in self.threads:
+            thread.join(5)
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _start(self, thread_pool=None):
+        """
+        Starts a pooled server with a blocking method
+        """
+        self.server = PooledJSONRPCServer(
+            ("localhost", 0), logRequests=False, thread_pool=thread_pool
+        )
+
+        def wait():
+            self.started.release()
+            self.event.wait(5)
+            return True
+
+        self.server.register_function(wait)
+        self.server.register_function(add)
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _call_in_thread(self, method, *args):
+        """
+        Calls the given method from a new client thread
+        """
+        url = "http://localhost:{0}".format(self.server.server_address[1])
+        thread = threading.Thread(
+            target=getattr(ServerProxy(url), method), args=args
+        )
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _send_add(self):
+        """
+        Sends an add() request on a new connection
+        """
+        body = json.dumps(
+            {"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}
+        ).encode()
+        return send_raw_request(
+            self.server.server_address,
+            ["Content-Length: {0}".format(len(body))],
+            body,
+        )
+
+    def test_max_in_flight(self):
+        """
+        Requests over the limit of concurrent requests are rejected
+        """
+        self._start()
+        self.server.max_in_flight = 2
+        self.server.retry_after = 3
+
+        for _ in range(2):
+            self._call_in_thread("wait")
+            self.assertTrue(self.started.acquire(timeout=5))
+
+        status, headers, _ = self._send_add()
+        self.assertEqual(status, 503)
+        self.assertEqual(headers["retry-after"], "3")
+
+        # Rejected requests are answered without reading their body
+        sock = socket.create_connection(self.server.server_address, 5)
+        try:
+            sock.sendall(
+                b"POST / HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Length: 1000\r\n\r\n"
+            )
+            self.assertEqual(read_response(sock.makefile("rb"))[0], 503)
+        finally:
+            sock.close()
+
+        stats = self.server.get_admission_stats()
+        self.assertEqual(stats["in_flight"], 2)
+        self.assertEqual(stats["rejected_in_flight"], 2)
+
+        # Requests are accepted again once the others are done
+        self.event.set()
+        for thread in self.threads:
+            thread.join(5)
+        self.assertEqual(self._send_add()[0], 200)
+        self.assertEqual(self.server.get_admission_stats()["in_flight"], 0)
+
+    def test_max_queue_size(self):
+        """
+        Requests over the limit of queued requests are rejected before being
+        read
+        """
+        pool = ThreadPool(1, 1)
+        pool.start()
+        self._start(pool)
+        self.server.max_queue_size = 1
+
+        # Occupy the only thread, then the only queue slot
+        self._call_in_thread("wait")
+        self.assertTrue(self.started.acquire(timeout=5))
+        self._call_in_thread("add", 1, 2)
+
+        deadline = time.time() + 5
+        while self.server.get_admission_stats()["queued"] < 1:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+        status, headers, _ = self._send_add()
+        self.assertEqual(status, 503)
+        self.assertEqual(headers["retry-after"], "1")
+        self.assertEqual(
+            self.server.get_admission_stats()["rejected_queue"], 1
+        )
+
+        self.event.set()
+        for thread in self.threads:
+            thread.join(5)
+        self.assertEqual(self._send_add()[0], 200)
+        self.assertEqual(self.server.get_admission_stats()["queued"], 0)
+
+    def test_codel(self):
+        """
+        Requests dropped by the CoDel pool are rejected
+        """
+        pool = ThreadPool(1, 1, codel_target=0.01, codel_interval=0.05)
+        pool.start()
+        self._start(pool)
+
+        def slow_add(a, b):
+            time.sleep(0.05)
+            return a + b
+
+        self.server.register_function(slow_add, "add")
+
+        results = []
+
+        def call():
+            results.append(self._send_add()[0])
+
+        threads = [threading.Thread(target=call) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(results), 20)
+        self.assertIn(503, results)
+        self.assertIn(200, results)
+
+        stats = self.server.get_admission_stats()
+        self.assertEqual(stats["rejected_delay"], results.count(503))
+        self.assertEqual(stats["queued"], 0)
+        pool.stop()
+
+    def test_priorities(self):
+        """
+        Requests are queued by priority, according to their method or header
+        """
+        pool = ThreadPool(1, 1)
+        pool.start()
+        self._start(pool)
+        self.server.priority_header = "X-Priority"
+
+        order = []
+
+        def record(name):
+            order.append(name)
+            return name
+
+        self.server.register_function(record)
+        self.server.register_function(record, "urgent")
+        self.server.set_method_priority("urgent", -1)
+
+        # Occupy the only thread
+        self._call_in_thread("wait")
+        self.assertTrue(self.started.acquire(timeout=5))
+
+        def send(method, name, headers=()):
+            body = json.dumps(
+                {"jsonrpc": "2.0", "method": method, "params": [name], "id": 1}
+            ).encode()
+            send_raw_request(
+                self.server.server_address,
+                ["Content-Length: {0}".format(len(body))] + list(headers),
+                body,
+            )
+
+        senders = [
+            threading.Thread(target=send, args=("record", "bulk")),
+            threading.Thread(target=send, args=("urgent", "urgent")),
+            threading.Thread(
+                target=send, args=("record", "header", ["X-Priority: -2"])
+            ),
+        ]
+        for sender in senders:
+            sender.start()
+            time.sleep(0.1)
+
+        self.event.set()
+        for sender in senders:
+            sender.join(5)
+
+        self.assertEqual(order, ["header", "urgent", "bulk"])
+        pool.stop()
+
+    def test_fair_queuing(self):
+        """
+        Clients are served in turn, whatever the number of their requests
+        """
+        pool = ThreadPool(1, 1)
+        pool.start()
+        self._start(pool)
+        self.server.fair_queuing = True
+        self.server.client_id_header = "X-Client"
+
+        order = []
+
+        def record(name):
+            order.append(name)
+            return name
+
+        self.server.register_function(record)
+
+        # Occupy the only thread
+        self._call_in_thread("wait")
+        self.assertTrue(self.started.acquire(timeout=5))
+
+        def send(client, name):
+            body = json.dumps(
+                {"jsonrpc": "2.0", "method": "record", "params": [name]}
+            ).encode()
+            send_raw_request(
+                self.server.server_address,
+                [
+                    "Content-Length: {0}".format(len(body)),
+                    "X-Client: {0}".format(client),
+                ],
+                body,
+            )
+
+        calls = [("noisy", "noisy-{0}".format(idx)) for idx in range(3)]
+        calls.append(("quiet", "quiet-0"))
+        senders = []
+        for call in calls:
+            sender = threading.Thread(target=send, args=call)
+            sender.start()
+            senders.append(sender)
+            time.sleep(0.1)
+
+        self.event.set()
+        for sender in senders:
+            sender.join(5)
+
+        self.assertEqual(order, ["noisy-0", "quiet-0", "noisy-1", "noisy-2"])
+
+        # Statistics are updated once the response has been sent
+        deadline = time.time() + 5
+        stats = self.server.get_client_stats()
+        while stats["noisy"]["served"] < 3 and time.time() < deadline:
+            time.sleep(0.01)
+            stats = self.server.get_client_stats()
+        self.assertEqual(stats["noisy"]["served"], 3)
+        self.assertEqual(stats["noisy"]["queued"], 0)
+        self.assertEqual(stats["quiet"]["served"], 1)
+        self.assertGreater(stats["quiet"]["service_time"], 0)
+        pool.stop()
+
+    def test_client_stats_limit(self):
+        """
+        Only the statistics of the most recently served clients are kept
+        """
+        pool = ThreadPool(1, 1)
+        pool.start()
+        self._start(pool)
+        self.server.fair_queuing = True
+        self.server.client_id_header = "X-Client"
+        self.server.max_client_stats = 2
+
+        body = json.dumps(
+            {"jsonrpc": "2.0", "method": "add", "params": [1, 2], "id": 1}
+        ).encode()
+        for client in ("a", "b", "c", "b"):
+            send_raw_request(
+                self.server.server_address,
+                [
+                    "Content-Length: {0}".format(len(body)),
+                    "X-Client: {0}".format(client),
+                ],
+                body,
+            )
+
+        # Statistics are updated once the response has been sent
+        deadline = time.time() + 5
+        stats = self.server.get_client_stats()
+        while stats.get("b", {}).get("served") != 2 and time.time() < deadline:
+            time.sleep(0.01)
+            stats = self.server.get_client_stats()
+        self.assertEqual(sorted(stats), ["b", "c"])
+        self.assertEqual(stats["b"]["served"], 2)
+        pool.stop()
+
+
+class MetricsTests(unittest.TestCase):
+    """
+    Tests the metrics of the server
+    """
+
+    def setUp(self):
+        """
+        Starts a server
+        """
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+        self.server.register_function(add)
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.proxy = ServerProxy(
+            "http://localhost:{0}".format(self.server.server_address[1])
+        )
+
+    def tearDown(self):
+        """
+        Stops the server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _get(self, path):
+        """
+        Sends a GET request
+
+        :return: The status code, the headers and the body of the response
+        """
+        return send_raw_request(
+            self.server.server_address, [], b"", method="GET", path=path
+        )
+
+    def test_disabled(self):
+        """
+        No metrics by default
+        """
+        self.assertEqual(self._get("/metrics")[0], 501)
+        self.assertIsNone(self.server.get_metrics())
+
+    def test_metrics(self):
+        """
+        Calls, errors and pools are described
+        """
+        self.server.enable_metrics()
+        self.assertEqual(self.proxy.add(1, 2), 3)
+        self.assertEqual(self.proxy.add(3, 4), 7)
+        self.assertRaises(Exception, self.proxy.add, 1)
+        self.assertRaises(Exception, self.proxy.unknown)
+
+        stats = self.proxy.system.stats()
+        add_stats = stats["methods"]["add"]
+        self.assertEqual(add_stats["calls"], 3)
+        self.assertEqual(add_stats["errors"], {"-32602": 1})
+        self.assertEqual(
+            sorted(add_stats["latency"]),
+            ["dispatch", "serialization", "total"],
+        )
+        self.assertEqual(add_stats["latency"]["total"]["count"], 3)
+        self.assertEqual(stats["methods"]["(unknown)"]["calls"], 1)
+
+        # The stats call itself is being handled
+        self.assertEqual(stats["in_flight"], 1)
+        self.assertGreater(stats["bytes_in"], 0)
+        self.assertGreater(stats["bytes_out"], 0)
+        self.assertEqual(stats["pools"]["request"]["started"], 5)
+
+        self.assertEqual(self._get("/other")[0], 404)
+        status, headers, body = self._get("/metrics")
+        self.assertEqual(status, 200)
+        self.assertTrue(headers["content-type"].startswith("text/plain"))
+
+        lines = body.decode("utf-8").splitlines()
+        self.assertIn('jsonrpc_calls_total{method="add"} 3', lines)
+        self.assertIn(
+            'jsonrpc_errors_total{code="-32602",method="add"} 1', lines
+        )
+        self.assertIn(
+            'jsonrpc_latency_seconds_bucket{le="+Inf",method="add",'
+            'phase="dispatch"} 3',
+            lines,
+        )
+        self.assertIn("jsonrpc_in_flight_requests 0", lines)
+        self.assertIn('jsonrpc_pool_queue_depth{pool="request"} 0', lines)
+
+
+class AccessLogTests(unittest.TestCase):
+    """
+    Tests the buffered access log
+    """
+
+    def setUp(self):
+        """
+        Starts a server with an access log
+        """
+        self.stream = StringIO()
+        self.server = PooledJSONRPCServer(("localhost", 0), logRequests=False)
+        self.server.register_function(add)
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.proxy = ServerProxy(
+            "http://localhost:{0}".format(self.server.server_address[1])
+        )
+
+    def tearDown(self):
+        """
+        Stops the server
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _records(self, count):
+        """
+        Waits for records to be written and parses them
+
+        :param count: Number of records to wait for
+        """
+        # Records are queued once the response has been sent
+        deadline = time.time() + 5
+        stats = self.server.access_log.get_stats
+        while stats()["delivered"] < count and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.server.access_log.close()
+        return [
+            json.loads(line) for line in self.stream.getvalue().splitlines()
+        ]
+
+    def test_records(self):
+        """
+        Requests are described in the log
+        """
+        self.server.access_log = AccessLog(self.stream, max_delay=0.01)
+        self.assertEqual(self.proxy.add(1, 2), 3)
+        status, _, _ = send_raw_request(
+            self.server.server_address, [], b"", path="/unknown"
+        )
+        self.assertEqual(status, 404)
+
+        # Records are logged after the responses: their order can change
+        records = sorted(self._records(2), key=lambda record: record["status"])
+        self.assertEqual([record["status"] for record in records], [200, 404])
+        record = records[0]
+        self.assertEqual(record["method"], "add")
+        self.assertEqual(record["request"], "POST")
+        self.assertEqual(record["client"], "127.0.0.1")
+        self.assertGreater(record["bytes_in"], 0)
+        self.assertGreater(record["bytes_out"], 0)
+        self.assertGreaterEqual(record["latency"], 0)
+        self.assertEqual(self.server.access_log.get_stats()["delivered"], 2)
+
+    def test_sampling(self):
+        """
+        Only a sample of the successful requests is logged
+        """
+        self.server.access_log = AccessLog(
+            self.stream, sample_rate=0, max_delay=0.01
+        )
+        self.assertEqual(self.proxy.add(1, 2), 3)
+        self.assertRaises(Exception, self.proxy.add, 1)
+        send_raw_request(self.server.server_address, [], b"", path="/other")
+        self.assertEqual(
+            [record["status"] for record in self._records(1)], [404]
+        )
+
+    def test_overflow(self):
+        """
+        Records are dropped when the buffer is full
+        """
+        event = threading.Event()
+        log = AccessLog(self.stream, queue_size=1, max_batch=1, max_delay=0)
+        log.formatter = lambda record: event.wait(5) and json.dumps(record)
+        self.server.access_log = log
+
+        for _ in range(4):
+            self.assertEqual(self.proxy.add(1, 2), 3)
+
+        # One record being written, one queued, the others dropped
+        deadline = time.time() + 5
+        while log.get_stats()["dropped"] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(log.get_stats()["dropped"], 2)
+
+        event.set()
+        self.assertEqual(len(self._records(2)), 2)
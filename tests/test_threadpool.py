@@ -9,9 +9,30 @@ Cached thread pool tests
 # ------------------------------------------------------------------------------
 
 # Standard library
+import sys
 import threading
 import time
 
+try:
+    # Python 3
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue  # type: ignore
+
+try:
+    # Python 3.4+
+    import asyncio
+except ImportError:
+    # Python 2
+    asyncio = None  # type: ignore
+
+try:
+    from concurrent.futures import Future
+except ImportError:
+    # Python 2
+    Future = None  # type: ignore
+
 # Tests
 try:
     import unittest2 as unittest
@@ -20,6 +41,7 @@ except ImportError:
 
 
 # Tested module
+import jsonrpclib.metrics as metrics
 import jsonrpclib.threadpool as threadpool
 
 # ------------------------------------------------------------------------------
@@ -234,6 +256,98 @@ class FutureTest(unittest.TestCase):
         future.set_callback(raising, exception)
         self.assertTrue(flag.is_set(), "Callback not called")
 
+    @unittest.skipIf(
+        not hasattr(sys, "setswitchinterval"), "No sys.setswitchinterval"
+    )
+    def testCallbackRace(self):
+        """
+        The callback is called once when set while the execution ends
+        """
+        # Switch threads as often as possible
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(500):
+                future = threadpool.FutureResult()
+                calls = []
+                thread = threading.Thread(
+                    target=future.execute, args=(max, (1, 2), None)
+                )
+                thread.start()
+                future.set_callback(lambda *args: calls.append(args))
+                thread.join()
+                self.assertEqual(calls, [(2, None, None)])
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+    def testDoneCallbacks(self):
+        """
+        Tests the concurrent.futures-like callbacks
+        """
+        future = threadpool.FutureResult()
+        called = []
+        future.add_done_callback(called.append)
+        future.add_done_callback(lambda _: 1 / 0)
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [])
+
+        try:
+            future.execute(self._raise_call, None, None)
+        except ValueError:
+            pass
+
+        # All callbacks are called once, despite the failing one
+        self.assertEqual(called, [future, future])
+        self.assertIsInstance(future.exception(0), ValueError)
+
+        # Called immediately once done
+        future.add_done_callback(called.append)
+        self.assertEqual(len(called), 3)
+
+    @unittest.skipIf(Future is None, "No concurrent.futures")
+    def testToFuture(self):
+        """
+        Tests the conversion to a standard future
+        """
+        future = threadpool.FutureResult()
+        std_future = future.to_future()
+        self.assertIsInstance(std_future, Future)
+        self.assertFalse(std_future.done())
+        self.assertFalse(std_future.cancel())
+
+        future.execute(self._simple_call, (1, 2, 3), None)
+        self.assertEqual(std_future.result(0), (1, 2, 3))
+
+        # Exceptions are given too
+        future = threadpool.FutureResult()
+        future.drop(threadpool.TaskDropped("dropped"))
+        self.assertIsInstance(
+            future.to_future().exception(0), threadpool.TaskDropped
+        )
+
+    @unittest.skipIf(asyncio is None, "No asyncio")
+    def testAsyncio(self):
+        """
+        Results of the pool can be awaited with asyncio
+        """
+        pool = threadpool.ThreadPool(2)
+        pool.start()
+        loop = asyncio.new_event_loop()
+        try:
+            futures = [
+                asyncio.wrap_future(
+                    pool.enqueue(_slow_call, 0.1, idx).to_future(), loop=loop
+                )
+                for idx in range(4)
+            ]
+            self.assertEqual(
+                loop.run_until_complete(asyncio.gather(*futures)),
+                [0, 1, 2, 3],
+            )
+        finally:
+            loop.close()
+            pool.stop()
+
 
 # ------------------------------------------------------------------------------
 
@@ -475,6 +589,695 @@ class ThreadPoolTest(unittest.TestCase):
 
         self.pool.join()
 
+    def testCoDel(self):
+        """
+        Tests the CoDel delay controller
+        """
+        for target, interval in ((0, 1), (-1, 1), (1, 0), ("abc", 1)):
+            self.assertRaises(ValueError, threadpool.CoDel, target, interval)
+
+        codel = threadpool.CoDel(0.01, 0.1)
+
+        # Short delays: never overloaded
+        for idx in range(10):
+            self.assertFalse(codel.should_drop(0.005, idx * 0.05))
+        self.assertFalse(codel.overloaded)
+
+        # Long delays during a whole interval (from 0.5 to 0.6)
+        self.assertFalse(codel.should_drop(0.05, 0.5))
+        self.assertFalse(codel.should_drop(0.05, 0.55))
+
+        # Overloaded: long delays are dropped, but not the short ones
+        self.assertTrue(codel.should_drop(0.05, 0.65))
+        self.assertTrue(codel.overloaded)
+        self.assertFalse(codel.should_drop(0.015, 0.66))
+        self.assertEqual(codel.nb_dropped, 1)
+
+        # Back to normal once the delay goes under the target
+        codel.should_drop(0.005, 0.7)
+        self.assertFalse(codel.should_drop(0.05, 0.8))
+        self.assertFalse(codel.overloaded)
+
+    def testCoDelPool(self):
+        """
+        The pool must drop the oldest tasks when its queue is overloaded
+        """
+        self.pool = threadpool.ThreadPool(
+            1, 1, codel_target=0.01, codel_interval=0.05
+        )
+        self.pool.start()
+
+        futures = [
+            self.pool.enqueue(_slow_call, 0.02, idx) for idx in range(30)
+        ]
+        self.pool.join()
+
+        executed = []
+        nb_dropped = 0
+        for idx, future in enumerate(futures):
+            self.assertTrue(future.done())
+            try:
+                executed.append(future.result())
+            except threadpool.TaskDropped:
+                nb_dropped += 1
+
+        self.assertGreater(nb_dropped, 0)
+        self.assertGreater(len(executed), 0)
+        self.assertEqual(self.pool.nb_dropped, nb_dropped)
+
+        # The pool still works
+        self.assertEqual(self.pool.enqueue(_slow_call, 0, 42).result(1), 42)
+
+    def testPriority(self):
+        """
+        Tasks with the lowest priority value must be executed first, in FIFO
+        order for a same priority
+        """
+        self.pool = threadpool.ThreadPool(1, 1, starvation_delay=None)
+        event = threading.Event()
+        result_list = []
+
+        # Block the only thread
+        self.pool.enqueue(event.wait)
+        self.pool.start()
+        time.sleep(0.1)
+
+        for idx in range(3):
+            self.pool.enqueue(
+                _trace_call, result_list, "normal-{0}".format(idx)
+            )
+        self.pool.enqueue_priority(5, _trace_call, result_list, "low")
+        self.pool.enqueue_priority(-1, _trace_call, result_list, "high-0")
+        self.pool.enqueue_priority(-1, _trace_call, result_list, "high-1")
+
+        event.set()
+        self.pool.join()
+        self.assertEqual(
+            result_list,
+            ["high-0", "high-1", "normal-0", "normal-1", "normal-2", "low"],
+        )
+
+    def testStarvation(self):
+        """
+        Low priority tasks waiting for too long must be executed
+        """
+        self.pool = threadpool.ThreadPool(1, 1, starvation_delay=0.1)
+        event = threading.Event()
+        result_list = []
+
+        self.pool.enqueue(event.wait)
+        self.pool.start()
+        time.sleep(0.1)
+
+        self.pool.enqueue_priority(1, _trace_call, result_list, "low")
+        time.sleep(0.2)
+        for idx in range(3):
+            self.pool.enqueue_priority(
+                0, _trace_call, result_list, "high-{0}".format(idx)
+            )
+
+        event.set()
+        self.pool.join()
+        self.assertEqual(result_list, ["low", "high-0", "high-1", "high-2"])
+
+    def _blocked_pool(self, event, **kwargs):
+        """
+        Starts a pool whose only thread waits for the given event, with a
+        queue of 2 tasks
+        """
+        self.pool = threadpool.ThreadPool(1, 1, queue_size=2, **kwargs)
+        self.pool.enqueue(event.wait)
+        self.pool.start()
+        time.sleep(0.1)
+        return self.pool
+
+    def testRejectionPolicies(self):
+        """
+        Tasks queued while the queue is full must follow the rejection policy
+        """
+        self.assertRaises(
+            ValueError, threadpool.ThreadPool, 1, rejection="unknown"
+        )
+
+        for policy in (
+            threadpool.REJECT_BLOCK,
+            threadpool.REJECT_ABORT,
+            threadpool.REJECT_CALLER_RUNS,
+            threadpool.REJECT_DROP_OLDEST,
+        ):
+            event = threading.Event()
+            result_list = []
+            pool = self._blocked_pool(event, timeout=0.2, rejection=policy)
+            first = pool.enqueue(_trace_call, result_list, "first")
+            pool.enqueue(_trace_call, result_list, "second")
+
+            start = time.time()
+            if policy in (threadpool.REJECT_BLOCK, threadpool.REJECT_ABORT):
+                self.assertRaises(
+                    queue.Full, pool.enqueue, _trace_call, result_list, "new"
+                )
+                blocked = time.time() - start >= 0.2
+                self.assertEqual(blocked, policy == threadpool.REJECT_BLOCK)
+                expected = ["first", "second"]
+            else:
+                future = pool.enqueue(_trace_call, result_list, "new")
+                if policy == threadpool.REJECT_CALLER_RUNS:
+                    # Executed before returning
+                    self.assertTrue(future.done())
+                    self.assertEqual(result_list, ["new"])
+                    expected = ["new", "first", "second"]
+                else:
+                    self.assertRaises(threadpool.TaskDropped, first.result, 0)
+                    expected = ["second", "new"]
+
+            event.set()
+            pool.join()
+            self.assertEqual(result_list, expected, policy)
+            self.assertEqual(pool.get_stats()["rejected"], 1, policy)
+            pool.stop()
+
+    def testEnqueueMany(self):
+        """
+        Tasks queued at once must give their futures in order
+        """
+        self.pool = threadpool.ThreadPool(4, 1)
+        self.pool.start()
+        futures = self.pool.enqueue_many(
+            _slow_call, [(0, idx) for idx in range(100)]
+        )
+        self.assertEqual(
+            [future.result(1) for future in futures], list(range(100))
+        )
+        self.assertEqual(self.pool.enqueue_many(_slow_call, []), [])
+        self.assertRaises(ValueError, self.pool.enqueue_many, None, [()])
+        self.pool.stop()
+
+        # Tasks which don't fit in the queue follow the rejection policy
+        event = threading.Event()
+        result_list = []
+        pool = self._blocked_pool(event, rejection=threadpool.REJECT_ABORT)
+        futures = pool.enqueue_many(
+            _trace_call, [(result_list, idx) for idx in range(4)], priority=1
+        )
+        for future in futures[2:]:
+            self.assertRaises(threadpool.TaskDropped, future.result, 0)
+
+        event.set()
+        pool.join()
+        self.assertEqual(result_list, [0, 1])
+        self.assertEqual(pool.get_stats()["rejected"], 2)
+        pool.stop()
+
+        # Queued tasks are handled while the calling thread runs the others
+        event = threading.Event()
+
+        def step(wait):
+            return event.wait(1) if wait else event.set()
+
+        self.pool = threadpool.ThreadPool(
+            1, 0, queue_size=1, rejection=threadpool.REJECT_CALLER_RUNS
+        )
+        self.pool.start()
+        futures = self.pool.enqueue_many(step, [(False,), (True,)])
+        self.assertTrue(futures[1].done())
+        self.assertTrue(futures[1].result(0))
+
+    def testMap(self):
+        """
+        Results of map() must be given in order
+        """
+        self.pool = threadpool.ThreadPool(4, 1)
+        self.pool.start()
+        self.assertEqual(
+            list(self.pool.map(pow, [2, 3, 4], [2, 2, 2])), [4, 9, 16]
+        )
+        self.assertEqual(
+            list(self.pool.map(_slow_call, [0.1, 0], [1, 2], timeout=1)),
+            [1, 2],
+        )
+
+        results = self.pool.map(_slow_call, [0.5], timeout=0.1)
+        self.assertRaises(OSError, list, results)
+        self.assertRaises(TypeError, self.pool.map, pow, [1], [2], other=1)
+
+    def testConcurrentProducers(self):
+        """
+        Tasks queued concurrently by many threads must all be executed
+        """
+        self.pool = threadpool.ThreadPool(4, 0, timeout=0.1)
+        self.pool.start()
+        result_list = []
+        nb_producers = 16
+        nb_tasks = 200
+
+        def producer(idx):
+            for task in range(nb_tasks):
+                # Switch to the priority queue while others are queuing
+                if idx == 0 and task == nb_tasks // 2:
+                    self.pool.enqueue_priority(1, result_list.append, -1)
+                self.pool.enqueue(result_list.append, task)
+
+        producers = [
+            threading.Thread(target=producer, args=(idx,))
+            for idx in range(nb_producers)
+        ]
+        for thread in producers:
+            thread.start()
+        for thread in producers:
+            thread.join()
+
+        self.assertTrue(self.pool.join(10))
+        self.assertEqual(len(result_list), nb_producers * nb_tasks + 1)
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["started"], len(result_list))
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertLessEqual(stats["threads"], 4)
+
+        # Idle threads stop, and are started again for new tasks
+        time.sleep(0.5)
+        self.assertEqual(self.pool.get_stats()["threads"], 0)
+        self.assertEqual(self.pool.enqueue(_slow_call, 0, 42).result(1), 42)
+
+    def testStats(self):
+        """
+        Tests the statistics and the timing histograms of the pool
+        """
+        self.pool = threadpool.ThreadPool(2, 2, timing=True)
+        self.pool.start()
+
+        def thrower():
+            raise ValueError("Some error")
+
+        for _ in range(4):
+            self.pool.enqueue(_slow_call, 0.05)
+        self.pool.enqueue(thrower)
+        self.assertTrue(self.pool.join(5))
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertEqual(stats["threads"], 2)
+        self.assertEqual(stats["active_threads"], 0)
+        self.assertEqual(stats["started"], 5)
+        self.assertEqual(stats["completed"], 5)
+        self.assertEqual(stats["failed"], 1)
+        self.assertGreaterEqual(stats["busy_time"], 0.2)
+        self.assertEqual(len(stats["busy_ratio"]), 2)
+        for ratio in stats["busy_ratio"].values():
+            self.assertTrue(0 <= ratio <= 1)
+
+        for key in ("wait_histogram", "run_histogram"):
+            self.assertEqual(stats[key]["count"], 5)
+            self.assertEqual(stats[key]["buckets"][-1], ("+Inf", 5))
+        self.assertGreaterEqual(stats["run_histogram"]["sum"], 0.2)
+
+        # Counters are kept when threads stop
+        self.pool.stop()
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["threads"], 0)
+        self.assertEqual(stats["completed"], 5)
+        self.assertEqual(stats["run_histogram"]["count"], 5)
+
+        # Exported as metrics
+        lines = metrics.MetricsRegistry().render({"test": self.pool})
+        lines = lines.splitlines()
+        self.assertIn('jsonrpc_pool_failed_tasks_total{pool="test"} 1', lines)
+        self.assertIn(
+            'jsonrpc_pool_task_run_seconds_bucket{le="+Inf",pool="test"} 5',
+            lines,
+        )
+
+        # No histogram by default
+        self.assertNotIn("run_histogram", threadpool.ThreadPool(1).get_stats())
+
+    def testAutoScaler(self):
+        """
+        Tests the decisions of the autoscaling policy
+        """
+        for target, interval, utilization in (
+            (0, 1, 0.5),
+            (1, -1, 0.5),
+            (1, 1, 0),
+            (1, 1, 1.5),
+            ("abc", 1, 0.5),
+        ):
+            self.assertRaises(
+                ValueError,
+                threadpool.AutoScaler,
+                target,
+                interval,
+                utilization,
+            )
+
+        scaler = threadpool.AutoScaler(0.1, 1, 0.5)
+
+        # Grows when tasks wait too long, once per target delay
+        self.assertFalse(scaler.should_grow(0.05, 0))
+        self.assertTrue(scaler.should_grow(0.2, 0))
+        self.assertFalse(scaler.should_grow(0.2, 0.05))
+        self.assertTrue(scaler.should_grow(0.2, 0.2))
+        self.assertEqual(scaler.nb_scale_ups, 2)
+
+        # No retirement before the end of the first window, nor during the
+        # interval following the last growth
+        self.assertFalse(scaler.should_shrink(0, 4, 0.5))
+        self.assertIsNone(scaler.utilization)
+        self.assertTrue(scaler.should_grow(0.2, 1.0))
+        self.assertFalse(scaler.should_shrink(0.5, 4, 1.5))
+        self.assertEqual(scaler.utilization, 0.125)
+
+        # Low load: retire
+        self.assertTrue(scaler.should_shrink(0.5, 4, 2.0))
+
+        # 2.5 threads busy on average: 3 threads would be too busy
+        self.assertFalse(scaler.should_shrink(3.0, 4, 2.5))
+        self.assertEqual(scaler.utilization, 0.625)
+
+        # 1.5 threads busy on average: 4 threads can handle it
+        self.assertTrue(scaler.should_shrink(4.5, 5, 3.5))
+        self.assertEqual(scaler.nb_scale_downs, 2)
+
+    def testAutoScalingPool(self):
+        """
+        The autoscaling pool must grow when tasks wait and shrink once idle
+        """
+        self.pool = threadpool.ThreadPool(
+            4,
+            1,
+            autoscale_target=0.05,
+            autoscale_interval=0.2,
+            autoscale_utilization=0.5,
+        )
+        self.pool.start()
+        self.assertEqual(self.pool.get_stats()["scale_ups"], 0)
+
+        futures = [
+            self.pool.enqueue(_slow_call, 0.3, idx) for idx in range(8)
+        ]
+        self.assertEqual(
+            [future.result(5) for future in futures], list(range(8))
+        )
+        stats = self.pool.get_stats()
+        self.assertGreater(stats["threads"], 1)
+        self.assertLessEqual(stats["threads"], 4)
+        self.assertGreater(stats["scale_ups"], 0)
+
+        # Idle threads are retired, down to the minimum
+        deadline = time.time() + 5
+        while self.pool.get_stats()["threads"] > 1 and time.time() < deadline:
+            time.sleep(0.1)
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["threads"], 1)
+        self.assertGreater(stats["scale_downs"], 0)
+        self.assertIsNotNone(stats["utilization"])
+
+
+# ------------------------------------------------------------------------------
+
+
+class StripedCountersTest(unittest.TestCase):
+    """
+    Tests the structures updated by many threads
+    """
+
+    def _run_threads(self, method, nb_threads=8):
+        """
+        Calls a method from concurrent threads
+        """
+        threads = [threading.Thread(target=method) for _ in range(nb_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def testStripes(self):
+        """
+        Threads get their own stripe, as long as there are enough of them
+        """
+        stripes = set()
+        lock = threading.Lock()
+
+        def get_stripe():
+            stripe = metrics.get_stripe()
+            self.assertEqual(stripe, metrics.get_stripe())
+            with lock:
+                stripes.add(stripe)
+
+        # Other threads might take stripes at the same time
+        self._run_threads(get_stripe, metrics.NB_STRIPES)
+        self.assertGreater(len(stripes), metrics.NB_STRIPES // 2)
+
+    def testCounter(self):
+        """
+        The value of the counter is the sum of the updates of all threads
+        """
+        counter = metrics.StripedCounter()
+        self.assertEqual(counter.value, 0)
+
+        def update():
+            for _ in range(1000):
+                counter.add()
+            counter.add(-500)
+
+        self._run_threads(update)
+        self.assertEqual(counter.value, 8 * 500)
+
+    def testMetricsRegistry(self):
+        """
+        The metrics recorded by all threads are merged in snapshots
+        """
+        registry = metrics.MetricsRegistry()
+
+        def record():
+            for _ in range(100):
+                registry.request_started()
+                registry.record_call("add", 0.001)
+                registry.record_call("add", 0.1, -32602)
+                registry.record_request("add", 0.001, 0.2)
+                registry.record_bytes(10, 20)
+                registry.request_done()
+
+        self._run_threads(record)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["in_flight"], 0)
+        self.assertEqual(snapshot["bytes_in"], 8000)
+        self.assertEqual(snapshot["bytes_out"], 16000)
+
+        add_stats = snapshot["methods"]["add"]
+        self.assertEqual(add_stats["calls"], 1600)
+        self.assertEqual(add_stats["errors"], {"-32602": 800})
+        self.assertEqual(add_stats["latency"]["dispatch"]["count"], 1600)
+        self.assertEqual(add_stats["latency"]["total"]["count"], 800)
+        self.assertEqual(
+            add_stats["latency"]["total"]["buckets"][-1], ("+Inf", 800)
+        )
+
+
+# ------------------------------------------------------------------------------
+
+
+class FairQueueTest(unittest.TestCase):
+    """
+    Tests the weighted fair queue
+    """
+
+    def testRoundRobin(self):
+        """
+        Clients are served in turn, according to their weight
+        """
+        fair_queue = threadpool.FairQueue()
+        self.assertRaises(queue.Empty, fair_queue.get)
+
+        for idx in range(4):
+            fair_queue.put("a", "a{0}".format(idx))
+        fair_queue.put("b", "b0")
+        fair_queue.put("b", "b1")
+        fair_queue.put("c", "c0", priority=1)
+        self.assertEqual(len(fair_queue), 7)
+        self.assertEqual(fair_queue.depths(), {"a": 4, "b": 2, "c": 1})
+
+        self.assertEqual(
+            [fair_queue.get() for _ in range(6)],
+            ["a0", "b0", "a1", "b1", "a2", "a3"],
+        )
+        self.assertRaises(queue.Empty, fair_queue.get)
+        self.assertEqual(fair_queue.get(1), "c0")
+        self.assertEqual(len(fair_queue), 0)
+
+    def testWeights(self):
+        """
+        Clients get a share of the service proportional to their weight
+        """
+        fair_queue = threadpool.FairQueue()
+        fair_queue.set_weight("a", 3)
+        fair_queue.set_weight("b", 0.5)
+        for invalid in (0, -1, "abc"):
+            self.assertRaises(ValueError, fair_queue.set_weight, "c", invalid)
+
+        for idx in range(8):
+            fair_queue.put("a", "a")
+            fair_queue.put("b", "b")
+            fair_queue.put("c", "c")
+
+        served = "".join(fair_queue.get() for _ in range(9))
+        self.assertEqual(served.count("a"), 6)
+        self.assertEqual(served.count("c"), 2)
+        self.assertEqual(served.count("b"), 1)
+
+        fair_queue.set_weight("a", None)
+        self.assertEqual(fair_queue.get_weight("a"), 1)
+
+    def testDrop(self):
+        """
+        Drops are taken from the most loaded client
+        """
+        fair_queue = threadpool.FairQueue()
+        fair_queue.put("a", "a0")
+        fair_queue.put("b", "b0")
+        fair_queue.put("b", "b1")
+
+        self.assertEqual(fair_queue.drop(), "b0")
+        self.assertEqual(fair_queue.depths(), {"a": 1, "b": 1})
+        self.assertRaises(queue.Empty, fair_queue.drop, 1)
+
+
+
+class MicroBatcherTest(unittest.TestCase):
+    """
+    Tests the micro-batching of items
+    """
+
+    def setUp(self):
+        """
+        Prepares a blocking consumer
+        """
+        self.batches = []
+        self.event = threading.Event()
+        self.event.set()
+        self.batcher = None
+
+    def tearDown(self):
+        """
+        Stops the batcher
+        """
+        self.event.set()
+        if self.batcher is not None:
+            self.batcher.stop()
+
+    def _consume(self, batch):
+        """
+        Stores the batch, once the event is set
+        """
+        self.event.wait(5)
+        self.batches.append(batch)
+
+    def testThresholds(self):
+        """
+        Batches are delivered when full or when their oldest item expired
+        """
+        self.batcher = threadpool.MicroBatcher(
+            self._consume, max_size=3, max_delay=0.2
+        )
+        for idx in range(4):
+            self.assertTrue(self.batcher.put(idx))
+
+        # The full batch is delivered immediately
+        time.sleep(0.1)
+        self.assertEqual(self.batches, [[0, 1, 2]])
+
+        # The partial batch after the delay
+        time.sleep(0.2)
+        self.assertEqual(self.batches, [[0, 1, 2], [3]])
+
+        stats = self.batcher.get_stats()
+        self.assertEqual(stats["delivered"], 4)
+        self.assertEqual(stats["batches"], 2)
+
+    def testStopFlush(self):
+        """
+        Queued items are delivered when stopping the batcher
+        """
+        self.batcher = threadpool.MicroBatcher(
+            self._consume, max_size=10, max_delay=60
+        )
+        self.batcher.put("a")
+        self.batcher.stop()
+        self.assertEqual(self.batches, [["a"]])
+
+        self.batcher.put("b")
+        self.batcher.stop(flush=False)
+        self.assertEqual(self.batches, [["a"]])
+        self.assertEqual(self.batcher.get_stats()["dropped"], 1)
+
+    def _fill(self, overflow):
+        """
+        Fills a batcher with a blocked consumer
+
+        :return: The results of the calls to put()
+        """
+        self.event.clear()
+        self.batcher = threadpool.MicroBatcher(
+            self._consume,
+            max_size=1,
+            max_delay=0,
+            queue_size=2,
+            overflow=overflow,
+        )
+
+        # The first item is being consumed, the next two are queued
+        results = [self.batcher.put(0)]
+        time.sleep(0.1)
+        results.extend(self.batcher.put(idx) for idx in range(1, 5))
+        return results
+
+    def testDropNew(self):
+        """
+        New items are dropped when the queue is full
+        """
+        results = self._fill(threadpool.OVERFLOW_DROP_NEW)
+        self.assertEqual(results, [True, True, True, False, False])
+        self.event.set()
+        self.batcher.stop()
+        self.assertEqual(self.batches, [[0], [1], [2]])
+        self.assertEqual(self.batcher.get_stats()["dropped"], 2)
+
+    def testDropOldest(self):
+        """
+        Oldest items are dropped when the queue is full
+        """
+        results = self._fill(threadpool.OVERFLOW_DROP_OLDEST)
+        self.assertEqual(results, [True] * 5)
+        self.event.set()
+        self.batcher.stop()
+        self.assertEqual(self.batches, [[0], [3], [4]])
+        self.assertEqual(self.batcher.get_stats()["dropped"], 2)
+
+    def testBlock(self):
+        """
+        Producers wait for room in the queue
+        """
+        threading.Timer(0.3, self.event.set).start()
+        start = time.time()
+        results = self._fill(threadpool.OVERFLOW_BLOCK)
+        self.assertGreaterEqual(time.time() - start, 0.25)
+        self.assertEqual(results, [True] * 5)
+        self.batcher.stop()
+        self.assertEqual(self.batches, [[idx] for idx in range(5)])
+
+    def testInvalid(self):
+        """
+        Invalid parameters are rejected
+        """
+        for kwargs in (
+            {"max_size": 0},
+            {"max_size": 10, "queue_size": 5},
+            {"max_delay": -1},
+            {"overflow": "unknown"},
+        ):
+            self.assertRaises(
+                ValueError, threadpool.MicroBatcher, self._consume, **kwargs
+            )
+
 
 # ------------------------------------------------------------------------------
 